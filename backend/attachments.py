@@ -0,0 +1,92 @@
+"""
+Support ticket attachments: streamed to disk, size-limited, content-addressed.
+
+Uploads are read in chunks and written by a worker thread, so a large file
+never sits in memory and the event loop is free between chunks. Files are
+stored under UPLOAD_DIR by the SHA-256 of their content
+(uploads/ab/ab34...), so the same screenshot attached to ten tickets is
+stored once.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+
+from fastapi.concurrency import run_in_threadpool
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "25")) * 1024 * 1024 # Gmail rejects larger attachments anyway
+CHUNK_SIZE = 1024 * 1024
+
+log = logging.getLogger("geotrack.attachments")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class StoredFile:
+    __slots__ = ("path", "sha256", "size", "name", "deduplicated")
+
+    def __init__(self, path, sha256, size, name, deduplicated):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.name = name
+        self.deduplicated = deduplicated
+
+
+def path_for(sha256):
+    return os.path.join(UPLOAD_DIR, sha256[:2], sha256)
+
+
+def _open_temp():
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=UPLOAD_DIR, prefix=".upload-")
+    return os.fdopen(fd, "wb"), tmp
+
+
+def _commit(tmp, sha256):
+    """Move a finished upload to its content address; drop it if that content is already stored"""
+    target = path_for(sha256)
+    if os.path.exists(target):
+        os.unlink(tmp)
+        return target, True
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(tmp, target) # atomic: readers never see a partial file at the final path
+    return target, False
+
+
+def _write(f, digest, chunk):
+    digest.update(chunk) # hashlib releases the GIL for large buffers, so hash off the event loop too
+    f.write(chunk)
+
+
+def _discard(f, tmp):
+    f.close()
+    if os.path.exists(tmp):
+        os.unlink(tmp)
+
+
+async def save_upload(upload, max_bytes=MAX_UPLOAD_BYTES):
+    """Stream an UploadFile into content-addressed storage. Raises UploadTooLarge past max_bytes."""
+    f, tmp = await run_in_threadpool(_open_temp)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(f"Attachment exceeds {max_bytes // (1024 * 1024)} MB")
+            await run_in_threadpool(_write, f, digest, chunk)
+        await run_in_threadpool(f.close)
+        path, deduplicated = await run_in_threadpool(_commit, tmp, digest.hexdigest())
+    except BaseException:
+        await run_in_threadpool(_discard, f, tmp)
+        raise
+    name = os.path.basename(upload.filename or "") or "attachment"
+    log.info("Attachment stored", extra={"sha256": digest.hexdigest(), "bytes": size, "deduplicated": deduplicated})
+    return StoredFile(path, digest.hexdigest(), size, name, deduplicated)
@@ -0,0 +1,242 @@
+"""
+API load-test and latency benchmark.
+
+Drives the FastAPI app with a mixed workload modeled on the dashboard's call
+pattern and reports p50/p95/p99 latency, throughput and DB statement counts
+per endpoint. Results are written as JSON so runs can be compared across
+commits.
+
+Usage (requires httpx):
+    python bench_api.py                                   # in-process ASGI, temporary seeded SQLite
+    python bench_api.py --url http://localhost:8000       # against a running uvicorn
+    python bench_api.py --output after.json --compare before.json
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, weight, method, path) - roughly what an open dashboard does over a session
+WORKLOAD = [
+    ("GET /vehicles", 30, "GET", "/vehicles"),
+    ("GET /notifications", 20, "GET", "/notifications"),
+    ("GET /analytics/cost", 10, "GET", "/analytics/cost"),
+    ("GET /analytics/cost-trend", 10, "GET", "/analytics/cost-trend?period=6M"),
+    ("GET /analytics/health", 10, "GET", "/analytics/health"),
+    ("GET /logs/{id}", 10, "GET", "/logs/{vehicle_id}"),
+    ("GET /settings/all", 5, "GET", "/settings/all"),
+    ("GET /analytics/logs", 3, "GET", "/analytics/logs"),
+    ("POST /auth/login", 2, "POST", "/auth/login"),
+]
+LOGIN = {"email": "admin@geotrack.pro", "password": "password123"}
+REGRESSION_THRESHOLD = 0.10 # flag p95/p99 slowdowns over 10% when comparing
+
+_query_counter = contextvars.ContextVar("bench_query_counter", default=None)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize(samples, elapsed):
+    latencies = [s["ms"] for s in samples]
+    queries = [s["queries"] for s in samples if s["queries"] is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if s["status"] >= 400 or s["status"] == 0),
+        "throughput_rps": round(len(samples) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "mean_ms": round(sum(latencies) / len(latencies), 2) if latencies else None,
+        "db_queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+async def run_workload(client, vehicle_ids, total, concurrency, rng, count_queries):
+    names = [w[0] for w in WORKLOAD]
+    weights = [w[1] for w in WORKLOAD]
+    by_name = {w[0]: w for w in WORKLOAD}
+    plan = rng.choices(names, weights, k=total)
+    ids = [rng.choice(vehicle_ids) if vehicle_ids else 1 for _ in range(total)]
+    samples = []
+    cursor = iter(range(total))
+
+    async def worker():
+        for i in cursor:
+            name = plan[i]
+            _, _, method, path = by_name[name]
+            path = path.format(vehicle_id=ids[i])
+            counter = [0] if count_queries else None
+            token = _query_counter.set(counter)
+            t0 = time.perf_counter()
+            try:
+                if method == "POST":
+                    response = await client.post(path, json=LOGIN)
+                else:
+                    response = await client.get(path)
+                await response.aread()
+                status = response.status_code
+            except Exception:
+                status = 0
+            finally:
+                _query_counter.reset(token)
+            samples.append({"name": name, "ms": (time.perf_counter() - t0) * 1000, "status": status,
+                            "queries": counter[0] if counter is not None else None})
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - t0
+
+
+async def bench(args):
+    import httpx
+
+    rng = random.Random(args.seed)
+    meta = {
+        "commit": git_commit(),
+        "db_async": os.getenv("DB_ASYNC", "") not in ("", "0"),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "mode": "http" if args.url else "asgi",
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "seed": args.seed,
+    }
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=60) as client:
+            vehicles = (await client.get("/vehicles")).json()
+            vehicle_ids = [v["id"] for v in vehicles]
+            meta["dataset"] = {"vehicles": len(vehicle_ids)}
+            await run_workload(client, vehicle_ids, args.warmup, args.concurrency, rng, False)
+            samples, elapsed = await run_workload(client, vehicle_ids, args.requests, args.concurrency, rng, False)
+        return meta, samples, elapsed
+
+    # In-process: seed a scratch database unless one was given
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not args.database_url:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='geotrack_bench_'), 'bench.db')}"
+    else:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    import database as db_mod
+    import main as app_main
+    from sqlalchemy import event, text
+
+    if not db_mod.init_db():
+        sys.exit(2)
+    with db_mod.engine.connect() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM vehicles")).scalar()
+    if not existing:
+        import generate_fleet
+        print(f"🌱 Seeding {args.vehicles:,} vehicles, {args.logs:,} logs...")
+        generate_fleet.generate(db_mod, args.vehicles, args.vehicles * 5, args.logs, seed=args.seed, progress=False)
+    with db_mod.engine.connect() as conn:
+        vehicle_ids = list(conn.execute(text("SELECT id FROM vehicles")).scalars())
+    meta["dataset"] = {"vehicles": len(vehicle_ids), "database": db_mod.engine.url.get_backend_name()}
+
+    def count_query(*_):
+        counter = _query_counter.get()
+        if counter is not None:
+            counter[0] += 1
+
+    async with app_main.lifespan(app_main.app):
+        app_main.seed_admin_user()
+        engines = [db_mod.engine] + ([db_mod.async_engine.sync_engine] if db_mod.async_engine is not None else [])
+        for eng in engines:
+            event.listen(eng, "before_cursor_execute", count_query)
+        transport = httpx.ASGITransport(app=app_main.app, root_path="")
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            await run_workload(client, vehicle_ids, args.warmup, args.concurrency, rng, True)
+            samples, elapsed = await run_workload(client, vehicle_ids, args.requests, args.concurrency, rng, True)
+        for eng in engines:
+            event.remove(eng, "before_cursor_execute", count_query)
+    return meta, samples, elapsed
+
+
+def compare(results, baseline):
+    print(f"\nComparison against {baseline['meta'].get('commit') or 'baseline'}:")
+    regressions = 0
+    for name, current in results["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if not before:
+            continue
+        parts = []
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if before.get(key) and current.get(key):
+                delta = (current[key] - before[key]) / before[key]
+                flag = ""
+                if key != "p50_ms" and delta > REGRESSION_THRESHOLD:
+                    flag = " ⚠️"
+                    regressions += 1
+                parts.append(f"{key[:3]} {delta:+.0%}{flag}")
+        print(f"   {name:<28} {'  '.join(parts)}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API latency and throughput with a dashboard-like workload")
+    parser.add_argument("--url", help="Benchmark a running server instead of the in-process app")
+    parser.add_argument("--database-url", help="In-process mode: database to use (default: temporary seeded SQLite)")
+    parser.add_argument("--vehicles", type=int, default=500, help="Fleet size when seeding a scratch database")
+    parser.add_argument("--logs", type=int, default=50000, help="Maintenance logs when seeding a scratch database")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results JSON here (default: bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="Baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    meta, samples, elapsed = asyncio.run(bench(args))
+
+    endpoints = {}
+    for name, *_ in WORKLOAD:
+        endpoint_samples = [s for s in samples if s["name"] == name]
+        if endpoint_samples:
+            endpoints[name] = summarize(endpoint_samples, elapsed)
+    results = {"meta": meta, "total": summarize(samples, elapsed), "endpoints": endpoints}
+
+    print(f"\n{'endpoint':<28} {'reqs':>6} {'err':>4} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8}")
+    for name, r in list(endpoints.items()) + [("TOTAL", results["total"])]:
+        queries = r["db_queries_per_request"] if r["db_queries_per_request"] is not None else "-"
+        print(f"{name:<28} {r['requests']:>6} {r['errors']:>4} {r['throughput_rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {queries:>8}")
+
+    output = args.output or os.path.join("bench_results", f"{meta['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n📄 Results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f))
+        if regressions:
+            print(f"⚠️ {regressions} tail latency regression(s) over {REGRESSION_THRESHOLD:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Response encoding benchmark.
+
+For the large list endpoints, reports the payload size of every negotiable
+format (JSON or MessagePack, each plain, gzip and brotli) together with what it
+costs: serializing and compressing on the server, decompressing and parsing on
+the client, and the end-to-end request time through the app with those
+Accept / Accept-Encoding headers. Results are written as JSON so runs can be
+compared across commits.
+
+Usage (requires httpx; brotli and msgpack rows need those packages):
+    python bench_encoding.py                              # in-process ASGI, temporary seeded SQLite
+    python bench_encoding.py --vehicles 2000 --logs 100000
+    python bench_encoding.py --database-url postgresql://... --repeat 50
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bench_api import git_commit, percentile
+
+ENDPOINTS = [
+    ("GET /vehicles", "/vehicles"),
+    ("GET /analytics/logs", "/analytics/logs"),
+]
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+# (name, Accept, Accept-Encoding)
+FORMATS = [
+    ("json", JSON, "identity"),
+    ("json+gzip", JSON, "gzip"),
+    ("json+br", JSON, "br"),
+    ("msgpack", MSGPACK, "identity"),
+    ("msgpack+gzip", MSGPACK, "gzip"),
+    ("msgpack+br", MSGPACK, "br"),
+]
+
+
+def timed(fn, repeat):
+    """Median ms of fn() over repeat runs, and its last result"""
+    samples, result = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return round(percentile(samples, 50), 3), result
+
+
+def codec(fmt, coding):
+    """(serialize, deserialize) between Python values and the wire bytes of one format"""
+    import response_encoding
+
+    if fmt == MSGPACK:
+        import msgpack
+        dump, load = (lambda value: msgpack.packb(value, use_bin_type=True)), msgpack.unpackb
+    else:
+        dump, load = (lambda value: json.dumps(value, separators=(",", ":")).encode()), json.loads
+    if coding == "identity":
+        return dump, load
+    if coding == "br":
+        import brotli
+        decompress = brotli.decompress
+    else:
+        decompress = gzip.decompress
+    return (lambda value: response_encoding.compress(dump(value), coding)), (lambda body: load(decompress(body)))
+
+
+def available(accept, coding):
+    import response_encoding
+    if accept == MSGPACK and response_encoding.msgpack is None:
+        return False
+    return coding in ("identity", *response_encoding.CODINGS)
+
+
+async def measure(client, path, repeat):
+    """{format name: stats} for one endpoint"""
+    baseline = await client.get(path, headers={"Accept": JSON, "Accept-Encoding": "identity"})
+    baseline.raise_for_status()
+    value = baseline.json()
+    json_size = len(baseline.content)
+    results = {}
+    for name, accept, coding in FORMATS:
+        if not available(accept, coding):
+            continue
+        headers = {"Accept": accept, "Accept-Encoding": coding}
+        latencies, size = [], None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            async with client.stream("GET", path, headers=headers) as response:
+                raw = b"".join([chunk async for chunk in response.aiter_raw()])
+            latencies.append((time.perf_counter() - t0) * 1000)
+            size = len(raw)
+            content_encoding = response.headers.get("content-encoding", "identity")
+            content_type = response.headers.get("content-type", "")
+        # The server may decline (e.g. below COMPRESS_MIN_BYTES); report what was actually sent
+        served = f"{'msgpack' if content_type.startswith(MSGPACK) else 'json'}" + \
+                 ("" if content_encoding == "identity" else f"+{content_encoding}")
+        serialize, deserialize = codec(MSGPACK if content_type.startswith(MSGPACK) else JSON, content_encoding)
+        serialize_ms, body = timed(lambda: serialize(value), repeat)
+        parse_ms, _ = timed(lambda: deserialize(body), repeat)
+        results[name] = {
+            "served": served,
+            "bytes": size,
+            "ratio": round(size / json_size, 3) if json_size else None,
+            "serialize_ms": serialize_ms,
+            "parse_ms": parse_ms,
+            "request_p50_ms": round(percentile(latencies, 50), 2),
+        }
+    return results
+
+
+async def bench(args):
+    import httpx
+
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    if not args.database_url:
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='geotrack_bench_'), 'bench.db')}"
+    else:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    import database as db_mod
+    import main as app_main
+    from sqlalchemy import text
+
+    if not db_mod.init_db():
+        sys.exit(2)
+    with db_mod.engine.connect() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM vehicles")).scalar()
+    if not existing:
+        import generate_fleet
+        print(f"🌱 Seeding {args.vehicles:,} vehicles, {args.logs:,} logs...")
+        generate_fleet.generate(db_mod, args.vehicles, args.vehicles * 5, args.logs, seed=args.seed, progress=False)
+    with db_mod.engine.connect() as conn:
+        dataset = {"vehicles": conn.execute(text("SELECT COUNT(*) FROM vehicles")).scalar(),
+                   "logs": conn.execute(text("SELECT COUNT(*) FROM maintenance_logs")).scalar(),
+                   "database": db_mod.engine.url.get_backend_name()}
+
+    results = {}
+    async with app_main.lifespan(app_main.app):
+        transport = httpx.ASGITransport(app=app_main.app, root_path="")
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for name, path in ENDPOINTS:
+                results[name] = await measure(client, path, args.repeat)
+    meta = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "dataset": dataset,
+    }
+    return {"meta": meta, "endpoints": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark payload size and encoding cost per response format")
+    parser.add_argument("--database-url", help="Database to use (default: temporary seeded SQLite)")
+    parser.add_argument("--vehicles", type=int, default=500, help="Fleet size when seeding a scratch database")
+    parser.add_argument("--logs", type=int, default=20000, help="Maintenance logs when seeding a scratch database")
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per measurement (medians are reported)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results JSON here (default: bench_results/encoding-<commit>.json)")
+    args = parser.parse_args()
+
+    results = asyncio.run(bench(args))
+
+    for endpoint, formats in results["endpoints"].items():
+        print(f"\n{endpoint}")
+        print(f"   {'format':<14} {'served':<14} {'bytes':>11} {'ratio':>7} {'serialize':>10} {'parse':>9} {'request':>9}")
+        for name, r in formats.items():
+            print(f"   {name:<14} {r['served']:<14} {r['bytes']:>11,} {r['ratio']:>7} {r['serialize_ms']:>8}ms "
+                  f"{r['parse_ms']:>7}ms {r['request_p50_ms']:>7}ms")
+
+    output = args.output or os.path.join("bench_results", f"encoding-{results['meta']['commit'] or 'local'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n📄 Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Sync pipeline benchmark against the local Geotab stub.
+
+For each fleet size, seeds a scratch SQLite database and a matching telemetry
+file, points sync_service at geotab_stub.py and runs sync_vehicles,
+sync_status_data and check_maintenance_alerts, reporting wall time, Geotab
+API calls and DB statements per phase.
+
+Usage:
+    python bench_sync.py                                  # 100, 1k and 10k vehicles
+    python bench_sync.py --sizes 1000 --latency-ms 40 --error-rate 0.01 --output sync.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_size(size, args, stub_mod, gen_mod):
+    import database as db_mod
+    import sync_service
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.orm import sessionmaker
+
+    # Fresh scratch database per size, swapped into the shared database module
+    workdir = tempfile.mkdtemp(prefix=f"geotrack_sync_{size}_")
+    db_mod.engine = create_engine(f"sqlite:///{os.path.join(workdir, 'sync.db')}", **db_mod.engine_args)
+    db_mod.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_mod.engine)
+    db_mod._schema_ready = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        db_mod.init_db()
+
+    telemetry = os.path.join(workdir, "telemetry.jsonl")
+    gen_mod.generate(db_mod, size, size * 3, size * 10, seed=args.seed, telemetry_out=telemetry,
+                     telemetry_days=args.telemetry_days, progress=False)
+
+    stub = stub_mod.GeotabStub(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rps, seed=args.seed)
+    stub.load_telemetry(telemetry)
+    if args.new_devices:
+        stub.add_synthetic_devices(int(size * args.new_devices), first_id=size + 1)
+    server, url = stub_mod.serve(stub)
+    sync_service.GEOTAB_SERVER = url
+
+    statements = [0]
+
+    def count_statement(*_):
+        statements[0] += 1
+
+    event.listen(db_mod.engine, "before_cursor_execute", count_statement)
+    phases = {}
+    try:
+        db = db_mod.SessionLocal()
+        api = None
+        for name, phase in (
+            ("authenticate", lambda: sync_service.get_geotab_api()),
+            ("authenticate_cached", lambda: sync_service.get_geotab_api()),
+            ("sync_vehicles", lambda: sync_service.sync_vehicles(api, db)),
+            ("sync_status_data", lambda: sync_service.sync_status_data(api, db)),
+            ("check_maintenance_alerts", lambda: sync_service.check_maintenance_alerts(db)),
+        ):
+            stub.reset_counters()
+            statements[0] = 0
+            t0 = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = phase()
+            elapsed = time.perf_counter() - t0
+            if name.startswith("authenticate"):
+                api = result
+            phases[name] = {
+                "wall_s": round(elapsed, 3),
+                "api_calls": sum(v for k, v in stub.calls.items() if ":" not in k),
+                "api_errors": sum(stub.errors.values()),
+                "db_statements": statements[0],
+            }
+        db.close()
+    finally:
+        event.remove(db_mod.engine, "before_cursor_execute", count_statement)
+        server.shutdown()
+        db_mod.engine.dispose()
+    return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Geotab sync pipeline against a local stub")
+    parser.add_argument("--sizes", default="100,1000,10000", help="Comma-separated fleet sizes")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated Geotab round-trip latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rps", type=int, default=0)
+    parser.add_argument("--new-devices", type=float, default=0.01, help="Fraction of the fleet that is new in Geotab")
+    parser.add_argument("--telemetry-days", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results JSON here")
+    args = parser.parse_args()
+
+    # Never send real alert emails or talk to the real Geotab while benchmarking
+    os.environ.pop("EMAIL_USER", None)
+    os.environ.setdefault("GEOTAB_USER", "bench@example.com")
+    os.environ.setdefault("GEOTAB_PASSWORD", "bench")
+    os.environ.setdefault("GEOTAB_DATABASE", "bench")
+    os.environ["GEOTAB_SESSION_FILE"] = "" # keep stub sessions out of the real session file
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='geotrack_sync_'), 'unused.db')}"
+
+    import geotab_stub
+    import generate_fleet
+    import email_utils
+    email_utils.EMAIL_USER = None
+
+    results = {"meta": {"timestamp": datetime.utcnow().isoformat() + "Z", "latency_ms": args.latency_ms,
+                        "error_rate": args.error_rate, "throttle_rps": args.throttle_rps}, "sizes": {}}
+    print(f"{'vehicles':>9}  {'phase':<26} {'wall s':>9} {'api calls':>10} {'api err':>8} {'db stmts':>9}")
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        phases = run_size(size, args, geotab_stub, generate_fleet)
+        results["sizes"][str(size)] = phases
+        for name, r in phases.items():
+            print(f"{size:>9}  {name:<26} {r['wall_s']:>9} {r['api_calls']:>10} {r['api_errors']:>8} {r['db_statements']:>9}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n📄 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
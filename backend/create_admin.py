@@ -1,5 +1,6 @@
 import os
-from database import SessionLocal, User
+import database
+from database import User
 from passlib.context import CryptContext
 from dotenv import load_dotenv
 
@@ -8,7 +9,8 @@ load_dotenv()
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 
 def create_admin(email, password, name):
-    db = SessionLocal()
+    database.init_db()
+    db = database.SessionLocal()
     try:
         # Check if user exists
         existing = db.query(User).filter(User.email == email).first()
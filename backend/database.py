@@ -1,9 +1,12 @@
 import os
+import logging
+import contextvars
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, create_engine
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Boolean, Index, create_engine, event, exists, select
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import Session, sessionmaker, relationship, with_loader_criteria
 from sqlalchemy.pool import NullPool
 
 load_dotenv()
@@ -26,7 +29,7 @@ if is_sqlite:
 
 # Handle Vercel's read-only filesystem by using in-memory SQLite if no DATABASE_URL is provided
 if is_sqlite and "maintenance.db" in SQLALCHEMY_DATABASE_URL and os.environ.get("VERCEL"):
-    print("WARNING: Running on Vercel without DATABASE_URL. Switching to in-memory SQLite.")
+    logging.getLogger("geotrack.db").warning("Running on Vercel without DATABASE_URL. Switching to in-memory SQLite.")
     SQLALCHEMY_DATABASE_URL = "sqlite:///:memory:"
 
 if "postgresql" in SQLALCHEMY_DATABASE_URL:
@@ -44,48 +47,142 @@ if "postgresql" in SQLALCHEMY_DATABASE_URL:
 engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_args)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Optional asyncio engine for the read-heavy API endpoints (DB_ASYNC=1, needs asyncpg or aiosqlite)
+DB_ASYNC = os.getenv("DB_ASYNC", "").lower() in ("1", "true", "yes")
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+async_engine = None
+AsyncSessionLocal = None
+
 Base = declarative_base()
 
+DEFAULT_TENANT = 1 # the tenant every deployment starts with (and every row from before tenants existed)
+
+class Tenant(Base):
+    # One Geotab database synced by this deployment (see tenants.py)
+    __tablename__ = "tenants"
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True) # e.g. "north": the X-Tenant header value and its settings' prefix
+    name = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class Vehicle(Base):
     __tablename__ = "vehicles"
+    __table_args__ = (Index("ux_vehicles_tenant_geotab_id", "tenant_id", "geotab_id", unique=True),)
     id = Column(Integer, primary_key=True, index=True)
-    geotab_id = Column(String, unique=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False, default=DEFAULT_TENANT, index=True)
+    geotab_id = Column(String, index=True) # unique within its tenant: Geotab ids repeat across databases
     name = Column(String)
     vin = Column(String, nullable=True)
     current_mileage = Column(Float, default=0.0)
     current_hours = Column(Float, default=0.0)
     last_sync = Column(DateTime, default=datetime.utcnow)
+    deleted_at = Column(DateTime, nullable=True, index=True) # soft-deleted, waiting for the purger (see purger.py)
     
     schedules = relationship("MaintenanceSchedule", back_populates="vehicle")
 
+class MaintenanceTask(Base):
+    """Reusable task definition (template) that schedules and logs reference by id"""
+    __tablename__ = "maintenance_tasks"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True, index=True)
+    tracking_type = Column(String) # "miles", "hours", "time"
+    interval_value = Column(Float)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    thresholds = relationship("TaskThreshold", primaryjoin="MaintenanceTask.id == TaskThreshold.task_id",
+                              order_by="TaskThreshold.value", lazy="selectin", cascade="all, delete-orphan")
+
+class TaskThreshold(Base):
+    """One alert threshold, owned by a task template or (as a per-vehicle override) by a schedule"""
+    __tablename__ = "task_thresholds"
+    id = Column(Integer, primary_key=True, index=True)
+    task_id = Column(Integer, ForeignKey("maintenance_tasks.id"), nullable=True, index=True)
+    schedule_id = Column(Integer, ForeignKey("maintenance_schedules.id"), nullable=True, index=True)
+    value = Column(Float)
+
 class MaintenanceSchedule(Base):
     __tablename__ = "maintenance_schedules"
     id = Column(Integer, primary_key=True, index=True)
-    vehicle_id = Column(Integer, ForeignKey("vehicles.id"))
-    task_name = Column(String)
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), index=True)
+    task_id = Column(Integer, ForeignKey("maintenance_tasks.id"), nullable=True, index=True)
+    task_name = Column(String) # copy of the task's name, for display
     tracking_type = Column(String) # "miles", "hours", "time"
-    interval_value = Column(Float)
-    alert_thresholds = Column(String) # comma-separated
+    interval_override = Column("interval_value", Float, nullable=True) # NULL follows the task
     last_performed_value = Column(Float, default=0.0)
     last_performed_date = Column(DateTime, default=datetime.utcnow)
     last_alerted_at = Column(DateTime, nullable=True) # Prevent spamming
-    is_active = Column(Boolean, default=True)
+    is_active = Column(Boolean, default=True, index=True)
+    own_thresholds = Column(Boolean, default=False, nullable=False) # threshold_overrides apply even when empty (alerts cleared)
 
     vehicle = relationship("Vehicle", back_populates="schedules")
+    task = relationship("MaintenanceTask", lazy="joined")
+    threshold_overrides = relationship("TaskThreshold", primaryjoin="MaintenanceSchedule.id == TaskThreshold.schedule_id",
+                                       order_by="TaskThreshold.value", lazy="joined", cascade="all, delete-orphan")
+    # Overrides are joined (they only add rows for the few schedules that have them); the
+    # task's thresholds are one selectin query over a handful of task ids
+
+    # The task's interval and thresholds apply unless this vehicle overrides them,
+    # so changing a task is one row update for every schedule that follows it.
+    @property
+    def interval_value(self):
+        if self.interval_override is not None or self.task is None:
+            return self.interval_override
+        return self.task.interval_value
+
+    @interval_value.setter
+    def interval_value(self, value):
+        self.interval_override = value
+
+    @property
+    def thresholds(self):
+        """Alert thresholds as floats, ascending"""
+        own = self.own_thresholds or self.threshold_overrides
+        rows = self.threshold_overrides if own else (self.task.thresholds if self.task is not None else [])
+        return tuple(t.value for t in rows)
+
+    @property
+    def alert_thresholds(self):
+        # The API's comma-separated form
+        return format_thresholds(self.thresholds)
+
+    @alert_thresholds.setter
+    def alert_thresholds(self, text):
+        self.threshold_overrides = [TaskThreshold(value=v) for v in parse_thresholds(text)]
+        self.own_thresholds = True
 
 class MaintenanceLog(Base):
     __tablename__ = "maintenance_logs"
     id = Column(Integer, primary_key=True, index=True)
-    vehicle_id = Column(Integer, ForeignKey("vehicles.id"))
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), index=True)
+    task_id = Column(Integer, ForeignKey("maintenance_tasks.id"), nullable=True, index=True)
     task_name = Column(String)
     performed_at_mileage = Column(Float)
     performed_at_hours = Column(Float)
-    performed_date = Column(DateTime, default=datetime.utcnow)
+    performed_date = Column(DateTime, default=datetime.utcnow, index=True)
     cost = Column(Float, default=0.0)
     notes = Column(String, nullable=True)
 
     vehicle = relationship("Vehicle")
 
+def parse_thresholds(text):
+    """"4500, 4800" -> [4500.0, 4800.0]; raises ValueError on anything that is not a non-negative number"""
+    values = []
+    for part in (text or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            value = float(part)
+        except ValueError:
+            raise ValueError(f"alert threshold {part!r} is not a number")
+        if value < 0:
+            raise ValueError(f"alert threshold {part} is negative")
+        values.append(value)
+    return sorted(set(values))
+
+def format_thresholds(values):
+    return ",".join(f"{v:g}" for v in values)
+
 class Setting(Base):
     __tablename__ = "settings"
     key = Column(String, primary_key=True)
@@ -97,8 +194,8 @@ class Notification(Base):
     title = Column(String)
     message = Column(String)
     type = Column(String, default="info") # info, warning, error
-    is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    is_read = Column(Boolean, default=False, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 class User(Base):
     __tablename__ = "users"
@@ -113,7 +210,7 @@ class LoginLog(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     email = Column(String)
-    login_time = Column(DateTime, default=datetime.utcnow)
+    login_time = Column(DateTime, default=datetime.utcnow, index=True)
     
     user = relationship("User")
 
@@ -124,20 +221,189 @@ class SupportTicket(Base):
     issue_type = Column(String)
     impact_count = Column(String)
     description = Column(String)
-    attachment_filename = Column(String, nullable=True)
+    attachment_filename = Column(String, nullable=True) # stored path
+    attachment_name = Column(String, nullable=True) # name as uploaded
+    attachment_sha256 = Column(String, nullable=True)
+    attachment_size = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-try:
-    Base.metadata.create_all(bind=engine)
-except Exception as e:
-    print(f"Error creating database tables: {e}")
-    # Fallback to in-memory if we failed (likely read-only FS)
-    if "readonly" in str(e).lower() or "attempt to write a readonly database" in str(e).lower() or "permission denied" in str(e).lower() or "unable to open database" in str(e).lower():
-         print("Fallback to in-memory SQLite due to read-only filesystem")
-         # Re-create engine and session for in-memory
-         engine = create_engine("sqlite:///:memory:", **engine_args)
-         SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-         Base.metadata.create_all(bind=engine)
+class SchedulerLease(Base):
+    __tablename__ = "scheduler_leases"
+    name = Column(String, primary_key=True) # e.g. "alerts", "sync:0/4"
+    holder = Column(String)
+    acquired_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime)
+
+class SettingsVersion(Base):
+    __tablename__ = "settings_version"
+    id = Column(Integer, primary_key=True) # single row, id 1
+    version = Column(Integer, default=0) # bumped on every settings write so other processes reload
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class FleetVersion(Base):
+    __tablename__ = "fleet_version"
+    id = Column(Integer, primary_key=True) # single row, id 1
+    version = Column(Integer, default=0) # bumped on every vehicle/schedule write so other processes rebuild their fleet snapshot
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class SyncHeartbeat(Base):
+    __tablename__ = "sync_heartbeats"
+    scope = Column(String, primary_key=True) # sync lease the cycle ran under, e.g. "sync", "sync:0/4"
+    synced_at = Column(DateTime)
+    vehicles = Column(Integer, default=0) # in scope
+    polled = Column(Integer, default=0)
+    changed = Column(Integer, default=0) # rows actually written
+
+class PurgeJob(Base):
+    __tablename__ = "purge_jobs"
+    vehicle_id = Column(Integer, primary_key=True) # no FK: the vehicle row is the last thing deleted
+    requested_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    rows_total = Column(Integer, nullable=True) # dependent rows counted when the purge started
+    rows_deleted = Column(Integer, default=0)
+    error = Column(String, nullable=True)
+
+class FleetGroup(Base):
+    # Geotab group (region, depot, division...), synced with its place in the hierarchy (see groups.py)
+    __tablename__ = "fleet_groups"
+    __table_args__ = (Index("ux_fleet_groups_tenant_geotab_id", "tenant_id", "geotab_id", unique=True),)
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, ForeignKey("tenants.id"), nullable=False, default=DEFAULT_TENANT, index=True)
+    geotab_id = Column(String, index=True) # e.g. "GroupCompanyId", "b27A"; every tenant has its own tree
+    name = Column(String)
+    parent_id = Column(Integer, ForeignKey("fleet_groups.id"), nullable=True, index=True)
+    synced_at = Column(DateTime, default=datetime.utcnow)
+
+class GroupClosure(Base):
+    # One row per (ancestor, descendant) pair, including each group with itself at depth 0
+    __tablename__ = "group_closure"
+    ancestor_id = Column(Integer, ForeignKey("fleet_groups.id"), primary_key=True)
+    descendant_id = Column(Integer, ForeignKey("fleet_groups.id"), primary_key=True, index=True)
+    depth = Column(Integer, default=0)
+
+class VehicleGroup(Base):
+    # Groups Geotab assigns a device to directly; the ancestors come from group_closure
+    __tablename__ = "vehicle_groups"
+    id = Column(Integer, primary_key=True) # lets the purger delete in batches like any other table
+    vehicle_id = Column(Integer, ForeignKey("vehicles.id"), index=True)
+    group_id = Column(Integer, ForeignKey("fleet_groups.id"), index=True)
+
+class GroupStats(Base):
+    # Cached aggregates over every vehicle under a group (see groups.py for how they are kept)
+    __tablename__ = "group_stats"
+    group_id = Column(Integer, ForeignKey("fleet_groups.id"), primary_key=True)
+    vehicles = Column(Integer, default=0)
+    total_cost = Column(Float, default=0.0)
+    log_count = Column(Integer, default=0)
+    due_count = Column(Integer, default=0) # active schedules past their interval
+    serviced_30d = Column(Integer, default=0) # vehicles with a log in the last 30 days
+    stale = Column(Boolean, default=True) # membership or telemetry changed since refreshed_at
+    refreshed_at = Column(DateTime, nullable=True)
+
+class SchemaVersion(Base):
+    __tablename__ = "schema_version"
+    version = Column(Integer, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+_schema_ready = False
+
+# --- SOFT DELETE ---
+# Every ORM SELECT hides soft-deleted vehicles and their schedules and logs.
+# Pass .execution_options(include_deleted=True) to see them (the purger works
+# on Core statements, which this hook does not touch).
+
+def _vehicle_deleted(vehicle_id):
+    # Own alias so it never correlates with (or gets filtered like) a vehicles join in the outer query
+    deleted = Vehicle.__table__.alias("deleted_vehicle")
+    return exists().where(deleted.c.id == vehicle_id, deleted.c.deleted_at.isnot(None))
+
+@event.listens_for(Session, "do_orm_execute")
+def _hide_deleted(state):
+    if (state.is_select and not state.is_column_load and not state.is_relationship_load
+            and not state.execution_options.get("include_deleted", False)):
+        state.statement = state.statement.options(
+            with_loader_criteria(Vehicle, lambda cls: cls.deleted_at.is_(None), include_aliases=True),
+            with_loader_criteria(MaintenanceSchedule, lambda cls: ~_vehicle_deleted(cls.vehicle_id), include_aliases=True),
+            with_loader_criteria(MaintenanceLog, lambda cls: ~_vehicle_deleted(cls.vehicle_id), include_aliases=True),
+        )
+
+# --- TENANTS ---
+# Inside tenant_scope(tenant_id) (the API enters it for requests with an X-Tenant
+# header) every ORM SELECT sees only that tenant's vehicles, their schedules and
+# logs, and its groups. Outside it, and with .execution_options(all_tenants=True),
+# queries see every tenant as before. Core statements are not touched: the sync
+# and groups.py pass the tenant explicitly.
+
+_tenant = contextvars.ContextVar("geotrack_tenant", default=None)
+
+def current_tenant():
+    """Tenant id selected for this request or task, or None for all tenants"""
+    return _tenant.get()
+
+@contextmanager
+def tenant_scope(tenant_id):
+    token = _tenant.set(tenant_id)
+    try:
+        yield tenant_id
+    finally:
+        _tenant.reset(token)
+
+def _vehicle_in_tenant(vehicle_id, tenant_id):
+    vehicles = Vehicle.__table__ # the table, so the Vehicle criteria doesn't apply to the subquery as well
+    return vehicle_id.in_(select(vehicles.c.id).where(vehicles.c.tenant_id == tenant_id))
+
+@event.listens_for(Session, "do_orm_execute")
+def _scope_tenant(state):
+    tenant_id = _tenant.get()
+    if (tenant_id is not None and state.is_select and not state.is_column_load and not state.is_relationship_load
+            and not state.execution_options.get("all_tenants", False)):
+        state.statement = state.statement.options(
+            with_loader_criteria(Vehicle, lambda cls: cls.tenant_id == tenant_id, include_aliases=True),
+            with_loader_criteria(MaintenanceSchedule, lambda cls: _vehicle_in_tenant(cls.vehicle_id, tenant_id), include_aliases=True),
+            with_loader_criteria(MaintenanceLog, lambda cls: _vehicle_in_tenant(cls.vehicle_id, tenant_id), include_aliases=True),
+            with_loader_criteria(FleetGroup, lambda cls: cls.tenant_id == tenant_id, include_aliases=True),
+        )
+
+def is_readonly_error(e):
+    msg = str(e).lower()
+    return "readonly" in msg or "attempt to write a readonly database" in msg or "permission denied" in msg or "unable to open database" in msg
+
+def use_memory_fallback():
+    """Re-create engine and session for in-memory SQLite (e.g. read-only filesystem)"""
+    global engine, SessionLocal
+    engine = create_engine("sqlite:///:memory:", **engine_args)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def init_async_engine():
+    """Create the asyncio engine for the current database URL. Returns it, or None if it can't be used."""
+    global async_engine, AsyncSessionLocal
+    if async_engine is not None:
+        return async_engine
+    url = engine.url
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}")
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        # A second engine would open its own, empty in-memory database
+        return None
+
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+    async_args = {}
+    if backend == "postgresql":
+        async_args = {"pool_pre_ping": True, "pool_recycle": 300, "connect_args": {"timeout": 5}}
+    async_engine = create_async_engine(url.set(drivername=ASYNC_DRIVERS[backend]), **async_args)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    return async_engine
+
+def init_db():
+    """Bring the schema up to date once per process (see migrations.py)"""
+    global _schema_ready
+    if _schema_ready:
+        return True
+    import migrations
+    _schema_ready = migrations.upgrade()
+    return _schema_ready
 
 def get_db():
     db = SessionLocal()
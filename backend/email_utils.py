@@ -1,44 +1,110 @@
+import io
 import os
+import re
+import uuid
+import base64
+import logging
 import smtplib
+from email.generator import BytesGenerator
+from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from email.mime.application import MIMEApplication
+from email.utils import formatdate, make_msgid
 from typing import Optional
 
-# Configuration
+import log_config
+import metrics
+
+log = logging.getLogger("geotrack.email")
+
+# Configuration (defaults; the Settings page overrides them)
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASS = os.getenv("EMAIL_PASS")
 
-def send_email_notification(subject: str, body: str, attachment_path: Optional[str] = None):
+def email_credentials():
+    """(user, password), re-read from the cached settings so UI changes apply without a restart"""
+    # Imported here so importing this module doesn't pull in the database layer
+    import settings_service
+    return (settings_service.get_str("EMAIL_USER", EMAIL_USER, env=()),
+            settings_service.get_str("EMAIL_PASS", EMAIL_PASS, env=()))
+
+# 57 raw bytes encode to one 76-character base64 line, so whole chunks never split a line
+ATTACHMENT_CHUNK = 57 * 1024
+
+def _send_streaming(server, msg, sender, recipient, attachment_path, attachment_name):
+    """SMTP DATA with the attachment base64-encoded from disk chunk by chunk instead of held in memory.
+
+    msg carries a placeholder as the attachment payload; everything before and
+    after it is generated by the email package as usual.
+    """
+    marker = f"@@attachment-{uuid.uuid4().hex}@@"
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(marker)
+    part["Content-Transfer-Encoding"] = "base64"
+    part.add_header("Content-Disposition", "attachment", filename=attachment_name)
+    msg.attach(part)
+    buffer = io.BytesIO()
+    BytesGenerator(buffer, policy=msg.policy.clone(linesep="\r\n")).flatten(msg) # as smtplib.send_message does
+    head, tail = buffer.getvalue().split(marker.encode(), 1)
+    # Headers and base64 never start a line with '.', but stuff periods anyway as DATA requires
+    head, tail = (re.sub(rb"(?m)^\.", b"..", chunk) for chunk in (head, tail))
+
+    server.ehlo_or_helo_if_needed()
+    server.mail(sender)
+    server.rcpt(recipient)
+    server.putcmd("data")
+    code, reply = server.getreply()
+    if code != 354:
+        server.rset()
+        raise smtplib.SMTPDataError(code, reply)
+    server.send(head)
+    with open(attachment_path, "rb") as f:
+        while chunk := f.read(ATTACHMENT_CHUNK):
+            server.send(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+    server.send(tail.lstrip(b"\r\n") + (b"" if tail.endswith(b"\r\n") else b"\r\n") + b".\r\n")
+    code, reply = server.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, reply)
+
+def send_email_notification(subject: str, body: str, attachment_path: Optional[str] = None,
+                            attachment_name: Optional[str] = None):
     """
     Sends a generic email notification via Gmail SMTP.
+    Blocks for the whole SMTP session; call it from a worker thread or background task.
     """
-    if not EMAIL_USER or not EMAIL_PASS:
-        print("WARNING: Email credentials not set. Skipping email.")
+    email_user, email_pass = email_credentials()
+    if not email_user or not email_pass:
+        log.warning("Email credentials not set, skipping email", extra=log_config.sampled(50, subject=subject))
+        metrics.EMAILS.inc("skipped")
         return False
 
+    metrics.EMAIL_QUEUE_DEPTH.inc()
     try:
         msg = MIMEMultipart()
-        msg['From'] = EMAIL_USER
-        msg['To'] = EMAIL_USER # Admin receives all notifications for now
+        msg['From'] = email_user
+        msg['To'] = email_user # Admin receives all notifications for now
         msg['Subject'] = subject
+        msg['Date'] = formatdate(localtime=True)
+        msg['Message-ID'] = make_msgid()
 
-        msg.attach(MIMEText(body, 'plain'))
-
-        if attachment_path and os.path.exists(attachment_path):
-            with open(attachment_path, "rb") as f:
-                part = MIMEApplication(f.read(), Name=os.path.basename(attachment_path))
-            part['Content-Disposition'] = f'attachment; filename="{os.path.basename(attachment_path)}"'
-            msg.attach(part)
+        msg.attach(MIMEText(body, 'plain', 'utf-8'))
 
         # Connect to Gmail SMTP
         with smtplib.SMTP_SSL('smtp.gmail.com', 465) as server:
-            server.login(EMAIL_USER, EMAIL_PASS)
-            server.send_message(msg)
+            server.login(email_user, email_pass)
+            if attachment_path and os.path.exists(attachment_path):
+                _send_streaming(server, msg, email_user, email_user, attachment_path,
+                                attachment_name or os.path.basename(attachment_path))
+            else:
+                server.send_message(msg)
             
-        print(f"SUCCESS: Email sent to {EMAIL_USER}")
+        log.info("Email sent", extra={"to": email_user, "subject": subject})
+        metrics.EMAILS.inc("sent")
         return True
 
     except Exception as e:
-        print(f"ERROR: Failed to send email: {e}")
+        log.error("Failed to send email: %s", e, extra={"subject": subject})
+        metrics.EMAILS.inc("failed")
         return False
+    finally:
+        metrics.EMAIL_QUEUE_DEPTH.dec()
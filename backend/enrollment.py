@@ -0,0 +1,234 @@
+"""
+Bulk vehicle enrollment and schedule assignment.
+
+A batch is validated as a whole before anything is written: every item is
+checked against the others (duplicate Geotab IDs, duplicate tasks) and against
+the database with one IN query per table, and each item gets its own result
+entry. Valid items are then inserted with bulk INSERT ... RETURNING in the
+caller's transaction, so a 500-truck division is a handful of statements and
+one commit instead of thousands of requests.
+
+With atomic=True (the default) one invalid item rejects the whole batch and
+nothing is written; with atomic=False the valid items are inserted and the
+invalid ones are reported.
+"""
+import logging
+import os
+
+from sqlalchemy import insert, select
+
+import database as db_mod
+import tasks
+from database import parse_thresholds
+
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "1000")) # per request
+TRACKING_TYPES = ("miles", "hours", "time")
+
+# Every new vehicle starts with a schedule for this task (API, bulk enrollment and Geotab sync):
+# (name, tracking type, interval, thresholds), created on first use
+DEFAULT_TASK = ("Oil Change", "miles", 5000.0, [4500.0, 4800.0])
+
+log = logging.getLogger("geotrack.enrollment")
+
+
+class BatchTooLarge(ValueError):
+    pass
+
+
+class BatchResult:
+    """Per-item outcome of a bulk request, in request order"""
+
+    def __init__(self, size):
+        self.results = [{"index": i, "status": "created", "id": None, "error": None} for i in range(size)]
+
+    def fail(self, index, error):
+        item = self.results[index]
+        if item["status"] != "invalid": # keep the first problem found
+            item.update(status="invalid", error=error)
+
+    def valid(self):
+        return [r["index"] for r in self.results if r["status"] != "invalid"]
+
+    @property
+    def failed(self):
+        return len(self.results) - len(self.valid())
+
+    def skip_valid(self):
+        for r in self.results:
+            if r["status"] != "invalid":
+                r.update(status="skipped", error="batch rejected: other items are invalid")
+
+    def as_dict(self):
+        created = sum(1 for r in self.results if r["status"] == "created")
+        return {"created": created, "failed": self.failed, "results": self.results}
+
+
+def _check_size(items):
+    if len(items) > BULK_MAX_ITEMS:
+        raise BatchTooLarge(f"At most {BULK_MAX_ITEMS} items per request, got {len(items)}")
+
+
+def _insert_returning(db, model, rows, *key):
+    """Bulk insert; {natural key: id}. Matching on a key validated unique in the batch keeps
+    RETURNING batched (sort_by_parameter_order would fall back to one INSERT per row on SQLite)."""
+    if not rows:
+        return {}
+    stmt = insert(model).returning(model.id, *key)
+    return {tuple(row[1:]): row[0] for row in db.execute(stmt, rows)}
+
+
+def default_task(db):
+    return tasks.resolve(db, [DEFAULT_TASK])[tasks.key(DEFAULT_TASK[0])]
+
+
+def default_schedule(db, vehicle_id):
+    """The default schedule for one new vehicle, following the default task"""
+    return tasks.new_schedule(default_task(db), vehicle_id)
+
+
+def enroll_vehicles(db, vehicles, atomic=True, default_schedule=True, tenant_id=db_mod.DEFAULT_TENANT):
+    """Insert vehicles (dicts with geotab_id, name, vin) into a tenant, plus their default schedule. Does not commit."""
+    _check_size(vehicles)
+    batch = BatchResult(len(vehicles))
+    rows = []
+    seen = {}
+    for i, v in enumerate(vehicles):
+        geotab_id = (v.get("geotab_id") or "").strip()
+        name = (v.get("name") or "").strip()
+        rows.append({"tenant_id": tenant_id, "geotab_id": geotab_id, "name": name, "vin": (v.get("vin") or "").strip() or None})
+        batch.results[i]["geotab_id"] = geotab_id
+        if not geotab_id:
+            batch.fail(i, "geotab_id is required")
+        elif geotab_id in seen:
+            batch.fail(i, f"duplicate geotab_id, same as item {seen[geotab_id]}")
+        else:
+            seen[geotab_id] = i
+        if not name:
+            batch.fail(i, "name is required")
+
+    if seen:
+        # Soft-deleted vehicles still hold their Geotab ID until the purger removes them
+        existing = db.execute(
+            select(db_mod.Vehicle.geotab_id, db_mod.Vehicle.id, db_mod.Vehicle.deleted_at)
+            .where(db_mod.Vehicle.tenant_id == tenant_id, db_mod.Vehicle.geotab_id.in_(list(seen)))
+            .execution_options(include_deleted=True)
+        ).all()
+        for geotab_id, vehicle_id, deleted_at in existing:
+            if deleted_at is None:
+                batch.fail(seen[geotab_id], f"already enrolled as vehicle {vehicle_id}")
+            else:
+                batch.fail(seen[geotab_id], f"vehicle {vehicle_id} with this geotab_id is still being deleted")
+
+    if atomic and batch.failed:
+        batch.skip_valid()
+        return batch
+
+    valid = batch.valid()
+    inserted = _insert_returning(db, db_mod.Vehicle, [rows[i] for i in valid], db_mod.Vehicle.geotab_id)
+    for i in valid:
+        batch.results[i]["id"] = inserted[(rows[i]["geotab_id"],)]
+    ids = list(inserted.values())
+    if default_schedule and ids:
+        fields, _ = tasks.schedule_fields(default_task(db))
+        db.execute(insert(db_mod.MaintenanceSchedule), [{"vehicle_id": vehicle_id, **fields} for vehicle_id in ids])
+    log.info("Vehicles enrolled", extra={"requested": len(vehicles), "inserted": len(ids), "failed": batch.failed})
+    return batch
+
+
+def assign_schedules(db, schedules, atomic=True):
+    """
+    Insert schedules (dicts shaped like ScheduleCreate) for existing vehicles. Each names its
+    task by task_id or task_name; a new name creates the task from the item. Does not commit.
+    """
+    _check_size(schedules)
+    batch = BatchResult(len(schedules))
+    items = []
+    for i, s in enumerate(schedules):
+        item = {
+            "vehicle_id": s.get("vehicle_id"),
+            "task_id": s.get("task_id"),
+            "name": (s.get("task_name") or "").strip(),
+            "tracking_type": s.get("tracking_type"),
+            "interval": s.get("interval_value"),
+            "thresholds": None,
+        }
+        items.append(item)
+        batch.results[i]["vehicle_id"] = item["vehicle_id"]
+        if item["task_id"] is None and not item["name"]:
+            batch.fail(i, "task_id or task_name is required")
+        if item["tracking_type"] is not None and item["tracking_type"] not in TRACKING_TYPES:
+            batch.fail(i, f"tracking_type must be one of {', '.join(TRACKING_TYPES)}")
+        if item["interval"] is not None and item["interval"] <= 0:
+            batch.fail(i, "interval_value must be positive")
+        if s.get("alert_thresholds") is not None:
+            try:
+                item["thresholds"] = parse_thresholds(s.get("alert_thresholds"))
+            except ValueError as e:
+                batch.fail(i, str(e))
+
+    by_id = {t.id: t for t in db.scalars(select(db_mod.MaintenanceTask).where(
+        db_mod.MaintenanceTask.id.in_({it["task_id"] for it in items if it["task_id"] is not None})))}
+    by_name = tasks.find(db, [it["name"] for it in items])
+    seen, new_tasks = {}, {}
+    for i, item in enumerate(items):
+        task = by_id.get(item["task_id"]) if item["task_id"] is not None else by_name.get(tasks.key(item["name"]))
+        item["task"] = task
+        if item["task_id"] is not None and task is None:
+            batch.fail(i, f"task {item['task_id']} not found")
+            continue
+        if task is None:
+            if item["tracking_type"] is None or item["interval"] is None:
+                batch.fail(i, f"new task '{item['name']}' needs tracking_type and interval_value")
+            # The first item naming a new task defines it; later ones may only override interval/thresholds
+            first = new_tasks.setdefault(tasks.key(item["name"]), i)
+            if items[first]["tracking_type"] != item["tracking_type"]:
+                batch.fail(i, f"new task '{item['name']}' is tracked in {items[first]['tracking_type']} by item {first}")
+        elif item["tracking_type"] is not None and item["tracking_type"] != task.tracking_type:
+            batch.fail(i, f"task '{task.name}' is tracked in {task.tracking_type}, not {item['tracking_type']}")
+        item["key"] = (item["vehicle_id"], tasks.key(task.name if task is not None else item["name"]))
+        if item["key"] in seen:
+            batch.fail(i, f"duplicate task for this vehicle, same as item {seen[item['key']]}")
+        else:
+            seen[item["key"]] = i
+
+    vehicle_ids = {it["vehicle_id"] for it in items}
+    if vehicle_ids:
+        # Soft-deleted vehicles are filtered out here like everywhere else
+        known = set(db.scalars(select(db_mod.Vehicle.id).where(db_mod.Vehicle.id.in_(vehicle_ids))))
+        active = db.execute(
+            select(db_mod.MaintenanceSchedule.vehicle_id, db_mod.MaintenanceSchedule.task_name)
+            .where(db_mod.MaintenanceSchedule.vehicle_id.in_(known), db_mod.MaintenanceSchedule.is_active == True)
+        ).all()
+        for i, item in enumerate(items):
+            if item["vehicle_id"] not in known:
+                batch.fail(i, f"vehicle {item['vehicle_id']} not found")
+        for vehicle_id, task_name in active:
+            i = seen.get((vehicle_id, tasks.key(task_name)))
+            if i is not None:
+                batch.fail(i, f"vehicle {vehicle_id} already has an active '{task_name}' schedule")
+
+    if atomic and batch.failed:
+        batch.skip_valid()
+        return batch
+
+    valid = batch.valid()
+    created = tasks.resolve(db, [(items[i]["name"], items[i]["tracking_type"], items[i]["interval"], items[i]["thresholds"] or [])
+                                 for i in valid if items[i]["task"] is None])
+    rows, overrides = [], {}
+    for i in valid:
+        item = items[i]
+        item["task"] = item["task"] or created[tasks.key(item["name"])]
+        fields, own = tasks.schedule_fields(item["task"], item["interval"], item["thresholds"])
+        rows.append({"vehicle_id": item["vehicle_id"], **fields})
+        overrides[(item["vehicle_id"], item["task"].id)] = own
+    schedule = db_mod.MaintenanceSchedule
+    inserted = _insert_returning(db, schedule, rows, schedule.vehicle_id, schedule.task_id)
+    for i in valid:
+        batch.results[i]["id"] = inserted[(items[i]["vehicle_id"], items[i]["task"].id)]
+        batch.results[i]["task_id"] = items[i]["task"].id
+    threshold_rows = [{"schedule_id": inserted[k], "value": v} for k, values in overrides.items() for v in values]
+    if threshold_rows:
+        db.execute(insert(db_mod.TaskThreshold), threshold_rows)
+    log.info("Schedules assigned", extra={"requested": len(schedules), "inserted": len(inserted), "failed": batch.failed,
+                                          "new_tasks": len(created)})
+    return batch
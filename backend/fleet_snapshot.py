@@ -0,0 +1,260 @@
+"""
+In-process read model of the fleet.
+
+GET /vehicles, the due list, alert evaluation and the sync's poll planning all
+need every vehicle with its schedules. Loading that as ORM objects on every
+call costs a round of queries and tens of thousands of objects; here it is
+kept in memory as compact records (__slots__, shared interned strings,
+threshold tuples) keyed by vehicle id.
+
+A Snapshot is never modified once published. A rebuild or a patch builds a new
+one and swaps the module reference, so readers never lock and never see half
+an update.
+
+Freshness works like settings_service: every write to vehicles or schedules
+bumps fleet_version in its own transaction (touch). Each process checks that
+counter at most every FLEET_SNAPSHOT_REFRESH seconds and rebuilds when it moved
+(three queries); the process that made the write patches just the vehicles it
+changed instead. The sync service rebuilds right after each sync commit.
+Writes that bypass the counter (scripts inserting rows directly) are picked up
+within FLEET_SNAPSHOT_MAX_AGE.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, insert, select, update
+
+import database as db_mod
+from database import format_thresholds
+
+FLEET_SNAPSHOT_REFRESH = float(os.getenv("FLEET_SNAPSHOT_REFRESH", "2")) # seconds between version checks
+FLEET_SNAPSHOT_MAX_AGE = float(os.getenv("FLEET_SNAPSHOT_MAX_AGE", "300")) # seconds before a rebuild regardless
+
+log = logging.getLogger("geotrack.snapshot")
+
+
+class ScheduleRecord:
+    __slots__ = ("id", "vehicle_id", "task_id", "task_name", "tracking_type", "interval_value", "thresholds",
+                 "last_performed_value", "last_performed_date", "last_alerted_at", "is_active")
+
+    def __init__(self, row, thresholds):
+        self.id = row.id
+        self.vehicle_id = row.vehicle_id
+        self.task_id = row.task_id
+        self.task_name = sys.intern(row.task_name) if row.task_name else row.task_name
+        self.tracking_type = sys.intern(row.tracking_type) if row.tracking_type else row.tracking_type
+        # The vehicle's own interval and thresholds, else its task's (as MaintenanceSchedule resolves them)
+        self.interval_value = row.interval_value if row.interval_value is not None else row.task_interval
+        self.thresholds = thresholds
+        self.last_performed_value = row.last_performed_value
+        self.last_performed_date = row.last_performed_date
+        self.last_alerted_at = row.last_alerted_at
+        self.is_active = row.is_active
+
+    @property
+    def alert_thresholds(self):
+        return format_thresholds(self.thresholds)
+
+    @property
+    def due_at(self):
+        """Usage at which the service is due, or None for time-based schedules"""
+        if self.tracking_type not in ("miles", "hours") or self.interval_value is None:
+            return None
+        return (self.last_performed_value or 0.0) + self.interval_value
+
+
+class VehicleRecord:
+    __slots__ = ("id", "tenant_id", "geotab_id", "name", "vin", "current_mileage", "current_hours", "last_sync", "schedules")
+
+    def __init__(self, row, schedules):
+        self.id = row.id
+        self.tenant_id = row.tenant_id
+        self.geotab_id = row.geotab_id
+        self.name = row.name
+        self.vin = row.vin
+        self.current_mileage = row.current_mileage
+        self.current_hours = row.current_hours
+        self.last_sync = row.last_sync
+        self.schedules = schedules # tuple of ScheduleRecord, by id
+
+    def usage(self, tracking_type):
+        return {"miles": self.current_mileage, "hours": self.current_hours}.get(tracking_type)
+
+
+class Snapshot:
+    __slots__ = ("vehicles", "version", "built_at", "cache")
+
+    def __init__(self, vehicles, version, built_at):
+        self.vehicles = vehicles # {vehicle id: VehicleRecord}, ascending id
+        self.version = version # fleet_version it reflects; None once a patch could not keep up
+        self.built_at = built_at # monotonic
+        self.cache = {} # values derived from this snapshot only (e.g. a serialized response)
+
+    def of_tenant(self, tenant_id):
+        """Vehicles of one tenant (all of them for None), ascending id"""
+        if tenant_id is None:
+            return list(self.vehicles.values())
+        return [v for v in self.vehicles.values() if v.tenant_id == tenant_id]
+
+    def active_schedules(self, tenant_id=None):
+        """(vehicle, schedule) for every active schedule (of one tenant, if given)"""
+        for vehicle in self.of_tenant(tenant_id):
+            for schedule in vehicle.schedules:
+                if schedule.is_active:
+                    yield vehicle, schedule
+
+    def due(self, soon=False, tenant_id=None):
+        """
+        [(vehicle, schedule, usage, mark)] for active schedules that are due (usage >= due value),
+        or with soon=True that have also crossed their first alert threshold, most overdue first.
+        """
+        found = []
+        for vehicle, schedule in self.active_schedules(tenant_id):
+            due_at = schedule.due_at
+            if due_at is None:
+                continue
+            usage = vehicle.usage(schedule.tracking_type) or 0.0
+            mark = due_at
+            if soon and schedule.thresholds:
+                mark = min(mark, (schedule.last_performed_value or 0.0) + schedule.thresholds[0])
+            if usage >= mark:
+                found.append((vehicle, schedule, usage, due_at))
+        found.sort(key=lambda item: item[3] - item[2])
+        return found
+
+
+# --- LOADING ---
+
+def _load(conn, vehicle_ids=None):
+    """{vehicle id: VehicleRecord} for every live vehicle, or just these. Three queries."""
+    vehicles, schedules = db_mod.Vehicle.__table__, db_mod.MaintenanceSchedule.__table__
+    tasks, thresholds = db_mod.MaintenanceTask.__table__, db_mod.TaskThreshold.__table__
+    live = vehicles.c.deleted_at.is_(None)
+
+    vehicle_q = select(vehicles.c.id, vehicles.c.tenant_id, vehicles.c.geotab_id, vehicles.c.name, vehicles.c.vin, vehicles.c.current_mileage,
+                       vehicles.c.current_hours, vehicles.c.last_sync).where(live).order_by(vehicles.c.id)
+    schedule_q = select(schedules.c.id, schedules.c.vehicle_id, schedules.c.task_id, schedules.c.task_name,
+                        schedules.c.tracking_type, schedules.c.interval_value, tasks.c.interval_value.label("task_interval"),
+                        schedules.c.last_performed_value, schedules.c.last_performed_date, schedules.c.last_alerted_at,
+                        schedules.c.is_active, schedules.c.own_thresholds)\
+        .join(vehicles, and_(vehicles.c.id == schedules.c.vehicle_id, live))\
+        .outerjoin(tasks, tasks.c.id == schedules.c.task_id).order_by(schedules.c.id)
+    # Task thresholds (a handful of tasks) and the schedules' own overrides, in one pass
+    threshold_q = select(thresholds.c.task_id, thresholds.c.schedule_id, thresholds.c.value).order_by(thresholds.c.value)
+    if vehicle_ids is not None:
+        vehicle_q = vehicle_q.where(vehicles.c.id.in_(vehicle_ids))
+        schedule_q = schedule_q.where(schedules.c.vehicle_id.in_(vehicle_ids))
+        threshold_q = threshold_q.where(
+            thresholds.c.task_id.isnot(None)
+            | thresholds.c.schedule_id.in_(select(schedules.c.id).where(schedules.c.vehicle_id.in_(vehicle_ids))))
+
+    by_task, by_schedule = {}, {}
+    for task_id, schedule_id, value in conn.execute(threshold_q):
+        if schedule_id is not None:
+            by_schedule.setdefault(schedule_id, []).append(value)
+        elif task_id is not None:
+            by_task.setdefault(task_id, []).append(value)
+    shared = {task_id: tuple(values) for task_id, values in by_task.items()} # one tuple per task, shared by its schedules
+
+    owned = {}
+    for row in conn.execute(schedule_q):
+        own = by_schedule.get(row.id)
+        owned.setdefault(row.vehicle_id, []).append(
+            ScheduleRecord(row, tuple(own or ()) if own or row.own_thresholds else shared.get(row.task_id, ())))
+    return {row.id: VehicleRecord(row, tuple(owned.get(row.id, ()))) for row in conn.execute(vehicle_q)}
+
+
+def _read_version(conn):
+    table = db_mod.FleetVersion.__table__
+    return conn.execute(select(table.c.version).where(table.c.id == 1)).scalar() or 0
+
+
+# --- THIS PROCESS'S SNAPSHOT ---
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+
+
+def is_fresh():
+    """True when current() will answer from memory without a version check"""
+    return _snapshot is not None and time.monotonic() - _checked_at < FLEET_SNAPSHOT_REFRESH
+
+
+def current(force=False):
+    """
+    The fleet snapshot, rebuilt first if fleet_version moved. The version is checked at most
+    every FLEET_SNAPSHOT_REFRESH seconds (now, with force); while one thread rebuilds, others
+    keep reading the previous snapshot.
+    """
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    if not force and is_fresh():
+        return snapshot
+    if not _lock.acquire(blocking=snapshot is None or force):
+        return snapshot
+    try:
+        snapshot = _snapshot
+        if not force and is_fresh():
+            return snapshot
+        started = time.monotonic()
+        try:
+            with db_mod.engine.connect() as conn:
+                # Version first: the data read after it is at least that new
+                version = _read_version(conn)
+                if snapshot is None or snapshot.version != version or started - snapshot.built_at >= FLEET_SNAPSHOT_MAX_AGE:
+                    snapshot = _snapshot = Snapshot(_load(conn), version, started)
+                    log.debug("Fleet snapshot rebuilt", extra={"version": version, "vehicles": len(snapshot.vehicles),
+                                                               "ms": round((time.monotonic() - started) * 1000, 1)})
+        except Exception as e:
+            if snapshot is None:
+                raise
+            # Keep serving the last snapshot while the database is unreachable
+            log.warning("Could not refresh the fleet snapshot: %s", e)
+        _checked_at = time.monotonic()
+        return snapshot
+    finally:
+        _lock.release()
+
+
+def touch(db):
+    """Bump fleet_version in the caller's transaction (call before commit). Returns the new version."""
+    table = db_mod.FleetVersion.__table__
+    now = datetime.utcnow()
+    if not db.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1, updated_at=now)).rowcount:
+        db.execute(insert(table).values(id=1, version=1, updated_at=now))
+    return _read_version(db)
+
+
+def patch(vehicle_ids, version):
+    """
+    After this process committed a write (touch() returned `version`): reload just these
+    vehicles, dropping deleted ones. With no ids (e.g. a task change that moves every
+    schedule following it) the next read rebuilds instead.
+    """
+    global _snapshot, _checked_at
+    with _lock:
+        snapshot = _snapshot
+        if snapshot is None:
+            return
+        if not vehicle_ids:
+            _snapshot, _checked_at = Snapshot(snapshot.vehicles, None, snapshot.built_at), 0.0
+            return
+        ids = set(vehicle_ids)
+        with db_mod.engine.connect() as conn:
+            fresh = _load(conn, ids)
+        vehicles = dict(snapshot.vehicles)
+        for vehicle_id in ids:
+            if vehicle_id in fresh:
+                vehicles[vehicle_id] = fresh[vehicle_id] # new ids have the highest ids, so order holds
+            else:
+                vehicles.pop(vehicle_id, None)
+        # Another writer got in between: keep the data, but let the next check rebuild
+        in_step = snapshot.version is not None and version == snapshot.version + 1
+        _snapshot = Snapshot(vehicles, version if in_step else None, snapshot.built_at)
+        if not in_step:
+            _checked_at = 0.0
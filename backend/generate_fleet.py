@@ -0,0 +1,328 @@
+"""
+Synthetic fleet generator for load and scale testing.
+
+Produces vehicles, maintenance schedules, maintenance logs and (optionally) a
+telemetry history file with realistic distributions, using bulk inserts
+(executemany, or COPY on Postgres/psycopg2). Output is deterministic for a
+given --seed.
+
+Usage:
+    python generate_fleet.py --vehicles 10000 --schedules 100000 --logs 10000000
+    python generate_fleet.py --vehicles 1000 --telemetry-out telemetry.jsonl --telemetry-days 14
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+METERS_PER_MILE = 1609.344
+
+# task: (tracking_type, interval, alert_thresholds, median cost $)
+TASK_CATALOG = {
+    "Oil Change": ("miles", 5000.0, "4500,4800", 85.0),
+    "Tire Rotation": ("miles", 7500.0, "7000,7300", 60.0),
+    "Air Filter Replace": ("miles", 15000.0, "14000,14700", 45.0),
+    "Brake Inspection": ("miles", 20000.0, "19000,19700", 150.0),
+    "Coolant Flush": ("miles", 30000.0, "29000,29700", 140.0),
+    "Spark Plugs": ("miles", 60000.0, "58000,59500", 220.0),
+    "Transmission Flush": ("miles", 60000.0, "58000,59500", 260.0),
+    "Timing Belt": ("miles", 90000.0, "87000,89000", 650.0),
+    "DPF Cleaning": ("miles", 150000.0, "145000,149000", 480.0),
+    "Engine Service": ("hours", 250.0, "225,240", 210.0),
+    "Hydraulic Service": ("hours", 500.0, "450,480", 320.0),
+    "Undercarriage Inspection": ("hours", 1000.0, "900,960", 400.0),
+}
+
+# class: (share of fleet, median miles/day, engine hours per 100 miles, idle hours/day, tasks)
+VEHICLE_CLASSES = {
+    "Pickup": (0.45, 45.0, 2.6, 0.4, ["Oil Change", "Tire Rotation", "Air Filter Replace", "Brake Inspection", "Coolant Flush", "Spark Plugs", "Transmission Flush", "Timing Belt", "Engine Service", "Undercarriage Inspection"]),
+    "Cargo Van": (0.25, 70.0, 2.8, 0.6, ["Oil Change", "Tire Rotation", "Air Filter Replace", "Brake Inspection", "Coolant Flush", "Spark Plugs", "Transmission Flush", "Timing Belt", "Engine Service", "Undercarriage Inspection"]),
+    "Box Truck": (0.2, 110.0, 3.4, 1.0, ["Oil Change", "Tire Rotation", "Air Filter Replace", "Brake Inspection", "Coolant Flush", "Transmission Flush", "DPF Cleaning", "Engine Service", "Hydraulic Service", "Undercarriage Inspection"]),
+    "Equipment": (0.1, 3.0, 0.0, 5.5, ["Engine Service", "Hydraulic Service", "Undercarriage Inspection", "Oil Change", "Air Filter Replace", "Coolant Flush", "Brake Inspection", "Tire Rotation", "Spark Plugs", "DPF Cleaning"]),
+}
+MAKES = {
+    "Pickup": ["Ford F-150", "Chevy Silverado", "Ram 1500", "Toyota Tundra"],
+    "Cargo Van": ["Ford Transit", "Mercedes Sprinter", "Ram ProMaster"],
+    "Box Truck": ["Isuzu NPR", "Hino 268", "Freightliner M2"],
+    "Equipment": ["CAT 320 Excavator", "Deere 310L Backhoe", "Bobcat S650"],
+}
+
+
+class BulkWriter:
+    """Buffers rows for one table and flushes them with executemany or Postgres COPY"""
+
+    def __init__(self, conn, table, batch_size, use_copy):
+        self.conn = conn
+        self.table = table
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.columns = [c.name for c in table.columns]
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        if self.use_copy:
+            self._copy()
+        else:
+            self.conn.execute(self.table.insert(), self.rows)
+        self.count += len(self.rows)
+        self.rows = []
+
+    def _copy(self):
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in self.rows:
+            writer.writerow([_copy_value(row.get(c)) for c in self.columns])
+        buf.seek(0)
+        cursor = self.conn.connection.dbapi_connection.cursor()
+        cursor.copy_expert(f"COPY {self.table.name} ({', '.join(self.columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def _copy_value(value):
+    if value is None:
+        return None # csv writes an empty unquoted field, which COPY reads as NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    return value
+
+
+def _lognormal(rng, median, sigma):
+    return median * math.exp(rng.gauss(0.0, sigma))
+
+
+def _pick_class(rng):
+    r = rng.random()
+    for name, spec in VEHICLE_CLASSES.items():
+        r -= spec[0]
+        if r <= 0:
+            return name
+    return name
+
+
+def plan_vehicles(rng, count, now, first_id):
+    """Vehicle specs with usage profiles; used for DB rows, logs and telemetry alike"""
+    vehicles = []
+    for i in range(count):
+        cls = _pick_class(rng)
+        _, median_miles, hours_per_100mi, idle_hours, _ = VEHICLE_CLASSES[cls]
+        age_days = rng.randint(30, 10 * 365)
+        daily_miles = _lognormal(rng, median_miles, 0.45)
+        daily_hours = daily_miles * hours_per_100mi / 100.0 + _lognormal(rng, idle_hours, 0.3)
+        # ~15% of the fleet is parked at any time (seasonal, spare or in the shop)
+        parked = rng.random() < 0.15
+        vid = first_id + i
+        vehicles.append({
+            "id": vid,
+            "class": cls,
+            "geotab_id": f"b{vid:x}",
+            "name": f"{rng.choice(MAKES[cls])} #{vid}",
+            "vin": "".join(rng.choice("ABCDEFGHJKLMNPRSTUVWXYZ0123456789") for _ in range(17)),
+            "age_days": age_days,
+            "daily_miles": 0.0 if parked else daily_miles,
+            "daily_hours": 0.0 if parked else daily_hours,
+            "current_mileage": round(daily_miles * age_days, 1),
+            "current_hours": round(daily_hours * age_days, 1),
+            "last_sync": now - timedelta(minutes=rng.randint(0, 180)),
+        })
+    return vehicles
+
+
+def vehicle_row(v):
+    return {k: v[k] for k in ("id", "geotab_id", "name", "vin", "current_mileage", "current_hours", "last_sync")}
+
+
+def ensure_tasks(conn, db_mod):
+    """{task name: id} for TASK_CATALOG, creating the task templates that are missing"""
+    from sqlalchemy import select
+    tasks, thresholds = db_mod.MaintenanceTask.__table__, db_mod.TaskThreshold.__table__
+    ids = {name: tid for tid, name in conn.execute(select(tasks.c.id, tasks.c.name).where(tasks.c.name.in_(list(TASK_CATALOG))))}
+    for name, (tracking, interval, alert_thresholds, _) in TASK_CATALOG.items():
+        if name not in ids:
+            ids[name] = conn.execute(tasks.insert().values(name=name, tracking_type=tracking, interval_value=interval)).inserted_primary_key[0]
+            conn.execute(thresholds.insert(), [{"task_id": ids[name], "value": v} for v in db_mod.parse_thresholds(alert_thresholds)])
+    return ids
+
+
+def schedule_rows(rng, vehicles, total, now, task_ids):
+    per_vehicle, remainder = divmod(total, len(vehicles))
+    for idx, v in enumerate(vehicles):
+        tasks = VEHICLE_CLASSES[v["class"]][4]
+        n = min(per_vehicle + (1 if idx < remainder else 0), len(tasks))
+        for task in tasks[:n]:
+            tracking, interval, _, _ = TASK_CATALOG[task]
+            current = v["current_mileage"] if tracking == "miles" else v["current_hours"]
+            daily = v["daily_miles"] if tracking == "miles" else v["daily_hours"]
+            # Mostly within the interval; ~8% overdue by up to half an interval
+            done_ago = interval * (rng.uniform(1.0, 1.5) if rng.random() < 0.08 else rng.uniform(0.0, 1.0))
+            last_value = max(0.0, current - done_ago)
+            days_ago = (current - last_value) / daily if daily else rng.randint(0, 365)
+            yield {
+                "vehicle_id": v["id"],
+                "task_id": task_ids[task],
+                "task_name": task,
+                "tracking_type": tracking,
+                "interval_value": None, # follows the task
+                "last_performed_value": round(last_value, 1),
+                "last_performed_date": now - timedelta(days=min(days_ago, v["age_days"])),
+                "last_alerted_at": None,
+                "is_active": rng.random() < 0.97,
+            }
+
+
+def log_rows(rng, vehicles, total, now, task_ids):
+    # Heavier-used vehicles get proportionally more service history
+    weights = [max(v["daily_miles"] / 50.0, v["daily_hours"] / 2.0, 0.1) * v["age_days"] for v in vehicles]
+    scale = total / sum(weights)
+    produced = 0
+    for idx, v in enumerate(vehicles):
+        n = total - produced if idx == len(vehicles) - 1 else int(round(weights[idx] * scale))
+        n = max(0, min(n, total - produced))
+        produced += n
+        tasks = VEHICLE_CLASSES[v["class"]][4]
+        task_weights = [1.0 / TASK_CATALOG[t][1] * (100.0 if TASK_CATALOG[t][0] == "miles" else 1.0) for t in tasks]
+        for _ in range(n):
+            days_ago = rng.uniform(0, v["age_days"])
+            task = rng.choices(tasks, task_weights)[0]
+            yield {
+                "vehicle_id": v["id"],
+                "task_id": task_ids[task],
+                "task_name": task,
+                "performed_at_mileage": round(max(0.0, v["current_mileage"] - v["daily_miles"] * days_ago), 1),
+                "performed_at_hours": round(max(0.0, v["current_hours"] - v["daily_hours"] * days_ago), 1),
+                "performed_date": now - timedelta(days=days_ago),
+                "cost": round(_lognormal(rng, TASK_CATALOG[task][3], 0.5), 2),
+                "notes": None if rng.random() < 0.7 else "Performed by vendor.",
+            }
+
+
+def write_telemetry(rng, vehicles, path, days, interval_minutes, now):
+    """
+    One JSON line per vehicle with odometer (meters) and engine hours (seconds) histories,
+    in the units Geotab StatusData reports. Readings only advance during working hours.
+    """
+    steps = int(days * 24 * 60 / interval_minutes)
+    with open(path, "w") as f:
+        for v in vehicles:
+            odometer, engine = [], []
+            miles, hours = v["current_mileage"], v["current_hours"]
+            t = now
+            for _ in range(steps + 1):
+                odometer.append([t.isoformat() + "Z", round(miles * METERS_PER_MILE, 1)])
+                engine.append([t.isoformat() + "Z", round(hours * 3600.0, 1)])
+                # Walk backwards in time, undoing the usage of each interval
+                t_prev = t - timedelta(minutes=interval_minutes)
+                if t_prev.weekday() < 5 and 7 <= t_prev.hour < 18:
+                    share = interval_minutes / (11 * 60.0) * rng.uniform(0.3, 1.7)
+                    miles = max(0.0, miles - v["daily_miles"] * 7 / 5 * share)
+                    hours = max(0.0, hours - v["daily_hours"] * 7 / 5 * share)
+                t = t_prev
+            odometer.reverse()
+            engine.reverse()
+            f.write(json.dumps({"device": v["geotab_id"], "name": v["name"], "serialNumber": v["vin"],
+                                "odometer": odometer, "engineHours": engine}) + "\n")
+
+
+def generate(db_mod, vehicles, schedules, logs, seed=42, batch_size=10000, use_copy=None,
+             telemetry_out=None, telemetry_days=7, telemetry_interval=60, progress=True):
+    """Generate a fleet into the configured database. Returns the planned vehicle specs."""
+    from sqlalchemy import func, select, text
+
+    rng = random.Random(seed)
+    now = datetime.utcnow().replace(microsecond=0)
+    engine = db_mod.engine
+    if use_copy is None:
+        use_copy = engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+    with engine.connect() as conn:
+        first_id = (conn.execute(select(func.max(db_mod.Vehicle.__table__.c.id))).scalar() or 0) + 1
+    fleet = plan_vehicles(rng, vehicles, now, first_id)
+
+    def load(table, rows, label):
+        t0 = time.perf_counter()
+        with engine.begin() as conn:
+            writer = BulkWriter(conn, table, batch_size, use_copy)
+            for row in rows:
+                writer.add(row)
+                if progress and writer.count and writer.count % (batch_size * 50) == 0 and not writer.rows:
+                    print(f"   ... {writer.count:,} {label}")
+            writer.flush()
+        if progress:
+            elapsed = time.perf_counter() - t0
+            print(f"   {writer.count:,} {label} in {elapsed:.1f}s ({writer.count / max(elapsed, 1e-9):,.0f} rows/s)")
+
+    with engine.begin() as conn:
+        task_ids = ensure_tasks(conn, db_mod)
+    load(db_mod.Vehicle.__table__, (vehicle_row(v) for v in fleet), "vehicles")
+    load(db_mod.MaintenanceSchedule.__table__, schedule_rows(rng, fleet, schedules, now, task_ids), "schedules")
+    load(db_mod.MaintenanceLog.__table__, log_rows(rng, fleet, logs, now, task_ids), "logs")
+
+    if engine.dialect.name == "postgresql":
+        # Explicit ids bypass the sequences; move them past the generated rows
+        with engine.begin() as conn:
+            for table in ("vehicles", "maintenance_schedules", "maintenance_logs"):
+                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 1))"))
+
+    if telemetry_out:
+        t0 = time.perf_counter()
+        write_telemetry(rng, fleet, telemetry_out, telemetry_days, telemetry_interval, now)
+        if progress:
+            print(f"   telemetry for {len(fleet):,} vehicles -> {telemetry_out} in {time.perf_counter() - t0:.1f}s")
+    return fleet
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic fleet for load and scale testing")
+    parser.add_argument("--database-url", help="Target database (default: DATABASE_URL / maintenance.db)")
+    parser.add_argument("--vehicles", type=int, default=10000)
+    parser.add_argument("--schedules", type=int, default=100000, help="Total schedules, spread evenly across vehicles")
+    parser.add_argument("--logs", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--no-copy", action="store_true", help="Use executemany even on Postgres")
+    parser.add_argument("--telemetry-out", help="Write per-vehicle odometer/engine-hour histories (JSON lines)")
+    parser.add_argument("--telemetry-days", type=float, default=7)
+    parser.add_argument("--telemetry-interval", type=int, default=60, help="Minutes between readings")
+    parser.add_argument("--force", action="store_true", help="Append even if the database already has vehicles")
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    import database as db_mod
+    from sqlalchemy import text
+
+    print(f"🔌 Preparing {db_mod.engine.url.get_backend_name()} database...")
+    if not db_mod.init_db():
+        sys.exit(2)
+    with db_mod.engine.connect() as conn:
+        existing = conn.execute(text("SELECT COUNT(*) FROM vehicles")).scalar()
+    if existing and not args.force:
+        print(f"❌ Database already has {existing} vehicles. Use --force to append.")
+        sys.exit(2)
+
+    print(f"🌱 Generating {args.vehicles:,} vehicles, {args.schedules:,} schedules, {args.logs:,} logs (seed {args.seed})...")
+    generate(db_mod, args.vehicles, args.schedules, args.logs, seed=args.seed, batch_size=args.batch_size,
+             use_copy=False if args.no_copy else None, telemetry_out=args.telemetry_out,
+             telemetry_days=args.telemetry_days, telemetry_interval=args.telemetry_interval)
+    print("✅ Done!")
+
+
+if __name__ == "__main__":
+    main()
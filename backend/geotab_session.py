@@ -0,0 +1,278 @@
+"""
+Reusable Geotab sessions.
+
+mygeotab.API opens a new HTTP connection (and TLS handshake) for every call,
+and sync used to run a full Authenticate before every cycle. GeotabSession
+keeps one keep-alive connection per process, reuses the session ID across
+cycles and re-authenticates only when Geotab answers InvalidUserException.
+
+The session ID (never the password) is saved to GEOTAB_SESSION_FILE so a
+restarted worker or the next cron run picks it up without logging in again.
+Set GEOTAB_SESSION_KEY to a Fernet key (cryptography.fernet.Fernet.generate_key())
+to encrypt that file; set GEOTAB_SESSION_FILE to an empty string to keep
+sessions in memory only.
+
+Geotab rate-limits each database separately, so a session can be given a call
+rate (calls per second) that every call on it waits for. With several tenants
+syncing at once each keeps to its own database's budget.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import requests
+from mygeotab import AuthenticationException, Credentials, MyGeotabException, TimeoutException
+from mygeotab.api import (DEFAULT_TIMEOUT, GeotabHTTPAdapter, camelcaseify_parameters, convert_get_parameters,
+                          get_api_url, get_headers)
+from mygeotab.serializers import json_deserialize, json_serialize
+
+import metrics
+
+SESSION_FILE = os.getenv("GEOTAB_SESSION_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".geotab_session"))
+SESSION_KEY = os.getenv("GEOTAB_SESSION_KEY")
+
+log = logging.getLogger("geotrack.geotab")
+
+
+# --- PERSISTENCE ---
+
+class SessionStore:
+    """Session IDs on disk, one per (server, database, user), optionally Fernet-encrypted"""
+
+    def __init__(self, path=SESSION_FILE, key=SESSION_KEY):
+        self.path = path
+        self._fernet = None
+        self._lock = threading.Lock()
+        if key:
+            try:
+                from cryptography.fernet import Fernet
+                self._fernet = Fernet(key.encode() if isinstance(key, str) else key)
+            except ImportError:
+                # Refuse to write session IDs in clear text when encryption was asked for
+                log.warning("GEOTAB_SESSION_KEY is set but cryptography is not installed; sessions will not be persisted")
+                self.path = None
+            except ValueError as e:
+                log.warning("Invalid GEOTAB_SESSION_KEY (%s); sessions will not be persisted", e)
+                self.path = None
+
+    @staticmethod
+    def key_for(username, database, server):
+        return f"{server}|{database}|{username}"
+
+    def _read(self):
+        if not self.path or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            if self._fernet:
+                raw = self._fernet.decrypt(raw)
+            return json.loads(raw)
+        except Exception as e:
+            # A corrupt file or a rotated key just costs one Authenticate
+            log.warning("Ignoring unreadable Geotab session file (%s)", type(e).__name__, extra={"path": self.path})
+            return {}
+
+    def _write(self, entries):
+        raw = json.dumps(entries).encode()
+        if self._fernet:
+            raw = self._fernet.encrypt(raw)
+        directory = os.path.dirname(self.path) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".geotab_session.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(raw)
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.path) # atomic, so a concurrent reader never sees half a file
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def load(self, key):
+        with self._lock:
+            return self._read().get(key)
+
+    def save(self, key, entry):
+        if not self.path:
+            return
+        with self._lock:
+            entries = self._read()
+            if entry is None:
+                entries.pop(key, None)
+            else:
+                entries[key] = entry
+            try:
+                self._write(entries)
+            except OSError as e:
+                log.warning("Could not save Geotab session: %s", e, extra={"path": self.path})
+
+
+# --- RATE LIMIT ---
+
+class RateLimiter:
+    """Token bucket: at most `rate` calls per second on average, bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1.0, self.rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until a call may go out. Returns the seconds waited."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1.0
+            delay = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+# --- SESSION ---
+
+class GeotabSession:
+    """Drop-in for the parts of mygeotab.API that sync uses (get/call/authenticate).
+
+    Not thread-safe: one session per sync worker thread.
+    """
+
+    def __init__(self, username, password=None, database=None, server="my.geotab.com",
+                 timeout=DEFAULT_TIMEOUT, store=None, limiter=None):
+        if username is None:
+            raise ValueError("`username` cannot be None")
+        self.credentials = Credentials(username, None, database, server, password)
+        self.timeout = timeout
+        self.store = store
+        self.limiter = limiter # RateLimiter shared by every call on this session, or None
+        self._store_key = SessionStore.key_for(username, database, server)
+        self._http = requests.Session()
+        self._http.mount("https://", GeotabHTTPAdapter())
+        self._http.headers.update(get_headers())
+        if store is not None:
+            saved = store.load(self._store_key)
+            if saved:
+                self.credentials.session_id = saved.get("session_id")
+                self.credentials.server = saved.get("server") or server
+                self.credentials.database = saved.get("database") or database
+
+    @property
+    def authenticated(self):
+        return bool(self.credentials.session_id)
+
+    def _post(self, method, params):
+        if self.limiter is not None:
+            self.limiter.wait()
+        payload = json_serialize({"id": -1, "method": method, "params": params})
+        try:
+            response = self._http.post(get_api_url(self.credentials.server), data=payload, timeout=self.timeout)
+        except requests.Timeout as e:
+            raise TimeoutException(self.credentials.server) from e
+        response.raise_for_status()
+        data = json_deserialize(response.text)
+        if data and "error" in data:
+            raise MyGeotabException(data["error"])
+        return data.get("result") if data else data
+
+    def authenticate(self):
+        """Log in with the password and save the new session ID"""
+        creds = self.credentials
+        if not creds.password:
+            raise AuthenticationException(creds.username, creds.database, creds.server)
+        metrics.GEOTAB_CALLS.inc("Authenticate")
+        try:
+            result = self._post("Authenticate", {
+                "database": creds.database, "userName": creds.username, "password": creds.password})
+        except MyGeotabException as e:
+            metrics.GEOTAB_ERRORS.inc("Authenticate", e.name)
+            if e.name == "InvalidUserException":
+                raise AuthenticationException(creds.username, creds.database, creds.server) from e
+            raise
+        except Exception as e:
+            metrics.GEOTAB_ERRORS.inc("Authenticate", type(e).__name__)
+            raise
+        if result.get("path") not in (None, "ThisServer"):
+            creds.server = result["path"] # the database lives on another server; talk to it directly from now on
+        creds.session_id = result["credentials"]["sessionId"]
+        creds.database = result["credentials"]["database"]
+        log.info("Authenticated with Geotab", extra={"user": creds.username, "database": creds.database, "server": creds.server})
+        if self.store is not None:
+            self.store.save(self._store_key, {
+                "session_id": creds.session_id, "server": creds.server, "database": creds.database})
+        return creds
+
+    def call(self, method, **parameters):
+        if not self.authenticated:
+            self.authenticate()
+        params = camelcaseify_parameters(parameters)
+        params["credentials"] = self.credentials.get_param()
+        try:
+            return self._post(method, params)
+        except MyGeotabException as e:
+            if e.name != "InvalidUserException":
+                raise
+            # Session expired or was revoked: log in again once and retry
+            log.info("Geotab session expired, re-authenticating", extra={"user": self.credentials.username})
+            self.credentials.session_id = None
+            self.authenticate()
+            params["credentials"] = self.credentials.get_param()
+            return self._post(method, params)
+
+    def get(self, type_name, **parameters):
+        return self.call("Get", type_name=type_name, **convert_get_parameters(parameters))
+
+    def close(self):
+        self._http.close()
+
+
+# --- PROCESS CACHE ---
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_store = None
+
+
+def _fingerprint(credentials):
+    # Changing the password on the Settings page must not keep using the old login
+    secret = (credentials.get("password") or "").encode()
+    return (credentials.get("server"), credentials.get("database"), credentials.get("username"),
+            hashlib.sha256(secret).hexdigest())
+
+
+def get_session(credentials, rate=None):
+    """The process-wide GeotabSession for these credentials (created on first use), limited to `rate` calls per second if given"""
+    global _store
+    key = _fingerprint(credentials)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            if _store is None:
+                _store = SessionStore()
+            # Sessions for credentials that changed are dropped along with their connections
+            for old in [k for k in _sessions if k[:3] == key[:3]]:
+                _sessions.pop(old).close()
+            session = GeotabSession(credentials["username"], credentials.get("password"), credentials.get("database"),
+                                    credentials.get("server") or "my.geotab.com", store=_store)
+            _sessions[key] = session
+        if not rate:
+            session.limiter = None
+        elif session.limiter is None or session.limiter.rate != float(rate):
+            session.limiter = RateLimiter(rate)
+        return session
+
+
+def reset():
+    """Forget cached sessions and close their connections (the session file is kept)"""
+    global _store
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _store = None
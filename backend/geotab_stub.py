@@ -0,0 +1,291 @@
+"""
+Local stand-in for the Geotab JSON-RPC API.
+
+Serves Authenticate, ExtendSession, ExecuteMultiCall and Get for Device,
+Group and StatusData from a recorded/generated telemetry file (see generate_fleet.py
+--telemetry-out) or from synthetic devices, with configurable latency, error
+rate, throttling and session expiry.
+
+Point the sync service at it with GEOTAB_SERVER=http://127.0.0.1:8765/apiv1
+
+Usage:
+    python geotab_stub.py --telemetry telemetry.jsonl --latency-ms 80 --error-rate 0.01
+    python geotab_stub.py --devices 1000 --throttle-rps 50
+"""
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DIAGNOSTIC_SERIES = {
+    "DiagnosticOdometerId": "odometer",
+    "DiagnosticEngineHoursId": "engineHours",
+    "DiagnosticEngineHoursWrapperId": "engineHours",
+}
+
+
+# Synthetic group tree: the company, regions under it, depots under each region
+SYNTHETIC_REGIONS = ("North", "South", "East", "West")
+DEPOTS_PER_REGION = 3
+
+
+def synthetic_groups():
+    """{group id: {"name", "children"}} for the synthetic tree"""
+    groups = {"GroupCompanyId": {"name": "Company Group", "children": []}}
+    for r, region in enumerate(SYNTHETIC_REGIONS):
+        region_id = f"bR{r}"
+        groups["GroupCompanyId"]["children"].append(region_id)
+        groups[region_id] = {"name": region, "children": []}
+        for d in range(DEPOTS_PER_REGION):
+            depot_id = f"bD{r}{d}"
+            groups[region_id]["children"].append(depot_id)
+            groups[depot_id] = {"name": f"{region} Depot {d + 1}", "children": []}
+    return groups
+
+
+def synthetic_depot(index):
+    return f"bD{index % len(SYNTHETIC_REGIONS)}{index // len(SYNTHETIC_REGIONS) % DEPOTS_PER_REGION}"
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.rstrip("Z").split("+")[0])
+
+
+class GeotabStub:
+    """The stub's data and behavior, independent of the HTTP transport"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, throttle_rps=0, session_ttl=0, seed=42):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rps = throttle_rps
+        self.session_ttl = session_ttl
+        self.rng = random.Random(seed)
+        self.devices = {}  # id -> {"name", "serialNumber", "groups": [group id], "odometer": [(dt, value)], "engineHours": [...]}
+        self.groups = synthetic_groups()  # id -> {"name", "children": [group id]}
+        self.sessions = {}  # session id -> issued at (monotonic)
+        self.calls = Counter()
+        self.errors = Counter()
+        self._lock = threading.Lock()
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    # --- DATA ---
+
+    def load_telemetry(self, path):
+        with open(path) as f:
+            for i, line in enumerate(f):
+                record = json.loads(line)
+                self.devices[record["device"]] = {
+                    "name": record.get("name", record["device"]),
+                    "serialNumber": record.get("serialNumber"),
+                    "groups": record.get("groups") or [synthetic_depot(i)],
+                    "odometer": [(_parse_date(t), v) for t, v in record.get("odometer", [])],
+                    "engineHours": [(_parse_date(t), v) for t, v in record.get("engineHours", [])],
+                }
+        return len(self.devices)
+
+    def add_synthetic_devices(self, count, first_id=1):
+        now = datetime.utcnow()
+        for i in range(first_id, first_id + count):
+            meters = self.rng.uniform(1e6, 2.5e8)
+            seconds = self.rng.uniform(3.6e5, 2.9e7)
+            self.devices[f"b{i:x}"] = {
+                "name": f"Synthetic #{i}",
+                "serialNumber": f"G9{i:010d}",
+                "groups": [synthetic_depot(i)],
+                "odometer": [(now - timedelta(hours=1), meters), (now, meters + self.rng.uniform(0, 30000))],
+                "engineHours": [(now - timedelta(hours=1), seconds), (now, seconds + self.rng.uniform(0, 3600))],
+            }
+
+    # --- JSON-RPC ---
+
+    def handle(self, method, params, nested=False):
+        """Returns (result, error) for one JSON-RPC call"""
+        with self._lock:
+            self.calls[method] += 1
+            if method == "Get":
+                self.calls[f"Get:{params.get('typeName')}"] += 1
+        if nested:
+            # Calls inside ExecuteMultiCall share the outer request's latency and quota
+            return self._dispatch(method, params)
+
+        delay = self.latency_ms + (self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+        if self.throttle_rps and self._over_limit():
+            return self._error("OverLimitException", "API calls quota exceeded.")
+        return self._dispatch(method, params)
+
+    def _dispatch(self, method, params):
+        if method == "Authenticate":
+            return self._authenticate(params), None
+        if self.error_rate and self.rng.random() < self.error_rate:
+            return self._error("DbUnavailableException", "Simulated transient failure.")
+
+        credentials = params.get("credentials") or {}
+        if method == "ExtendSession":
+            credentials = {"sessionId": params.get("sessionId")}
+        if not self._session_valid(credentials.get("sessionId")):
+            return self._error("InvalidUserException", "Incorrect login credentials")
+
+        if method == "ExtendSession":
+            with self._lock:
+                self.sessions[params.get("sessionId")] = time.monotonic()
+            return {}, None
+        if method == "ExecuteMultiCall":
+            results = []
+            for call in params.get("calls", []):
+                result, error = self.handle(call.get("method"), dict(call.get("params", {}), credentials=credentials), nested=True)
+                if error:
+                    return None, error
+                results.append(result)
+            return results, None
+        if method == "Get":
+            return self._get(params), None
+        return self._error("MissingMethodException", f"Unknown method {method}")
+
+    def _error(self, name, message):
+        with self._lock:
+            self.errors[name] += 1
+        return None, {"message": message, "code": -32000, "errors": [{"name": name, "message": message}]}
+
+    def _over_limit(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._window_start >= 1.0:
+                self._window_start = now
+                self._window_count = 0
+            self._window_count += 1
+            return self._window_count > self.throttle_rps
+
+    def _authenticate(self, params):
+        session_id = uuid.uuid4().hex
+        with self._lock:
+            self.sessions[session_id] = time.monotonic()
+        return {
+            "path": "ThisServer",
+            "credentials": {"userName": params.get("userName"), "sessionId": session_id, "database": params.get("database")},
+        }
+
+    def _session_valid(self, session_id):
+        with self._lock:
+            issued = self.sessions.get(session_id)
+        if issued is None:
+            return False
+        return not self.session_ttl or time.monotonic() - issued < self.session_ttl
+
+    def _get(self, params):
+        type_name = params.get("typeName")
+        search = params.get("search") or {}
+        limit = params.get("resultsLimit") or search.get("take")
+
+        if type_name == "Device":
+            ids = [search["id"]] if search.get("id") else list(self.devices)
+            results = [{"id": d, "name": self.devices[d]["name"], "serialNumber": self.devices[d]["serialNumber"],
+                        "groups": [{"id": g} for g in self.devices[d].get("groups") or ["GroupCompanyId"]]}
+                       for d in ids if d in self.devices]
+            return results[:limit] if limit else results
+
+        if type_name == "Group":
+            results = [{"id": g, "name": group["name"], "children": [{"id": c} for c in group["children"]]}
+                       for g, group in self.groups.items()]
+            return results[:limit] if limit else results
+
+        if type_name == "StatusData":
+            device = self.devices.get((search.get("deviceSearch") or {}).get("id"))
+            series = DIAGNOSTIC_SERIES.get((search.get("diagnosticSearch") or {}).get("id"))
+            if not device or not series:
+                return []
+            readings = device[series]
+            now = datetime.utcnow()
+            from_date = _parse_date(search.get("fromDate"))
+            to_date = min(_parse_date(search.get("toDate")) or now, now)
+            start = bisect.bisect_left(readings, (from_date,)) if from_date else 0
+            end = bisect.bisect_right(readings, (to_date, float("inf")))
+            window = readings[start:end]
+            if limit:
+                window = window[:limit]
+            diag = (search.get("diagnosticSearch") or {}).get("id")
+            return [{"device": {"id": search["deviceSearch"]["id"]}, "diagnostic": {"id": diag},
+                     "dateTime": dt.isoformat() + "Z", "data": value} for dt, value in window]
+
+        return []
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+            self.errors.clear()
+
+
+def serve(stub, host="127.0.0.1", port=0):
+    """Start the stub on a background thread. Returns (server, url)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True # headers and body are separate writes
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            request = json.loads(body or b"{}")
+            result, error = stub.handle(request.get("method"), request.get("params") or {})
+            payload = {"id": request.get("id", -1)}
+            if error:
+                payload["error"] = error
+            else:
+                payload["result"] = result
+            data = json.dumps(payload).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="geotab-stub", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/apiv1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Geotab JSON-RPC stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--telemetry", help="Telemetry JSON lines from generate_fleet.py --telemetry-out")
+    parser.add_argument("--devices", type=int, default=0, help="Synthetic devices to add (b1, b2, ...)")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls failing with DbUnavailableException")
+    parser.add_argument("--throttle-rps", type=int, default=0, help="Answer OverLimitException beyond this many calls/second")
+    parser.add_argument("--session-ttl", type=float, default=0, help="Seconds before a session returns InvalidUserException")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    stub = GeotabStub(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rps, args.session_ttl, args.seed)
+    if args.telemetry:
+        print(f"📼 Loaded {stub.load_telemetry(args.telemetry)} devices from {args.telemetry}")
+    if args.devices:
+        stub.add_synthetic_devices(args.devices)
+    server, url = serve(stub, args.host, args.port)
+    print(f"🛰️ Geotab stub listening on {url} ({len(stub.devices)} devices). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
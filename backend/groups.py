@@ -0,0 +1,337 @@
+"""
+Geotab groups: per-region and per-depot views of the fleet.
+
+sync_vehicles pulls the group tree from Geotab (each Group lists its children)
+and every device's direct groups. The hierarchy is stored as a closure table,
+group_closure, with one row per (ancestor, descendant) pair, so "every vehicle
+under Northeast" is one indexed join however deep the tree goes, and filtering
+an endpoint by group is an IN (members(group_id)).
+
+Per-group aggregates are cached in group_stats:
+  - total_cost, log_count, serviced_30d and due_count are adjusted by every log
+    written through the API, in the same transaction (record_log);
+  - telemetry moves due_count by how many of each changed vehicle's schedules
+    became (or stopped being) due (adjust_due);
+  - membership and deletes change who is in the group, which a single row
+    can't track, so those only mark the groups above them stale.
+refresh() recomputes groups from scratch with a few GROUP BY queries however
+many it is given, which also corrects any drift, and upserts the rows so two
+refreshes of the same group can overlap. Only the "groups" job in sync_service
+runs it, for stale groups and ones older than GROUP_STATS_TTL (the 30-day
+window moves on its own); reads serve the cached rows as they are.
+
+Every tenant (see tenants.py) has its own tree, synced with its devices; group
+ids only mean something within their tenant.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, case, delete, distinct, func, insert, or_, select, true, update
+
+import database as db_mod
+
+GROUP_STATS_TTL = int(os.getenv("GROUP_STATS_TTL", "300")) # seconds before a group's stats are recomputed
+GROUP_STATS_INTERVAL = int(os.getenv("GROUP_STATS_INTERVAL", "120")) # seconds between refresh runs in sync_service
+CHUNK = 500 # ids per IN clause
+
+log = logging.getLogger("geotrack.groups")
+
+
+class AmbiguousGroup(ValueError):
+    pass
+
+
+def _chunks(ids):
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK):
+        yield ids[start:start + CHUNK]
+
+
+def members(group_id):
+    """SELECT of the ids of every vehicle in this group or below it, for .in_()"""
+    closure, links = db_mod.GroupClosure.__table__, db_mod.VehicleGroup.__table__
+    return select(links.c.vehicle_id).join(closure, closure.c.descendant_id == links.c.group_id)\
+        .where(closure.c.ancestor_id == group_id)
+
+
+def _above_vehicles(vehicle_ids):
+    """SELECT of every group these vehicles are in, directly or below it"""
+    closure, links = db_mod.GroupClosure.__table__, db_mod.VehicleGroup.__table__
+    return select(closure.c.ancestor_id).join(links, links.c.group_id == closure.c.descendant_id)\
+        .where(links.c.vehicle_id.in_(vehicle_ids))
+
+
+def lookup(db, geotab_id, tenant_id=None):
+    """
+    Internal id of a group from its Geotab id (within this tenant, if given), or None.
+    Without a tenant, AmbiguousGroup if several tenants have a group with that id.
+    """
+    groups = db_mod.FleetGroup.__table__
+    query = select(groups.c.id).where(groups.c.geotab_id == geotab_id)
+    if tenant_id is not None:
+        query = query.where(groups.c.tenant_id == tenant_id)
+    found = db.execute(query.order_by(groups.c.id).limit(2)).scalars().all()
+    if len(found) > 1:
+        raise AmbiguousGroup(ambiguity(geotab_id))
+    return found[0] if found else None
+
+
+def ambiguity(geotab_id):
+    return f"Group {geotab_id} exists in several tenants; select one with the X-Tenant header"
+
+
+def count_due(schedules, mileage, hours):
+    """
+    How many of these schedules are due at this mileage and these hours. Same rule as the
+    maintenance alerts: usage has reached last service + interval.
+    """
+    usage = {"miles": mileage, "hours": hours}
+    return sum(1 for s in schedules if usage.get(s.tracking_type) is not None and s.interval_value is not None
+               and usage[s.tracking_type] >= (s.last_performed_value or 0.0) + s.interval_value)
+
+
+# --- SYNC ---
+
+def closure_rows(parents):
+    """{group id: parent id or None} -> group_closure rows. A cycle in the data ends the walk instead of looping."""
+    rows = []
+    for group_id in parents:
+        node, depth, seen = group_id, 0, set()
+        while node is not None and node not in seen:
+            rows.append({"ancestor_id": node, "descendant_id": group_id, "depth": depth})
+            seen.add(node)
+            node, depth = parents.get(node), depth + 1
+    return rows
+
+
+def sync_groups(db, remote, tenant_id=db_mod.DEFAULT_TENANT):
+    """
+    Store one tenant's Geotab groups (dicts with id, name, children) and rebuild its part of
+    the closure table when the hierarchy changed. Returns {Geotab id: group id}. Does not commit.
+    """
+    groups, closure = db_mod.FleetGroup.__table__, db_mod.GroupClosure.__table__
+    stats, links = db_mod.GroupStats.__table__, db_mod.VehicleGroup.__table__
+    own = groups.c.tenant_id == tenant_id
+    existing = {row.geotab_id: row for row in db.execute(
+        select(groups.c.id, groups.c.geotab_id, groups.c.name, groups.c.parent_id).where(own))}
+    if not remote:
+        # An empty answer is an API problem, not a company without groups
+        return {geotab_id: row.id for geotab_id, row in existing.items()}
+
+    names = {g["id"]: g.get("name") or g["id"] for g in remote}
+    parent_of = {child["id"]: g["id"] for g in remote for child in g.get("children") or [] if child["id"] in names}
+    now = datetime.utcnow()
+    new = [{"tenant_id": tenant_id, "geotab_id": geotab_id, "name": name, "synced_at": now}
+           for geotab_id, name in names.items() if geotab_id not in existing]
+    if new:
+        db.execute(insert(groups), new)
+    ids = {geotab_id: group_id for group_id, geotab_id in db.execute(select(groups.c.id, groups.c.geotab_id).where(own))}
+    if new:
+        db.execute(insert(stats), [{"group_id": ids[g["geotab_id"]], "stale": True} for g in new])
+
+    changes, moved = [], False
+    for geotab_id, name in names.items():
+        row, parent = existing.get(geotab_id), ids.get(parent_of.get(geotab_id))
+        if row is None:
+            if parent is not None:
+                changes.append({"gid": ids[geotab_id], "name": name, "parent": parent, "now": now})
+        elif row.name != name or row.parent_id != parent:
+            changes.append({"gid": row.id, "name": name, "parent": parent, "now": now})
+            moved = moved or row.parent_id != parent
+    if changes:
+        db.execute(update(groups).where(groups.c.id == bindparam("gid"))
+                   .values(name=bindparam("name"), parent_id=bindparam("parent"), synced_at=bindparam("now")), changes)
+
+    gone = [row.id for geotab_id, row in existing.items() if geotab_id not in names]
+    if gone:
+        db.execute(update(groups).where(groups.c.parent_id.in_(gone)).values(parent_id=None))
+        for table, column in ((links, links.c.group_id), (stats, stats.c.group_id), (closure, closure.c.descendant_id),
+                              (closure, closure.c.ancestor_id), (groups, groups.c.id)):
+            db.execute(delete(table).where(column.in_(gone)))
+
+    if new or moved or gone:
+        parents = {ids[geotab_id]: ids.get(parent_of.get(geotab_id)) for geotab_id in names}
+        tree = select(groups.c.id).where(own)
+        db.execute(delete(closure).where(closure.c.descendant_id.in_(tree)))
+        db.execute(insert(closure), closure_rows(parents))
+        # Every one of this tenant's groups may have new members
+        db.execute(update(stats).where(stats.c.group_id.in_(tree)).values(stale=True))
+        log.info("Group hierarchy rebuilt", extra={"tenant_id": tenant_id, "groups": len(names), "added": len(new),
+                                                   "removed": len(gone)})
+    return {geotab_id: ids[geotab_id] for geotab_id in names}
+
+
+def sync_memberships(db, assigned, group_ids):
+    """
+    Make vehicle_groups match {vehicle id: Geotab group ids} for these vehicles, and mark
+    the groups above anything that changed stale. Returns (added, removed). Does not commit.
+    """
+    links = db_mod.VehicleGroup.__table__
+    wanted = {(vehicle_id, group_ids[g]) for vehicle_id, names in assigned.items() for g in names if g in group_ids}
+    current = set()
+    for chunk in _chunks(assigned):
+        current.update((v, g) for v, g in db.execute(select(links.c.vehicle_id, links.c.group_id).where(links.c.vehicle_id.in_(chunk))))
+    added, removed = wanted - current, current - wanted
+    if added:
+        db.execute(insert(links), [{"vehicle_id": v, "group_id": g} for v, g in sorted(added)])
+    if removed:
+        db.execute(delete(links).where(links.c.vehicle_id == bindparam("v"), links.c.group_id == bindparam("g")),
+                   [{"v": v, "g": g} for v, g in removed])
+    mark_stale(db, group_ids={g for _, g in added | removed})
+    return len(added), len(removed)
+
+
+def mark_stale(db, vehicle_ids=(), group_ids=()):
+    """Flag every group above these vehicles and groups for a refresh. Does not commit."""
+    stats, closure = db_mod.GroupStats.__table__, db_mod.GroupClosure.__table__
+    for chunk in _chunks(vehicle_ids):
+        db.execute(update(stats).where(stats.c.group_id.in_(_above_vehicles(chunk)), stats.c.stale == False).values(stale=True))
+    for chunk in _chunks(group_ids):
+        above = select(closure.c.ancestor_id).where(closure.c.descendant_id.in_(chunk))
+        db.execute(update(stats).where(stats.c.group_id.in_(above), stats.c.stale == False).values(stale=True))
+
+
+def record_log(db, vehicle_id, cost, first_in_30d=False, due_change=0):
+    """
+    Add one maintenance log to the stats of every group above its vehicle, in one UPDATE.
+    first_in_30d: the vehicle had no other log in the last 30 days; due_change: -1 if the
+    log took a due schedule out of due. Does not commit.
+    """
+    stats = db_mod.GroupStats.__table__
+    db.execute(update(stats).where(stats.c.group_id.in_(_above_vehicles([vehicle_id]))).values(
+        total_cost=stats.c.total_cost + (cost or 0.0),
+        log_count=stats.c.log_count + 1,
+        serviced_30d=stats.c.serviced_30d + (1 if first_in_30d else 0),
+        due_count=stats.c.due_count + due_change,
+    ))
+
+
+def adjust_due(db, changes):
+    """
+    Move due_count of every group above these vehicles by {vehicle id: change in due schedules},
+    counting a vehicle once per group even when it sits in two of its subgroups. Does not commit.
+    """
+    stats, closure, links = db_mod.GroupStats.__table__, db_mod.GroupClosure.__table__, db_mod.VehicleGroup.__table__
+    changes = {vehicle_id: change for vehicle_id, change in changes.items() if change}
+    by_group = {}
+    for chunk in _chunks(changes):
+        for group_id, vehicle_id in db.execute(
+                select(closure.c.ancestor_id, links.c.vehicle_id).join(links, links.c.group_id == closure.c.descendant_id)
+                .where(links.c.vehicle_id.in_(chunk)).distinct()):
+            by_group[group_id] = by_group.get(group_id, 0) + changes[vehicle_id]
+    moved = [{"gid": group_id, "change": change} for group_id, change in by_group.items() if change]
+    if moved:
+        db.execute(update(stats).where(stats.c.group_id == bindparam("gid"))
+                   .values(due_count=stats.c.due_count + bindparam("change")), moved)
+    return len(moved)
+
+
+# --- AGGREGATES ---
+
+def _upsert(db, rows):
+    """Insert or overwrite group_stats rows (ON CONFLICT DO UPDATE), so concurrent refreshes don't collide"""
+    stats = db_mod.GroupStats.__table__
+    if db_mod.engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as upsert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as upsert
+    statement = upsert(stats)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[stats.c.group_id],
+        set_={column: statement.excluded[column] for column in rows[0] if column != "group_id"}), rows)
+
+
+def refresh(db, group_ids, now=None):
+    """Recompute group_stats for these groups: three GROUP BY queries per CHUNK groups, then one upsert. Does not commit."""
+    now = now or datetime.utcnow()
+    closure, links = db_mod.GroupClosure.__table__, db_mod.VehicleGroup.__table__
+    vehicles, logs = db_mod.Vehicle.__table__, db_mod.MaintenanceLog.__table__
+    schedules, tasks = db_mod.MaintenanceSchedule.__table__, db_mod.MaintenanceTask.__table__
+    done = 0
+    for chunk in _chunks(group_ids):
+        # (group, vehicle) for every live vehicle under each group, once even if it sits in two subgroups
+        member = select(closure.c.ancestor_id.label("group_id"), links.c.vehicle_id)\
+            .join(links, links.c.group_id == closure.c.descendant_id)\
+            .join(vehicles, and_(vehicles.c.id == links.c.vehicle_id, vehicles.c.deleted_at.is_(None)))\
+            .where(closure.c.ancestor_id.in_(chunk)).distinct().subquery()
+
+        counts = dict(db.execute(select(member.c.group_id, func.count()).group_by(member.c.group_id)).all())
+        recent = case((logs.c.performed_date >= now - timedelta(days=30), logs.c.vehicle_id))
+        totals = {g: (cost, n, serviced) for g, cost, n, serviced in db.execute(
+            select(member.c.group_id, func.coalesce(func.sum(logs.c.cost), 0.0), func.count(logs.c.id), func.count(distinct(recent)))
+            .join(logs, logs.c.vehicle_id == member.c.vehicle_id).group_by(member.c.group_id))}
+        usage = case((schedules.c.tracking_type == "miles", vehicles.c.current_mileage),
+                     (schedules.c.tracking_type == "hours", vehicles.c.current_hours))
+        interval = func.coalesce(schedules.c.interval_value, tasks.c.interval_value)
+        due = dict(db.execute(
+            select(member.c.group_id, func.count(schedules.c.id))
+            .join(schedules, schedules.c.vehicle_id == member.c.vehicle_id)
+            .join(vehicles, vehicles.c.id == schedules.c.vehicle_id)
+            .outerjoin(tasks, tasks.c.id == schedules.c.task_id)
+            .where(schedules.c.is_active == True, usage >= func.coalesce(schedules.c.last_performed_value, 0.0) + interval)
+            .group_by(member.c.group_id)).all())
+
+        rows = []
+        for group_id in chunk:
+            cost, n, serviced = totals.get(group_id, (0.0, 0, 0))
+            rows.append({"group_id": group_id, "vehicles": counts.get(group_id, 0), "total_cost": cost, "log_count": n,
+                         "due_count": due.get(group_id, 0), "serviced_30d": serviced, "stale": False, "refreshed_at": now})
+        _upsert(db, rows)
+        done += len(rows)
+    return done
+
+
+def needs_refresh(now=None):
+    """Condition on group_stats for rows that are stale or older than GROUP_STATS_TTL"""
+    stats = db_mod.GroupStats.__table__
+    cutoff = (now or datetime.utcnow()) - timedelta(seconds=GROUP_STATS_TTL)
+    return or_(stats.c.stale == True, stats.c.refreshed_at.is_(None), stats.c.refreshed_at < cutoff)
+
+
+def refresh_due(db):
+    """Refresh every group whose stats are stale or expired. Returns the number refreshed. Does not commit."""
+    stats = db_mod.GroupStats.__table__
+    ids = list(db.execute(select(stats.c.group_id).where(needs_refresh())).scalars())
+    if ids:
+        refresh(db, ids)
+        log.info("Group stats refreshed", extra={"groups": len(ids)})
+    return len(ids)
+
+
+def _as_dict(row):
+    vehicles = row.vehicles or 0
+    return {
+        "id": row.geotab_id,
+        "tenant_id": row.tenant_id,
+        "name": row.name,
+        "parent": row.parent,
+        "vehicles": vehicles,
+        "total_maintenance_cost": row.total_cost or 0.0,
+        "log_count": row.log_count or 0,
+        "due_count": row.due_count or 0,
+        "vehicles_in_shop_last_30d": row.serviced_30d or 0,
+        # Same formula as /analytics/health
+        "health_index": int((vehicles - (row.serviced_30d or 0)) / vehicles * 100) if vehicles else 100,
+        "refreshed_at": row.refreshed_at,
+    }
+
+
+def current_stats(geotab_ids=None, tenant_id=None):
+    """
+    [stats dict] for these groups (by Geotab id; all when None) of this tenant (every tenant
+    when None), as last refreshed: stale rows are served as they are until the groups job gets to them.
+    """
+    groups, stats = db_mod.FleetGroup.__table__, db_mod.GroupStats.__table__
+    parent = groups.alias("parent")
+    scope = groups.c.geotab_id.in_(geotab_ids) if geotab_ids is not None else true()
+    if tenant_id is not None:
+        scope = and_(scope, groups.c.tenant_id == tenant_id)
+    with db_mod.engine.connect() as conn:
+        rows = conn.execute(
+            select(groups.c.geotab_id, groups.c.tenant_id, groups.c.name, parent.c.geotab_id.label("parent"), stats)
+            .outerjoin(stats, stats.c.group_id == groups.c.id)
+            .outerjoin(parent, parent.c.id == groups.c.parent_id)
+            .where(scope).order_by(groups.c.name)
+        ).all()
+    return [_as_dict(row) for row in rows]
@@ -0,0 +1,97 @@
+"""
+Health probes that cost (almost) nothing.
+
+    /health/live     process is up; no I/O
+    /health/ready    one SELECT 1 through the pool, bounded by HEALTH_READY_TIMEOUT;
+                     concurrent probes share a single in-flight check
+    /health/details  counts, sync lag and pool usage from a snapshot refreshed at
+                     most every HEALTH_SNAPSHOT_TTL seconds (stale-while-revalidate)
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+
+from fastapi.concurrency import run_in_threadpool
+
+import metrics
+
+HEALTH_READY_TIMEOUT = float(os.getenv("HEALTH_READY_TIMEOUT", "2")) # seconds
+HEALTH_SNAPSHOT_TTL = float(os.getenv("HEALTH_SNAPSHOT_TTL", "30")) # seconds
+
+log = logging.getLogger("geotrack.health")
+
+
+# sqlalchemy is imported inside the probes so /health/live works before (or without) the database layer
+
+def ping(engine):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+def collect(db_mod, engine):
+    """Everything /health/details reports, in two queries"""
+    from sqlalchemy import func, select
+    snapshot = {"generated_at": datetime.utcnow().isoformat() + "Z", "pool": metrics.pool_usage(engine)}
+    count = lambda model, *where: select(func.count()).select_from(model).where(*where).scalar_subquery()
+    with engine.connect() as conn:
+        users, vehicles, schedules, tickets, purges = conn.execute(select(
+            count(db_mod.User),
+            count(db_mod.Vehicle, db_mod.Vehicle.deleted_at.is_(None)),
+            count(db_mod.MaintenanceSchedule, db_mod.MaintenanceSchedule.is_active == True),
+            count(db_mod.SupportTicket),
+            count(db_mod.PurgeJob, db_mod.PurgeJob.finished_at.is_(None)),
+        )).one()
+        heartbeats = conn.execute(select(db_mod.SyncHeartbeat.scope, db_mod.SyncHeartbeat.synced_at)).all()
+    snapshot.update(user_count=users, vehicle_count=vehicles, active_schedules=schedules, support_tickets=tickets, pending_purges=purges)
+
+    now = datetime.utcnow()
+    lags = {scope: round((now - synced_at).total_seconds(), 1) for scope, synced_at in heartbeats if synced_at}
+    snapshot["sync"] = {
+        "lag_seconds": max(lags.values()) if lags else None, # the most stale partition
+        "scopes": lags,
+    }
+    return snapshot
+
+
+class Probes:
+    def __init__(self, ready_timeout=HEALTH_READY_TIMEOUT, snapshot_ttl=HEALTH_SNAPSHOT_TTL):
+        self.ready_timeout = ready_timeout
+        self.snapshot_ttl = snapshot_ttl
+        self._ready_check = None
+        self._snapshot = None
+        self._snapshot_at = 0.0
+        self._refresh = None
+
+    async def ready(self, engine):
+        """(ok, error). A hung database costs one blocked thread, not one per probe."""
+        if self._ready_check is None or self._ready_check.done():
+            self._ready_check = asyncio.ensure_future(run_in_threadpool(ping, engine))
+        try:
+            await asyncio.wait_for(asyncio.shield(self._ready_check), self.ready_timeout)
+            return True, None
+        except asyncio.TimeoutError:
+            return False, f"database did not answer within {self.ready_timeout:g}s"
+        except Exception as e:
+            return False, str(e)
+
+    async def _refresh_snapshot(self, db_mod, engine):
+        try:
+            self._snapshot = await run_in_threadpool(collect, db_mod, engine)
+        except Exception as e:
+            log.warning("Health snapshot failed: %s", e)
+            self._snapshot = {**(self._snapshot or {}), "error": str(e)}
+        self._snapshot_at = time.monotonic()
+
+    async def details(self, db_mod, engine):
+        """Cached snapshot; a stale one is returned immediately while a single refresh runs"""
+        stale = time.monotonic() - self._snapshot_at >= self.snapshot_ttl
+        if stale and (self._refresh is None or self._refresh.done()):
+            self._refresh = asyncio.ensure_future(self._refresh_snapshot(db_mod, engine))
+        if self._snapshot is None:
+            await asyncio.shield(self._refresh)
+        snapshot = dict(self._snapshot)
+        snapshot["age_seconds"] = round(time.monotonic() - self._snapshot_at, 1)
+        return snapshot
@@ -1,4 +1,4 @@
-from database import Base, engine
+import database
 print("Initializing database tables...")
-Base.metadata.create_all(bind=engine)
+database.init_db()
 print("Done!")
@@ -0,0 +1,153 @@
+"""
+Structured, non-blocking logging.
+
+Call configure() once per process. Application code logs through
+logging.getLogger("geotrack.<area>"); records are put on a bounded in-memory
+queue by a QueueHandler and formatted and written by a QueueListener thread,
+so the request or sync thread never waits on stdout.
+
+Environment:
+    LOG_LEVEL         DEBUG/INFO/WARNING/ERROR for geotrack.* loggers (default INFO)
+    LOG_ROOT_LEVEL    level for third-party libraries (default WARNING)
+    LOG_FORMAT        json (default) or text
+    LOG_QUEUE_SIZE    records buffered before new ones are dropped (default 10000)
+    LOG_SAMPLING      set to 0 to log every occurrence of sampled messages
+
+High-volume messages can be sampled per call site:
+    log.warning("vehicle sync failed", extra=sampled(100, vehicle_id=v.id))
+keeps the first occurrence and then one in every 100.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_ROOT_LEVEL = os.getenv("LOG_ROOT_LEVEL", "WARNING").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "1").lower() not in ("0", "false", "no")
+
+# Attributes every LogRecord has; anything else came in through extra= and is emitted as a field
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample_every"}
+
+_listener = None
+_configure_lock = threading.Lock()
+
+
+def sampled(every, **fields):
+    """extra= for a message that should only be logged once per `every` occurrences"""
+    fields["sample_every"] = every
+    return fields
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in N records per call site for records logged with extra=sampled(N)"""
+
+    def __init__(self):
+        super().__init__()
+        self._seen = {}
+
+    def filter(self, record):
+        every = getattr(record, "sample_every", None)
+        if not every or every <= 1 or not LOG_SAMPLING:
+            return True
+        key = (record.name, record.msg)
+        # A lost increment under a race only skews the sample slightly, so no lock
+        count = self._seen.get(key, 0)
+        self._seen[key] = count + 1
+        if count % every:
+            return False
+        if count:
+            record.sampled = f"1/{every}"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RESERVED}
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Never blocks the caller: when the queue is full the record is dropped and counted"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve the message and traceback now (arguments may change after we return),
+        # but leave JSON encoding and I/O to the listener thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure(level=None, fmt=None, stream=None):
+    """Route all logging through the queue. Safe to call more than once."""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(TextFormatter() if (fmt or LOG_FORMAT) == "text" else JsonFormatter())
+
+        log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        handler = DroppingQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter())
+
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(LOG_ROOT_LEVEL)
+        logging.getLogger("geotrack").setLevel(level or LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown)
+
+
+def shutdown():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
@@ -0,0 +1,147 @@
+import os
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, delete
+
+import database as db_mod
+
+log = logging.getLogger("geotrack.audit")
+
+# Configuration
+FLUSH_INTERVAL_MS = int(os.getenv("LOGIN_AUDIT_FLUSH_MS", "500"))
+BATCH_SIZE = int(os.getenv("LOGIN_AUDIT_BATCH_SIZE", "100"))
+MAX_BUFFER = int(os.getenv("LOGIN_AUDIT_MAX_BUFFER", "10000")) # Drop events beyond this if the DB is down
+RETENTION_DAYS = int(os.getenv("LOGIN_LOG_RETENTION_DAYS", "90"))
+PRUNE_INTERVAL = 3600 # seconds
+PRUNE_BATCH_SIZE = 5000
+# Serverless hosts (Vercel) freeze or drop the process between requests without running shutdown
+# hooks, so anything still buffered would be lost: write each event through on the request instead
+WRITE_THROUGH = os.getenv("LOGIN_AUDIT_WRITE_THROUGH", "1" if os.getenv("VERCEL") else "0") == "1"
+
+
+def _is_memory_db():
+    # Every pooled connection to an in-memory SQLite DB sees its own empty database,
+    # so a background thread would write somewhere the API can never read.
+    url = db_mod.engine.url
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+class LoginAuditWriter:
+    """Buffers login events in memory and writes them in batched INSERTs off the request path"""
+
+    def __init__(self, flush_interval_ms=FLUSH_INTERVAL_MS, batch_size=BATCH_SIZE, max_buffer=MAX_BUFFER):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self._buffer = deque(maxlen=max_buffer) # oldest dropped first once full
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_prune = None
+        self.dropped = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running or _is_memory_db() or WRITE_THROUGH:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="login-audit-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and flush whatever is still buffered"""
+        if self.running:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join(timeout=10)
+        self._thread = None
+        self.flush()
+
+    def record(self, user_id, email, login_time=None):
+        event = {
+            "user_id": user_id,
+            "email": email,
+            "login_time": login_time or datetime.utcnow(),
+        }
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+            self._buffer.append(event)
+            pending = len(self._buffer)
+
+        if not self.running:
+            # No writer thread (scripts, in-memory DB, serverless): write through immediately
+            self.flush()
+        elif pending >= self.batch_size:
+            self._wake.set()
+
+    def flush(self):
+        """Write all buffered events. Returns the number of rows inserted."""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._buffer)
+                self._buffer.clear()
+            if not rows:
+                return 0
+
+            try:
+                with db_mod.engine.begin() as conn:
+                    for i in range(0, len(rows), self.batch_size):
+                        conn.execute(insert(db_mod.LoginLog.__table__), rows[i:i + self.batch_size])
+                return len(rows)
+            except Exception as e:
+                log.warning("Failed to write login logs: %s", e, extra={"rows": len(rows)})
+                # Put them back (oldest first) so the next flush retries, within the buffer cap
+                with self._lock:
+                    self._buffer = deque(rows + list(self._buffer), maxlen=self.max_buffer)
+                return 0
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+            now = datetime.utcnow()
+            if self._last_prune is None or now - self._last_prune >= timedelta(seconds=PRUNE_INTERVAL):
+                self._last_prune = now
+                try:
+                    prune_login_logs()
+                except Exception as e:
+                    log.warning("Login log pruning failed: %s", e)
+
+
+def prune_login_logs(retention_days=RETENTION_DAYS, batch_size=PRUNE_BATCH_SIZE):
+    """Delete login logs older than the retention window in short, bounded transactions"""
+    if retention_days <= 0:
+        return 0
+
+    table = db_mod.LoginLog.__table__
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    total = 0
+    while True:
+        with db_mod.engine.begin() as conn:
+            ids = conn.execute(
+                select(table.c.id).where(table.c.login_time < cutoff).order_by(table.c.login_time).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(delete(table).where(table.c.id.in_(ids)))
+        total += len(ids)
+        if len(ids) < batch_size:
+            break
+    return total
+
+
+writer = LoginAuditWriter()
+
+if __name__ == "__main__":
+    removed = prune_login_logs()
+    print(f"Pruned {removed} login log(s) older than {RETENTION_DAYS} days.")
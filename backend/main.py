@@ -1,8 +1,11 @@
+import time
+_BOOT_STARTED = time.perf_counter()
+
 import os
 # Force Reload
 import traceback
 import sys
-import shutil
+import logging
 from datetime import datetime, timedelta
 from typing import List, Optional
 from contextlib import asynccontextmanager
@@ -12,13 +15,23 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 
 # Third-party imports
-from fastapi import FastAPI, Depends, HTTPException, Request, status, File, UploadFile, Form
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, Depends, HTTPException, Request, status, File, UploadFile, Form, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter
 
+import attachments
 import email_utils
+import health
+import log_config
+import metrics
+import response_encoding
+import startup_profile
+
+log_config.configure()
+log = logging.getLogger("geotrack.api")
 
 # --- CONFIGURATION ---
 SECRET_KEY = os.getenv("SECRET_KEY", "change_this_to_a_secure_random_string")
@@ -38,78 +51,128 @@ pwd_context = None
 pwd_context = None
 text = None
 joinedload = None
+audit_mod = None
+stats_mod = None
+settings_mod = None
+purge_mod = None
+enroll_mod = None
+groups_mod = None
+tasks_mod = None
+snapshot_mod = None
+tenants_mod = None
+
+profiler = startup_profile.StartupProfiler(_BOOT_STARTED)
+probes = health.Probes()
+
+def seed_admin_user():
+    db = db_mod.SessionLocal()
+    try:
+        admin_email = "admin@geotrack.pro"
+        existing = db.query(db_mod.User).filter(db_mod.User.email == admin_email).first()
+        if not existing:
+            log.info("Seeding admin user", extra={"email": admin_email})
+            hashed_pw = get_password_hash("password123")
+
+            admin_user = db_mod.User(
+                email=admin_email,
+                hashed_password=hashed_pw,
+                full_name="Fleet Manager"
+            )
+            db.add(admin_user)
+            db.commit()
+    except Exception as seed_err:
+        log.warning("Startup seed failed: %s", seed_err)
+    finally:
+        db.close()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global SAFE_MODE_ERROR
-    global jwt, CryptContext, Session, db_mod, engine, pwd_context, text, joinedload
+    global Session, db_mod, engine, text, joinedload, audit_mod, stats_mod, settings_mod, purge_mod, enroll_mod, tasks_mod, groups_mod, snapshot_mod, tenants_mod
     
-    print("BACKEND STARTING UP...")
+    log.info("Backend starting up")
+    profiler.mark("import:app", _BOOT_STARTED)
     try:
-        # 1. Critical Imports
-        from jose import JWTError
-        import jose.jwt as jwt_lib
-        jwt = jwt_lib
+        # 1. Critical Imports (jose/passlib are loaded lazily on first auth request)
+        with profiler.phase("import:sqlalchemy"):
+            from sqlalchemy.orm import Session as Sess, joinedload as joinedload_lib
+            from sqlalchemy import text as s_text # Import text for raw SQL
+            Session = Sess
+            joinedload = joinedload_lib
+            text = s_text
         
-        from passlib.context import CryptContext as CC
-        CryptContext = CC
+        with profiler.phase("import:database"):
+            import database as db_module
+            db_mod = db_module
+        
+        # 2. Schema: one cheap version check, migrations only when behind
+        with profiler.phase("schema_check"):
+            import migrations
+            current_version = migrations.current_version()
+        
+        if current_version < migrations.LATEST_VERSION:
+            log.info("Running database migrations", extra={"from_version": current_version, "to_version": migrations.LATEST_VERSION})
+            with profiler.phase("migrations"):
+                if not db_mod.init_db():
+                    # Do NOT raise, let the app start so we can see health check errors
+                    log.warning("Migrations failed (likely connection issue)")
+            
+            # 3. Seed Admin User (only needed on a fresh or upgraded database)
+            with profiler.phase("seed_admin"):
+                try:
+                    seed_admin_user()
+                except Exception as db_err:
+                    log.warning("Database connection failed while seeding: %s", db_err)
         
-        from sqlalchemy.orm import Session as Sess, sessionmaker, joinedload as joinedload_lib
-        Session = Sess
-        joinedload = joinedload_lib
+        # init_db() may have swapped in an in-memory engine
+        engine = db_mod.engine
+        log.info("Database configured", extra={"backend": engine.url.get_backend_name(), "database_url_set": os.getenv("DATABASE_URL") is not None})
         
-        import database as db_module
-        db_mod = db_module
-        from database import engine as db_engine
-        engine = db_engine
+        # Per-request statement counting (see query_stats.py)
+        import query_stats
+        query_stats.install(engine)
+        stats_mod = query_stats
         
-        import migrate_db
-        import migrate_notifications
+        # Settings are cached in-process (see settings_service.py)
+        import settings_service
+        settings_mod = settings_service
         
-        # Run Migrations (Safe to run every time)
-        # Run Migrations (Safe to run every time)
-        print("Running Database Migrations...")
-        try:
-            migrate_db.add_column()
-            migrate_notifications.create_table()
-        except Exception as e:
-            print(f"WARNING: Migrations failed (likely connection issue): {e}")
-            # Do NOT raise, let the app start so we can see health check errors
-            pass
+        # 4. Optional asyncio engine for read-heavy endpoints (see run_read)
+        async_engine = None
+        if db_mod.DB_ASYNC:
+            with profiler.phase("async_engine"):
+                try:
+                    async_engine = db_mod.init_async_engine()
+                    if async_engine is None:
+                        log.warning("DB_ASYNC ignored for in-memory SQLite")
+                    else:
+                        query_stats.install(async_engine.sync_engine)
+                        log.info("Async database engine enabled", extra={"driver": async_engine.url.drivername})
+                except Exception as async_err: # e.g. asyncpg/aiosqlite not installed
+                    log.warning("Async database engine unavailable, using the threadpool: %s", async_err)
+        metrics.watch_pool(engine, async_engine)
         
-        from sqlalchemy import text as s_text # Import text for raw SQL
-        text = s_text
-
-        # Initialize Security Context
-        pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
-
-        # 2. Database Checks
-        print(f"Database URL configured (Is None? {os.getenv('DATABASE_URL') is None})")
+        # Login audit trail is written in batches by a background thread
+        with profiler.phase("audit_writer"):
+            import login_audit
+            audit_mod = login_audit
+            audit_mod.writer.start()
         
-        # 3. Seed Admin User
-        try:
-            # We must use the imported module
-            db = db_mod.SessionLocal()
-            try:
-                admin_email = "admin@geotrack.pro"
-                existing = db.query(db_mod.User).filter(db_mod.User.email == admin_email).first()
-                if not existing:
-                    print(f"Seeding admin user: {admin_email}")
-                    hashed_pw = pwd_context.hash("password123")
-                    
-                    admin_user = db_mod.User(
-                        email=admin_email, 
-                        hashed_password=hashed_pw, 
-                        full_name="Fleet Manager"
-                    )
-                    db.add(admin_user)
-                    db.commit()
-            except Exception as seed_err:
-                print(f"Startup seed warning: {seed_err}")
-            finally:
-                db.close()
-        except Exception as db_err:
-            print(f"Database connection warning: {db_err}")
+        # Resume vehicle purges interrupted by the last shutdown (see purger.py)
+        import purger
+        purge_mod = purger
+        purge_mod.kick()
+        
+        import enrollment
+        import fleet_snapshot
+        import groups
+        import tasks
+        import tenants
+        enroll_mod = enrollment
+        snapshot_mod = fleet_snapshot
+        groups_mod = groups
+        tasks_mod = tasks
+        tenants_mod = tenants
             
     except Exception as e:
         # If critical imports fail, we capture the error
@@ -118,11 +181,17 @@ async def lifespan(app: FastAPI):
             "detail": str(e),
             "traceback": traceback.format_exc()
         }
-        print(f"CRITICAL IMPORT ERROR: {e}")
-        print("STARTING IN SAFE MODE")
+        log.critical("Critical import error, starting in safe mode: %s", e, exc_info=True)
+    
+    if startup_profile.STARTUP_PROFILE:
+        profiler.report()
     
     yield
-    print("BACKEND SHUTTING DOWN...")
+    log.info("Backend shutting down")
+    if audit_mod:
+        audit_mod.writer.stop()
+    if db_mod and db_mod.async_engine is not None:
+        await db_mod.async_engine.dispose()
 
 # --- APP INITIALIZATION ---
 app = FastAPI(
@@ -135,7 +204,7 @@ app = FastAPI(
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     error_msg = "".join(traceback.format_exception(None, exc, exc.__traceback__))
-    print(f"GLOBAL ERROR: {error_msg}")
+    log.error("Unhandled exception", exc_info=exc, extra={"method": request.method, "path": request.url.path})
     return JSONResponse(
         status_code=500,
         content={"detail": "Internal Server Error", "traceback": error_msg},
@@ -144,11 +213,57 @@ async def global_exception_handler(request: Request, exc: Exception):
 # 2. Safe Mode Middleware
 @app.middleware("http")
 async def check_safe_mode(request: Request, call_next):
-    if SAFE_MODE_ERROR and request.url.path != "/api/health" and request.url.path != "/health":
+    if SAFE_MODE_ERROR and not request.url.path.startswith(("/api/health", "/health")):
         return JSONResponse(status_code=503, content=SAFE_MODE_ERROR)
     return await call_next(request)
 
-# 3. CORS Middleware
+# 3. Request Instrumentation Middleware (latency metrics, Server-Timing, slow request log)
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    stats = token = None
+    if stats_mod and stats_mod.ENABLED:
+        stats, token = stats_mod.begin()
+    t0 = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        if token is not None:
+            stats_mod.end(token)
+        elapsed = time.perf_counter() - t0
+        # Label by route template, not raw path, so /logs/1../logs/9999 share one series
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.REQUEST_LATENCY.observe(elapsed, request.method, route, f"{status_code // 100}xx")
+    if stats is not None:
+        response.headers["Server-Timing"] = stats_mod.server_timing(stats, elapsed * 1000)
+        stats_mod.report(request.method, request.url.path, status_code, stats, elapsed * 1000)
+    return response
+
+# 4. Upload Size Limit (reject before the multipart body is spooled to disk)
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    if request.method == "POST" and request.url.path.endswith("/support/submit"):
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and int(length) > attachments.MAX_UPLOAD_BYTES + 64 * 1024: # room for the form fields
+            return JSONResponse(status_code=413, content={"detail": f"Attachment exceeds {attachments.MAX_UPLOAD_BYTES // (1024 * 1024)} MB"})
+    return await call_next(request)
+
+# 5. Tenant Selection (X-Tenant: <key>, or ?tenant= for download links, scopes the request; see tenants.py)
+@app.middleware("http")
+async def select_tenant(request: Request, call_next):
+    key = request.headers.get("x-tenant") or request.query_params.get("tenant")
+    if not key or not tenants_mod:
+        return await call_next(request)
+    try:
+        tenant = tenants_mod.cached(key) or await run_in_threadpool(tenants_mod.resolve, key)
+    except tenants_mod.TenantNotFound as e:
+        return JSONResponse(status_code=404, content={"detail": str(e)})
+    request.state.tenant = tenant
+    with db_mod.tenant_scope(tenant.id):
+        return await call_next(request)
+
+# 6. CORS Middleware
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -157,30 +272,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 7. Negotiated Response Encoding (gzip/brotli, MessagePack; see response_encoding.py)
+app.add_middleware(response_encoding.ResponseEncodingMiddleware)
+
 # --- SECURITY HELPERS ---
+def load_security():
+    """Import jose/passlib on first use so they stay off the cold-start path"""
+    global jwt, CryptContext, pwd_context
+    if pwd_context is None:
+        import jose.jwt as jwt_lib
+        from passlib.context import CryptContext as CC
+        jwt = jwt_lib
+        CryptContext = CC
+        pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+
 def get_password_hash(password):
-    if pwd_context:
-        return pwd_context.hash(password)
-    raise RuntimeError("Security context not initialized")
+    load_security()
+    return pwd_context.hash(password)
 
 def verify_password(plain_password, hashed_password):
-    if pwd_context:
-        return pwd_context.verify(plain_password, hashed_password)
-    raise RuntimeError("Security context not initialized")
+    load_security()
+    return pwd_context.verify(plain_password, hashed_password)
+
+# Helper for dependency injection
+def get_db_session():
+    # A generator dependency, so FastAPI closes the session (and returns its connection) after the request
+    if not db_mod:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+    yield from db_mod.get_db()
+
+async def run_read(query):
+    """Run query(session) for a read-only endpoint.
+
+    With DB_ASYNC the sync-style ORM code runs on the asyncio engine via
+    AsyncSession.run_sync, so the request holds no worker thread while it waits
+    on the database. Otherwise it runs on the threadpool with a regular session.
+    The session is closed before returning, so query() must load everything the
+    response needs.
+    """
+    if not db_mod:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+    if db_mod.AsyncSessionLocal is not None:
+        async with db_mod.AsyncSessionLocal() as session:
+            return await session.run_sync(query)
+    
+    def in_thread():
+        db = db_mod.SessionLocal()
+        try:
+            return query(db)
+        finally:
+            db.close()
+    return await run_in_threadpool(in_thread)
 
 # --- SECURITY SCHEME ---
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 def create_access_token(data: dict):
-    if not jwt:
-         raise RuntimeError("JWT library not initialized")
+    load_security()
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(lambda: next(get_db_session()))):
-    if not jwt:
+async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db_session)):
+    try:
+        load_security()
+    except ImportError:
         raise HTTPException(status_code=503, detail="Auth not initialized")
     
     credentials_exception = HTTPException(
@@ -214,9 +371,10 @@ class VehicleCreate(VehicleBase):
 class Schedule(BaseModel):
     id: int
     vehicle_id: int
+    task_id: Optional[int] = None
     task_name: str
     tracking_type: str
-    interval_value: float
+    interval_value: float # the vehicle's own, or its task's
     last_performed_value: float
     last_performed_date: datetime
     alert_thresholds: Optional[str] = None
@@ -239,19 +397,64 @@ class Vehicle(VehicleBase):
 
 class ScheduleCreate(BaseModel):
     vehicle_id: int
-    task_name: str
+    task_id: Optional[int] = None # or task_name; a new name creates the task from this schedule
+    task_name: Optional[str] = None
+    tracking_type: Optional[str] = None
+    interval_value: Optional[float] = None # omitted: follow the task
+    alert_thresholds: Optional[str] = None
+
+class TaskCreate(BaseModel):
+    name: str
     tracking_type: str
     interval_value: float
-    alert_thresholds: str
+    thresholds: List[float] = []
+
+class TaskUpdate(BaseModel):
+    name: Optional[str] = None
+    interval_value: Optional[float] = None
+    thresholds: Optional[List[float]] = None
+
+VehicleList = TypeAdapter(List[Vehicle])
+
+class LogEntry(BaseModel):
+    id: int
+    vehicle_id: Optional[int] = None
+    vehicle_name: str
+    task_name: Optional[str] = None
+    performed_date: Optional[datetime] = None
+    cost: Optional[float] = None
+    performed_at_mileage: Optional[float] = None
+    class Config:
+        from_attributes = True
+
+LogEntryList = TypeAdapter(List[LogEntry])
+
+class VehicleBulkCreate(BaseModel):
+    vehicles: List[VehicleCreate]
+    atomic: bool = True # one invalid item rejects the whole batch
+    default_schedule: bool = True
+
+class ScheduleBulkCreate(BaseModel):
+    schedules: List[ScheduleCreate]
+    atomic: bool = True
 
 class LogCreate(BaseModel):
     vehicle_id: int
-    task_name: str
+    task_id: Optional[int] = None
+    task_name: Optional[str] = None # matched to a task when task_id is not given
     performed_at_mileage: float
     performed_at_hours: float
     cost: float
     notes: Optional[str] = None
 
+class TenantCreate(BaseModel):
+    key: str
+    name: Optional[str] = None
+    geotab_user: Optional[str] = None
+    geotab_password: Optional[str] = None
+    geotab_database: Optional[str] = None
+    geotab_server: Optional[str] = None # default: GEOTAB_SERVER
+
 class UserCreate(BaseModel):
     email: str
     password: str
@@ -264,173 +467,343 @@ class Token(BaseModel):
 
 # --- ENDPOINTS ---
 
-@app.get("/health")
-def health_check():
-    health_status = {
-        "status": "ok", 
+def connection_info():
+    try:
+        url = engine.url
+        return f"{url.drivername}://{url.host or 'localhost'}"
+    except Exception:
+        return "parsing_error"
+
+@app.get("/health/live")
+async def health_live():
+    # No I/O: answers as long as the event loop is running
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    if SAFE_MODE_ERROR:
+        return JSONResponse(status_code=503, content={"status": "degraded", "mode": "SAFE_MODE", "error": SAFE_MODE_ERROR})
+    ok, error = await probes.ready(engine)
+    if not ok:
+        return JSONResponse(status_code=503, content={"status": "db_error", "database_error": error})
+    return {"status": "ok", "database": "connected"}
+
+@app.get("/health/details")
+async def health_details():
+    if SAFE_MODE_ERROR:
+        return {"status": "degraded", "mode": "SAFE_MODE", "error": SAFE_MODE_ERROR}
+    details = {
+        "status": "ok",
         "timestamp": datetime.now().isoformat(),
-        "database": "unknown",
-        "connection_info": "unknown"
+        "connection_info": connection_info(),
+        **await probes.details(db_mod, engine),
     }
+    details["database"] = "error" if "error" in details else "connected"
+    if "error" in details:
+        details["status"] = "db_error"
+    if startup_profile.STARTUP_PROFILE:
+        details["startup_profile"] = profiler.summary()
+    return details
 
-    # Debug: Identify which DB we are using
-    if db_mod and engine:
-        try:
-            url = engine.url
-            clean_host = url.host if url.host else "localhost"
-            clean_driver = url.drivername
-            health_status["connection_info"] = f"{clean_driver}://{clean_host}"
-        except:
-            health_status["connection_info"] = "parsing_error"
-    
-    if SAFE_MODE_ERROR:
-        return {
-            "status": "degraded", 
-            "mode": "SAFE_MODE", 
-            "error": SAFE_MODE_ERROR
-        }
-    
-    # Try to connect to DB
+@app.get("/health")
+async def health_check():
+    # Kept for existing probes; served from the same cached snapshot as /health/details
+    return await health_details()
+
+@app.get("/metrics")
+def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+def _in_group(query, db, group, vehicle_id):
+    """Limit query to the vehicles in a Geotab group and its subgroups (?group=), if one is given"""
+    if group is None:
+        return query
     try:
-        # Use a fresh session for check
-        if db_mod and hasattr(db_mod, "SessionLocal"):
-            db = db_mod.SessionLocal()
-            try:
-                # Simple query to verify connection and table existence
-                db.execute(text("SELECT 1")) # Use text() wrapper
-                health_status["database"] = "connected"
-                
-                # Check if tables exist
-                try:
-                    user_count = db.query(db_mod.User).count()
-                    health_status["user_count"] = user_count
-                    
-                    vehicle_count = db.query(db_mod.Vehicle).count()
-                    health_status["vehicle_count"] = vehicle_count
-                    
-                    # Debug first vehicle
-                    first_v = db.query(db_mod.Vehicle).first()
-                    if first_v:
-                        health_status["sample_vehicle"] = {
-                            "id": first_v.id,
-                            "name": first_v.name,
-                            "geotab_id": first_v.geotab_id
-                        }
-                except Exception as table_err:
-                    health_status["table_error"] = str(table_err)
-            except Exception as e:
-                 health_status["database_error"] = str(e)
-                 health_status["status"] = "db_error"
-            finally:
-                db.close()
-    except Exception as e:
-        health_status["database_Check_error"] = str(e)
+        group_id = groups_mod.lookup(db, group, db_mod.current_tenant())
+    except groups_mod.AmbiguousGroup as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if group_id is None:
+        raise HTTPException(status_code=404, detail=f"Group {group} not found")
+    return query.filter(vehicle_id.in_(groups_mod.members(group_id)))
+
+async def _group_members(group):
+    """Ids of the vehicles under ?group=, or None for the whole fleet"""
+    if group is None:
+        return None
+    rows = await run_read(lambda db: _in_group(db.query(db_mod.Vehicle.id), db, group, db_mod.Vehicle.id).all())
+    return {row.id for row in rows}
+
+async def _fleet():
+    """This process's fleet snapshot (see fleet_snapshot.py); a due version check runs in the threadpool"""
+    if not db_mod:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+    if snapshot_mod.is_fresh():
+        return snapshot_mod.current()
+    return await run_in_threadpool(snapshot_mod.current)
 
-    return health_status
+def _write_tenant():
+    """Tenant new vehicles go to: the request's, or the default one"""
+    return db_mod.current_tenant() or db_mod.DEFAULT_TENANT
 
-# Helper for dependency injection
-def get_db_session():
+def _commit_fleet(db, vehicle_ids=()):
+    """Commit a write to vehicles or schedules and bring this process's fleet snapshot along"""
+    version = snapshot_mod.touch(db)
+    db.commit()
+    snapshot_mod.patch(vehicle_ids, version)
+
+def _visible_vehicle(db, vehicle_id):
+    """The vehicle through the tenant-scoped session; 404 if it doesn't exist or belongs to another tenant"""
+    vehicle = db.query(db_mod.Vehicle).filter(db_mod.Vehicle.id == vehicle_id).first()
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+    return vehicle
+
+async def _group_stats(group):
+    """Cached aggregates for one Geotab group (see groups.py); 404 if it isn't synced"""
+    if not db_mod:
+        raise HTTPException(status_code=503, detail="Database not initialized")
+    found = await run_in_threadpool(groups_mod.current_stats, [group], db_mod.current_tenant())
+    if not found:
+        raise HTTPException(status_code=404, detail=f"Group {group} not found")
+    if len(found) > 1:
+        raise HTTPException(status_code=400, detail=groups_mod.ambiguity(group))
+    return found[0]
+
+@app.get("/groups")
+async def list_groups():
+    # Every group with its aggregates; parent is the Geotab id of the group above it
     if not db_mod:
         raise HTTPException(status_code=503, detail="Database not initialized")
-    return db_mod.get_db()
+    return await run_in_threadpool(groups_mod.current_stats, None, db_mod.current_tenant())
 
 @app.get("/vehicles", response_model=List[Vehicle])
-def read_vehicles(db: Session = Depends(lambda: next(get_db_session()))): 
-    # Use explicit lambda deferral and handling for Session type hint
-    return db.query(db_mod.Vehicle).options(joinedload(db_mod.Vehicle.schedules)).all()
+async def read_vehicles(request: Request, group: Optional[str] = None):
+    snapshot = await _fleet()
+    tenant_id = db_mod.current_tenant()
+    members = await _group_members(group)
+    if members is not None:
+        return [v for v in snapshot.of_tenant(tenant_id) if v.id in members]
+    # The whole fleet (or tenant) is serialized once per snapshot, and encoded once per format
+    key = "vehicles" if tenant_id is None else f"vehicles@{tenant_id}"
+    body = snapshot.cache.get(key)
+    if body is None:
+        body = snapshot.cache[key] = VehicleList.dump_json(
+            VehicleList.validate_python(snapshot.of_tenant(tenant_id), from_attributes=True))
+    return response_encoding.render(request, body, snapshot.cache, key)
 
 @app.post("/vehicles", response_model=Vehicle)
-def create_vehicle(vehicle: VehicleCreate, db: Session = Depends(lambda: next(get_db_session()))):
+def create_vehicle(vehicle: VehicleCreate, db: Session = Depends(get_db_session)):
     # Support both Pydantic v1 and v2
     data = vehicle.model_dump() if hasattr(vehicle, "model_dump") else vehicle.dict()
+    data["tenant_id"] = _write_tenant()
+    pending = db.query(db_mod.Vehicle.id).filter(db_mod.Vehicle.tenant_id == data["tenant_id"], db_mod.Vehicle.geotab_id == data.get("geotab_id"),
+                                                 db_mod.Vehicle.deleted_at.isnot(None)).execution_options(include_deleted=True).first()
+    if pending:
+        raise HTTPException(status_code=409, detail=f"Vehicle {pending.id} with this Geotab ID is still being deleted, try again shortly")
     db_vehicle = db_mod.Vehicle(**data)
     db.add(db_vehicle)
-    db.commit()
-    db.refresh(db_vehicle)
+    db.flush() # Get ID
     
-    # Create default schedule (Oil Change every 5000 miles)
-    default_schedule = db_mod.MaintenanceSchedule(
-        vehicle_id=db_vehicle.id,
-        task_name="Oil Change",
-        tracking_type="miles",
-        interval_value=5000.0,
-        alert_thresholds="4500,4800"
-    )
-    db.add(default_schedule)
-    db.commit()
+    # Create default schedule (Oil Change every 5000 miles), in the same transaction
+    db.add(enroll_mod.default_schedule(db, db_vehicle.id))
+    _commit_fleet(db, [db_vehicle.id])
     db.refresh(db_vehicle)
     
     return db_vehicle
 
+def _bulk_response(db, run, vehicle_key):
+    """Commit a validated batch (see enrollment.py); 422 with per-item results if nothing could be written.
+    vehicle_key names the result field holding each created item's vehicle id."""
+    from sqlalchemy.exc import IntegrityError
+    try:
+        batch = run()
+    except enroll_mod.BatchTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    body = batch.as_dict()
+    if body["failed"] and not body["created"]:
+        db.rollback()
+        return JSONResponse(status_code=422, content=body)
+    try:
+        _commit_fleet(db, [r[vehicle_key] for r in body["results"] if r["status"] == "created"])
+    except IntegrityError:
+        # Another request enrolled the same vehicle between validation and commit
+        db.rollback()
+        raise HTTPException(status_code=409, detail="Batch conflicts with a concurrent change, nothing was written; retry it")
+    return body
+
+@app.post("/vehicles/bulk")
+def create_vehicles_bulk(request: VehicleBulkCreate, db: Session = Depends(get_db_session)):
+    vehicles = [v.model_dump() if hasattr(v, "model_dump") else v.dict() for v in request.vehicles]
+    return _bulk_response(db, lambda: enroll_mod.enroll_vehicles(
+        db, vehicles, atomic=request.atomic, default_schedule=request.default_schedule, tenant_id=_write_tenant()), "id")
+
 @app.delete("/vehicles/{vehicle_id}")
-def delete_vehicle(vehicle_id: int, db: Session = Depends(lambda: next(get_db_session()))):
+def delete_vehicle(vehicle_id: int, db: Session = Depends(get_db_session)):
     # Check existence
     vehicle = db.query(db_mod.Vehicle).filter(db_mod.Vehicle.id == vehicle_id).first()
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle not found")
         
-    # Delete related logs first
-    db.query(db_mod.MaintenanceLog).filter(db_mod.MaintenanceLog.vehicle_id == vehicle_id).delete()
+    # Soft delete: hidden from every query now, logs and schedules are purged in the background
+    now = datetime.utcnow()
+    vehicle.deleted_at = now
+    groups_mod.mark_stale(db, vehicle_ids=[vehicle_id])
+    db.merge(db_mod.PurgeJob(vehicle_id=vehicle_id, requested_at=now, started_at=None, finished_at=None,
+                             rows_total=None, rows_deleted=0, error=None))
+    _commit_fleet(db, [vehicle_id])
+    purge_mod.kick()
     
-    # Delete related schedules
-    db.query(db_mod.MaintenanceSchedule).filter(db_mod.MaintenanceSchedule.vehicle_id == vehicle_id).delete()
-    
-    # Delete vehicle
-    db.delete(vehicle)
-    db.commit()
-    
-    return {"status": "success", "id": vehicle_id}
+    return {"status": "success", "id": vehicle_id, "purge": "queued"}
+
+@app.get("/vehicles/{vehicle_id}/purge")
+def get_vehicle_purge(vehicle_id: int):
+    progress = purge_mod.status(vehicle_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No deletion requested for this vehicle")
+    return progress
 
 @app.post("/schedules")
-def create_schedule(schedule: ScheduleCreate, db: Session = Depends(lambda: next(get_db_session()))):
+def create_schedule(schedule: ScheduleCreate, db: Session = Depends(get_db_session)):
+    _visible_vehicle(db, schedule.vehicle_id)
     data = schedule.model_dump() if hasattr(schedule, "model_dump") else schedule.dict()
-    db_schedule = db_mod.MaintenanceSchedule(**data)
-    db.add(db_schedule)
-    db.commit()
-    return {"status": "success"}
-
-@app.get("/schedules/{vehicle_id}")
-def get_schedules(vehicle_id: int, db: Session = Depends(lambda: next(get_db_session()))):
-    return db.query(db_mod.MaintenanceSchedule).filter(db_mod.MaintenanceSchedule.vehicle_id == vehicle_id).all()
+    result = enroll_mod.assign_schedules(db, [data]).results[0]
+    if result["status"] != "created":
+        raise HTTPException(status_code=400, detail=result["error"])
+    _commit_fleet(db, [schedule.vehicle_id])
+    return {"status": "success", "id": result["id"], "task_id": result["task_id"]}
+
+@app.post("/schedules/bulk")
+def create_schedules_bulk(request: ScheduleBulkCreate, db: Session = Depends(get_db_session)):
+    schedules = [s.model_dump() if hasattr(s, "model_dump") else s.dict() for s in request.schedules]
+    return _bulk_response(db, lambda: enroll_mod.assign_schedules(db, schedules, atomic=request.atomic), "vehicle_id")
+
+@app.get("/schedules/due")
+async def get_due_schedules(soon: bool = False, group: Optional[str] = None):
+    # Due now, or with soon=true also past their first alert threshold; most overdue first
+    snapshot = await _fleet()
+    members = await _group_members(group)
+    return [{
+        "vehicle_id": vehicle.id,
+        "vehicle_name": vehicle.name,
+        "schedule_id": schedule.id,
+        "task_id": schedule.task_id,
+        "task_name": schedule.task_name,
+        "tracking_type": schedule.tracking_type,
+        "current": usage,
+        "due_at": due_at,
+        "remaining": round(due_at - usage, 1)
+    } for vehicle, schedule, usage, due_at in snapshot.due(soon=soon, tenant_id=db_mod.current_tenant())
+        if members is None or vehicle.id in members]
+
+@app.get("/schedules/{vehicle_id}", response_model=List[Schedule])
+async def get_schedules(vehicle_id: int):
+    vehicle = (await _fleet()).vehicles.get(vehicle_id)
+    if vehicle is None or db_mod.current_tenant() not in (None, vehicle.tenant_id):
+        return []
+    return vehicle.schedules
 
 @app.put("/schedules/{schedule_id}")
-def update_schedule(schedule_id: int, updates: ScheduleUpdate, db: Session = Depends(lambda: next(get_db_session()))):
+def update_schedule(schedule_id: int, updates: ScheduleUpdate, db: Session = Depends(get_db_session)):
     schedule = db.query(db_mod.MaintenanceSchedule).filter(db_mod.MaintenanceSchedule.id == schedule_id).first()
     if not schedule:
         raise HTTPException(status_code=404, detail="Schedule not found")
     
-    if updates.interval_value is not None:
-        schedule.interval_value = updates.interval_value
+    # Per-vehicle overrides; a value equal to the task's goes back to following the task
+    try:
+        thresholds = None if updates.alert_thresholds is None else db_mod.parse_thresholds(updates.alert_thresholds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    tasks_mod.override(schedule, interval=updates.interval_value, thresholds=thresholds)
     if updates.last_performed_value is not None:
         schedule.last_performed_value = updates.last_performed_value
-    if updates.alert_thresholds is not None:
-        schedule.alert_thresholds = updates.alert_thresholds
         
-    db.commit()
+    _commit_fleet(db, [schedule.vehicle_id])
     return {"status": "success"}
 
+# --- Task templates ---
+def _task_out(task, schedules=0):
+    return {"id": task.id, "name": task.name, "tracking_type": task.tracking_type, "interval_value": task.interval_value,
+            "thresholds": [t.value for t in task.thresholds], "schedules": schedules}
+
+@app.get("/tasks")
+def list_tasks(db: Session = Depends(get_db_session)):
+    from sqlalchemy import func
+    counts = dict(db.query(db_mod.MaintenanceSchedule.task_id, func.count())
+                  .filter(db_mod.MaintenanceSchedule.is_active == True)
+                  .group_by(db_mod.MaintenanceSchedule.task_id).all())
+    return [_task_out(t, counts.get(t.id, 0)) for t in db.query(db_mod.MaintenanceTask).order_by(db_mod.MaintenanceTask.name)]
+
+@app.post("/tasks")
+def create_task(task: TaskCreate, db: Session = Depends(get_db_session)):
+    if tasks_mod.find(db, [task.name]):
+        raise HTTPException(status_code=409, detail=f"A task named '{task.name}' already exists")
+    if task.tracking_type not in enroll_mod.TRACKING_TYPES or task.interval_value <= 0 or min(task.thresholds, default=0) < 0:
+        raise HTTPException(status_code=400, detail="Invalid tracking type, interval or thresholds")
+    created = tasks_mod.resolve(db, [(task.name, task.tracking_type, task.interval_value, sorted(set(task.thresholds)))])
+    db.commit()
+    return _task_out(created[tasks_mod.key(task.name)])
+
+@app.put("/tasks/{task_id}")
+def update_task(task_id: int, updates: TaskUpdate, db: Session = Depends(get_db_session)):
+    # Applies to every schedule following this task; vehicles with their own values keep them
+    task = db.query(db_mod.MaintenanceTask).filter(db_mod.MaintenanceTask.id == task_id).first()
+    if not task:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if (updates.interval_value is not None and updates.interval_value <= 0) or min(updates.thresholds or [], default=0) < 0:
+        raise HTTPException(status_code=400, detail="Invalid interval or thresholds")
+    try:
+        tasks_mod.update(db, task, name=updates.name, interval_value=updates.interval_value,
+                         thresholds=None if updates.thresholds is None else sorted(set(updates.thresholds)))
+    except tasks_mod.TaskConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    # Every schedule following the task changes: the snapshot is rebuilt rather than patched
+    _commit_fleet(db)
+    from sqlalchemy import func
+    following = db.query(func.count(db_mod.MaintenanceSchedule.id)).filter(
+        db_mod.MaintenanceSchedule.task_id == task.id, db_mod.MaintenanceSchedule.is_active == True).scalar()
+    return _task_out(task, following)
+
 @app.post("/logs")
-def create_log(log: LogCreate, db: Session = Depends(lambda: next(get_db_session()))):
+def create_log(log: LogCreate, db: Session = Depends(get_db_session)):
+    vehicle = _visible_vehicle(db, log.vehicle_id)
     data = log.model_dump() if hasattr(log, "model_dump") else log.dict()
+    if log.task_id is not None:
+        task = db.query(db_mod.MaintenanceTask).filter(db_mod.MaintenanceTask.id == log.task_id).first()
+        if not task:
+            raise HTTPException(status_code=404, detail="Task not found")
+    elif log.task_name:
+        # Older clients send the name: match it once, then everything below goes by id
+        task = tasks_mod.find(db, [log.task_name]).get(tasks_mod.key(log.task_name))
+    else:
+        raise HTTPException(status_code=400, detail="task_id or task_name is required")
+    if task:
+        data.update(task_id=task.id, task_name=task.name)
+    # Group stats are adjusted in this transaction (see groups.py), so compare with before the log
+    serviced_recently = db.query(db_mod.MaintenanceLog.id).filter(
+        db_mod.MaintenanceLog.vehicle_id == log.vehicle_id,
+        db_mod.MaintenanceLog.performed_date >= datetime.utcnow() - timedelta(days=30)
+    ).first() is not None
     db_log = db_mod.MaintenanceLog(**data)
     db.add(db_log)
     
+    schedule = None
+    if task:
+        schedule = db.query(db_mod.MaintenanceSchedule).filter(
+            db_mod.MaintenanceSchedule.vehicle_id == log.vehicle_id,
+            db_mod.MaintenanceSchedule.task_id == task.id
+        ).first()
     
+    # Due schedules of the vehicle before and after, for the group stats
+    active = [s for s in vehicle.schedules if s.is_active]
+    was_due = groups_mod.count_due(active, vehicle.current_mileage, vehicle.current_hours)
     # Update Vehicle Odometer/Hours if higher
-    vehicle = db.query(db_mod.Vehicle).filter(db_mod.Vehicle.id == log.vehicle_id).first()
-    if vehicle:
-        # We trust manual logs if they are higher than current (Geotab sync will catch up or confirm)
-        if log.performed_at_mileage > vehicle.current_mileage:
-            vehicle.current_mileage = log.performed_at_mileage
-        if log.performed_at_hours > vehicle.current_hours:
-            vehicle.current_hours = log.performed_at_hours
+    # We trust manual logs if they are higher than current (Geotab sync will catch up or confirm)
+    if log.performed_at_mileage > vehicle.current_mileage:
+        vehicle.current_mileage = log.performed_at_mileage
+    if log.performed_at_hours > vehicle.current_hours:
+        vehicle.current_hours = log.performed_at_hours
 
     # Update Schedule
-    schedule = db.query(db_mod.MaintenanceSchedule).filter(
-        db_mod.MaintenanceSchedule.vehicle_id == log.vehicle_id,
-        db_mod.MaintenanceSchedule.task_name == log.task_name
-    ).first()
-    
     if schedule:
         if schedule.tracking_type == "miles":
             schedule.last_performed_value = log.performed_at_mileage
@@ -439,24 +812,30 @@ def create_log(log: LogCreate, db: Session = Depends(lambda: next(get_db_session
             
         schedule.last_performed_date = datetime.utcnow()
     
-    db.commit()
+    # Higher readings may have made the vehicle's other schedules due, the serviced one no longer is
+    is_due = groups_mod.count_due(active, vehicle.current_mileage, vehicle.current_hours)
+    groups_mod.record_log(db, log.vehicle_id, log.cost, first_in_30d=not serviced_recently, due_change=is_due - was_due)
+    _commit_fleet(db, [log.vehicle_id])
     return {"status": "success"}
 
 @app.get("/logs/{vehicle_id}")
-def get_vehicle_logs(vehicle_id: int, db: Session = Depends(lambda: next(get_db_session()))):
-    return db.query(db_mod.MaintenanceLog).filter(db_mod.MaintenanceLog.vehicle_id == vehicle_id).order_by(db_mod.MaintenanceLog.performed_date.desc()).all()
+async def get_vehicle_logs(vehicle_id: int):
+    return await run_read(lambda db: db.query(db_mod.MaintenanceLog).filter(db_mod.MaintenanceLog.vehicle_id == vehicle_id).order_by(db_mod.MaintenanceLog.performed_date.desc()).all())
 
 @app.get("/admin/logs/login")
-def get_login_logs(db: Session = Depends(lambda: next(get_db_session()))):
+def get_login_logs(db: Session = Depends(get_db_session)):
+    # Admin view should include logins still sitting in the audit buffer
+    if audit_mod:
+        audit_mod.writer.flush()
     return db.query(db_mod.LoginLog).order_by(db_mod.LoginLog.login_time.desc()).limit(100).all()
 
 # --- Notifications API ---
 @app.get("/notifications")
-def get_notifications(db: Session = Depends(lambda: next(get_db_session()))):
-    return db.query(db_mod.Notification).order_by(db_mod.Notification.created_at.desc()).limit(50).all()
+async def get_notifications():
+    return await run_read(lambda db: db.query(db_mod.Notification).order_by(db_mod.Notification.created_at.desc()).limit(50).all())
 
 @app.post("/notifications/{notif_id}/read")
-def mark_notification_read(notif_id: int, db: Session = Depends(lambda: next(get_db_session()))):
+def mark_notification_read(notif_id: int, db: Session = Depends(get_db_session)):
     notif = db.query(db_mod.Notification).filter(db_mod.Notification.id == notif_id).first()
     if notif:
         notif.is_read = True
@@ -464,7 +843,7 @@ def mark_notification_read(notif_id: int, db: Session = Depends(lambda: next(get
     return {"status": "success"}
 
 @app.post("/notifications/read-all")
-def mark_all_notifications_read(db: Session = Depends(lambda: next(get_db_session()))):
+def mark_all_notifications_read(db: Session = Depends(get_db_session)):
     db.query(db_mod.Notification).filter(db_mod.Notification.is_read == False).update({"is_read": True})
     db.commit()
     return {"status": "success"}
@@ -473,27 +852,49 @@ def mark_all_notifications_read(db: Session = Depends(lambda: next(get_db_sessio
 
 
 @app.get("/analytics/cost")
-def get_cost_analytics(db: Session = Depends(lambda: next(get_db_session()))):
-    logs = db.query(db_mod.MaintenanceLog).all()
+async def get_cost_analytics(group: Optional[str] = None):
+    if group is not None:
+        stats = await _group_stats(group)
+        return {"total_maintenance_cost": stats["total_maintenance_cost"], "count": stats["log_count"], "group": group}
+    logs = await run_read(lambda db: db.query(db_mod.MaintenanceLog).all())
     total = sum(log.cost for log in logs)
     return {"total_maintenance_cost": total, "count": len(logs)}
 
 
 
 @app.get("/analytics/health")
-def get_health_index(db: Session = Depends(lambda: next(get_db_session()))):
-    # Core Health Index = (Total Vehicles - Vehicles with Maint in last 30d) / Total Vehicles
-    total_vehicles = db.query(db_mod.Vehicle).count()
-    if total_vehicles == 0:
-        return {"health_index": 100, "detail": "No vehicles"}
-        
+async def get_health_index(group: Optional[str] = None):
+    from sqlalchemy import func, distinct
+    
+    if group is not None:
+        stats = await _group_stats(group)
+        if stats["vehicles"] == 0:
+            return {"health_index": 100, "detail": "No vehicles", "group": group}
+        return {
+            "health_index": stats["health_index"],
+            "total_vehicles": stats["vehicles"],
+            "vehicles_in_shop_last_30d": stats["vehicles_in_shop_last_30d"],
+            "due_count": stats["due_count"],
+            "group": group
+        }
+    
     thirty_days_ago = datetime.utcnow() - timedelta(days=30)
     
-    # Count unique vehicles that had maintenance
-    # distinct(MaintenanceLog.vehicle_id)
-    unique_maint_vehicles = db.query(db_mod.MaintenanceLog.vehicle_id)\
-        .filter(db_mod.MaintenanceLog.performed_date >= thirty_days_ago)\
-        .distinct().count()
+    def counts(db):
+        # Core Health Index = (Total Vehicles - Vehicles with Maint in last 30d) / Total Vehicles
+        total = db.query(db_mod.Vehicle).count()
+        if total == 0:
+            return 0, 0
+        # Count unique vehicles that had maintenance
+        # COUNT(DISTINCT vehicle_id) lets the planner range-scan the performed_date index
+        unique = db.query(func.count(distinct(db_mod.MaintenanceLog.vehicle_id)))\
+            .filter(db_mod.MaintenanceLog.performed_date >= thirty_days_ago)\
+            .scalar()
+        return total, unique
+    
+    total_vehicles, unique_maint_vehicles = await run_read(counts)
+    if total_vehicles == 0:
+        return {"health_index": 100, "detail": "No vehicles"}
         
     healthy_vehicles = total_vehicles - unique_maint_vehicles
     health_index = int((healthy_vehicles / total_vehicles) * 100)
@@ -505,7 +906,7 @@ def get_health_index(db: Session = Depends(lambda: next(get_db_session()))):
     }
 
 @app.get("/analytics/cost-trend")
-def get_cost_trend(period: str = "6M", db: Session = Depends(lambda: next(get_db_session()))):
+async def get_cost_trend(period: str = "6M", group: Optional[str] = None):
     from collections import defaultdict
     
     # Periods: 1W, 1M, 3M, 6M, 1Y, ALL
@@ -538,7 +939,8 @@ def get_cost_trend(period: str = "6M", db: Session = Depends(lambda: next(get_db
         delta_step = timedelta(days=30)
         step_count = 6
         
-    logs = db.query(db_mod.MaintenanceLog).filter(db_mod.MaintenanceLog.performed_date >= start_date).all()
+    logs = await run_read(lambda db: _in_group(db.query(db_mod.MaintenanceLog), db, group, db_mod.MaintenanceLog.vehicle_id)
+                          .filter(db_mod.MaintenanceLog.performed_date >= start_date).all())
     
     # bucket
     data_map = defaultdict(float)
@@ -591,12 +993,12 @@ def get_cost_trend(period: str = "6M", db: Session = Depends(lambda: next(get_db
     }
 
 @app.get("/analytics/export")
-def export_logs_csv(db: Session = Depends(lambda: next(get_db_session()))):
+def export_logs_csv(group: Optional[str] = None, db: Session = Depends(get_db_session)):
     import csv
     from io import StringIO
     
     # Fetch all logs for export
-    logs = db.query(db_mod.MaintenanceLog).options(
+    logs = _in_group(db.query(db_mod.MaintenanceLog), db, group, db_mod.MaintenanceLog.vehicle_id).options(
         joinedload(db_mod.MaintenanceLog.vehicle)
     ).order_by(db_mod.MaintenanceLog.performed_date.desc()).all()
     
@@ -631,89 +1033,104 @@ def export_logs_csv(db: Session = Depends(lambda: next(get_db_session()))):
 
 
 
+def create_support_ticket(fields):
+    db = db_mod.SessionLocal()
+    try:
+        ticket = db_mod.SupportTicket(**fields)
+        db.add(ticket)
+        db.commit()
+        return ticket.id
+    finally:
+        db.close()
+
 @app.post("/support/submit")
 async def submit_support_ticket(
+    background_tasks: BackgroundTasks,
     issue_type: str = Form(...),
     impact_count: str = Form(...),
     description: str = Form(...),
     user_email: str = Form(...),
-    attachment: UploadFile = File(None),
-    db: Session = Depends(lambda: next(get_db_session()))
+    attachment: UploadFile = File(None)
 ):
-    print(f"Received Support Ticket from {user_email}")
+    log.info("Support ticket received", extra={"email": user_email, "issue_type": issue_type})
     
-    file_path = None
+    stored = None
     if attachment:
-        upload_dir = "uploads"
-        os.makedirs(upload_dir, exist_ok=True)
-        filename = f"{datetime.now().timestamp()}_{attachment.filename}"
-        file_path = os.path.join(upload_dir, filename)
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(attachment.file, buffer)
+        try:
+            stored = await attachments.save_upload(attachment)
+        except attachments.UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
             
-    # Save to DB
-    ticket = db_mod.SupportTicket(
-        user_email=user_email,
-        issue_type=issue_type,
-        impact_count=impact_count,
-        description=description,
-        attachment_filename=file_path
-    )
-    db.add(ticket)
-    db.commit()
-    db.refresh(ticket)
+    # Save to DB (off the event loop)
+    fields = dict(user_email=user_email, issue_type=issue_type, impact_count=impact_count, description=description)
+    if stored:
+        fields.update(attachment_filename=stored.path, attachment_name=stored.name,
+                      attachment_sha256=stored.sha256, attachment_size=stored.size)
+    ticket_id = await run_in_threadpool(create_support_ticket, fields)
     
-    # Send Email
-    subject = f"New Support Ticket: {ticket.issue_type}"
+    # Send Email after the response, in the threadpool
+    subject = f"New Support Ticket: {issue_type}"
     body = f"""
     New Support Ticket Received
     ---------------------------
-    User: {ticket.user_email}
-    Issue: {ticket.issue_type}
-    Impact: {ticket.impact_count}
+    User: {user_email}
+    Issue: {issue_type}
+    Impact: {impact_count}
     
     Description:
-    {ticket.description}
+    {description}
     """
-    email_utils.send_email_notification(subject, body, file_path)
-
-    return {"status": "success", "ticket_id": ticket.id}
-
-@app.get("/analytics/logs")
-def get_global_logs(db: Session = Depends(lambda: next(get_db_session()))):
-    # Fetch all logs, joined with Vehicle to get names
-    logs = db.query(db_mod.MaintenanceLog).options(
-        joinedload(db_mod.MaintenanceLog.vehicle)
-    ).order_by(db_mod.MaintenanceLog.performed_date.desc()).all()
-    
-    # Custom serialization to include vehicle name
-    result = []
-    for log in logs:
-        result.append({
-            "id": log.id,
-            "vehicle_id": log.vehicle_id,
-            "vehicle_name": log.vehicle.name if log.vehicle else "Unknown",
-            "task_name": log.task_name,
-            "performed_date": log.performed_date,
-            "cost": log.cost,
-            "performed_at_mileage": log.performed_at_mileage
-        })
-    return result
+    background_tasks.add_task(email_utils.send_email_notification, subject, body,
+                              stored.path if stored else None, stored.name if stored else None)
+
+    return {"status": "success", "ticket_id": ticket_id}
+
+@app.get("/analytics/logs", response_model=List[LogEntry])
+async def get_global_logs(request: Request, group: Optional[str] = None):
+    # Fetch all logs with their vehicle's name: plain rows, serialized by pydantic-core
+    from sqlalchemy import func
+    Log = db_mod.MaintenanceLog
+    rows = await run_read(lambda db: _in_group(db.query(
+        Log.id, Log.vehicle_id, func.coalesce(db_mod.Vehicle.name, "Unknown").label("vehicle_name"), Log.task_name,
+        Log.performed_date, Log.cost, Log.performed_at_mileage
+    ).outerjoin(db_mod.Vehicle, db_mod.Vehicle.id == Log.vehicle_id), db, group, Log.vehicle_id
+    ).order_by(Log.performed_date.desc()).all())
+    return response_encoding.render(request, LogEntryList.dump_json(LogEntryList.validate_python(rows, from_attributes=True)))
+
+def _tenant_key(request: Request):
+    """Key of the tenant selected with X-Tenant, for tenant settings; None for deployment-wide ones"""
+    tenant = getattr(request.state, "tenant", None)
+    return None if tenants_mod.is_default(tenant) else tenant.key
 
 @app.get("/settings/all")
-def get_all_settings(db: Session = Depends(lambda: next(get_db_session()))):
-    settings_list = db.query(db_mod.Setting).all()
-    return {s.key: s.value for s in settings_list}
+async def get_all_settings(request: Request):
+    tenant = _tenant_key(request)
+    if settings_mod.is_fresh():
+        return settings_mod.as_dict(tenant)
+    return await run_in_threadpool(settings_mod.as_dict, tenant)
 
 @app.post("/settings")
-def update_settings(settings: dict, db: Session = Depends(lambda: next(get_db_session()))):
-    for key, value in settings.items():
-        db_setting = db_mod.Setting(key=key, value=str(value))
-        db.merge(db_setting)
-    db.commit()
+def update_settings(settings: dict, request: Request, db: Session = Depends(get_db_session)):
+    settings_mod.update_settings(db, settings, tenant=_tenant_key(request))
     return {"status": "success"}
 
+# --- Tenants (one per Geotab database) ---
+@app.get("/tenants")
+async def list_tenants():
+    return await run_in_threadpool(tenants_mod.summary)
+
+@app.post("/tenants")
+def create_tenant(tenant: TenantCreate, db: Session = Depends(get_db_session)):
+    settings = {"GEOTAB_USER": tenant.geotab_user, "GEOTAB_PASS": tenant.geotab_password,
+                "GEOTAB_DB": tenant.geotab_database, "GEOTAB_SERVER": tenant.geotab_server}
+    try:
+        tenant_id = tenants_mod.create(db, tenant.key, tenant.name, settings)
+    except tenants_mod.TenantExists as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except tenants_mod.InvalidTenant as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"status": "success", "id": tenant_id}
+
 @app.get("/auth/me")
 def read_users_me(current_user: UserCreate = Depends(get_current_user)):
     return {
@@ -723,7 +1140,7 @@ def read_users_me(current_user: UserCreate = Depends(get_current_user)):
     }
 
 @app.post("/auth/register", response_model=Token)
-def register(user: UserCreate, db: Session = Depends(lambda: next(get_db_session()))):
+def register(user: UserCreate, db: Session = Depends(get_db_session)):
     db_user = db.query(db_mod.User).filter(db_mod.User.email == user.email).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -738,42 +1155,26 @@ def register(user: UserCreate, db: Session = Depends(lambda: next(get_db_session
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/auth/login", response_model=Token)
-def login(user: UserCreate, db: Session = Depends(lambda: next(get_db_session()))):
-    print(f"LOGIN ATTEMPT: {user.email}")
-    
-    # Check what DB we are actually using
-    try:
-        db_name = db.bind.url.database
-        host = db.bind.url.host
-        print(f"LOGIN DB: {host}/{db_name}")
-    except:
-        print("LOGIN DB: Could not determine DB URL")
+def login(user: UserCreate, db: Session = Depends(get_db_session)):
+    log.debug("Login attempt", extra={"email": user.email})
 
     db_user = db.query(db_mod.User).filter(db_mod.User.email == user.email).first()
     
     if not db_user:
-        print("LOGIN FAIL: User not found in DB")
+        log.info("Login failed: user not found", extra={"email": user.email})
         raise HTTPException(status_code=401, detail="User not found")
         
     if not verify_password(user.password, db_user.hashed_password):
-        print(f"LOGIN FAIL: Password mismatch for {user.email}")
-        # print(f"  Input: {user.password}")
-        # print(f"  Hash:  {db_user.hashed_password}")
+        log.info("Login failed: password mismatch", extra={"email": user.email})
         raise HTTPException(status_code=401, detail="Password mismatch")
     
-    print("LOGIN SUCCESS")
+    log.debug("Login succeeded", extra={"email": user.email})
     
-    # Create Login Log
+    # Queue Login Log (flushed in batches by the audit writer)
     try:
-        log_entry = db_mod.LoginLog(
-            user_id=db_user.id,
-            email=db_user.email,
-            login_time=datetime.utcnow()
-        )
-        db.add(log_entry)
-        db.commit()
+        audit_mod.writer.record(db_user.id, db_user.email)
     except Exception as e:
-        print(f"Failed to create login log: {e}")
+        log.warning("Failed to queue login log: %s", e)
         # Don't fail the login just because logging failed
 
     access_token = create_access_token(data={"sub": db_user.email})
@@ -0,0 +1,226 @@
+"""
+In-process metrics rendered in the Prometheus text exposition format.
+
+Counters, gauges and histograms keep one shard per thread, so recording a
+value only touches a dict owned by the calling thread and never takes a lock.
+Shards are summed when /metrics is scraped. Values are per process: with
+several uvicorn workers, scrape each one (or run a single worker per port).
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _series(name, labels, key, extra=None):
+    pairs = [f'{label}="{_escape(value)}"' for label, value in zip(labels, key)]
+    if extra:
+        pairs.append(extra)
+    return f"{name}{{{','.join(pairs)}}}" if pairs else name
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock() # only taken the first time a thread records
+        _registry.append(self)
+
+    def _shard(self):
+        shard = getattr(self._local, "values", None)
+        if shard is None:
+            shard = self._local.values = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self):
+        # Copying a dict is a single C call under the GIL, so this is safe
+        # while the owning thread keeps writing
+        with self._lock:
+            shards = list(self._shards)
+        return [dict(shard) for shard in shards]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._render_samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self):
+        totals = {}
+        for shard in self._snapshots():
+            for key, value in shard.items():
+                totals[key] = totals.get(key, 0) + value
+        return totals
+
+    def _render_samples(self):
+        values = self.values()
+        if not values and not self.labels:
+            values = {(): 0} # unlabelled series exist from the start
+        return [f"{_series(self.name, self.labels, key)} {_fmt(value)}" for key, value in sorted(values.items())]
+
+
+class Gauge(Counter):
+    """A counter that can go down, or a value read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set_function(self, function):
+        """function() returns a number, or {label values tuple: number} for labelled gauges"""
+        self._function = function
+
+    def values(self):
+        if self._function is None:
+            return super().values()
+        try:
+            result = self._function()
+        except Exception:
+            return {}
+        return result if isinstance(result, dict) else {(): result}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # One slot per bucket, one for +Inf, then the running sum
+            state = shard[labels] = [0] * (len(self.buckets) + 2)
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, *labels)
+
+    def _render_samples(self):
+        merged = {}
+        for shard in self._snapshots():
+            for key, state in shard.items():
+                total = merged.setdefault(key, [0] * len(state))
+                for i, value in enumerate(list(state)):
+                    total[i] += value
+        lines = []
+        for key, state in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), state[:-1]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _fmt(bound)
+                bucket = _series(self.name + "_bucket", self.labels, key, f'le="{le}"')
+                lines.append(f"{bucket} {cumulative}")
+            lines.append(f"{_series(self.name + '_sum', self.labels, key)} {_fmt(state[-1])}")
+            lines.append(f"{_series(self.name + '_count', self.labels, key)} {cumulative}")
+        return lines
+
+
+def render():
+    """All registered metrics as a Prometheus text exposition payload"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def pool_usage(engine):
+    """{state: connections} for an engine's pool"""
+    pool = engine.pool
+    return {state: max(getattr(pool, method)(), 0) # QueuePool reports negative overflow until it fills
+            for state, method in (("checked_out", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow"), ("size", "size"))
+            if hasattr(pool, method)}
+
+
+def watch_pool(engine, async_engine=None):
+    """Report connection pool usage for the engine (and the optional asyncio engine) at scrape time"""
+
+    def usage():
+        return {(name, state): value
+                for name, eng in (("sync", engine), ("async", async_engine)) if eng is not None
+                for state, value in pool_usage(eng).items()}
+
+    DB_POOL_CONNECTIONS.set_function(usage)
+
+
+def serve(port, host="0.0.0.0"):
+    """Expose /metrics from a process that has no API server (e.g. sync_service.py)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            data = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+# --- API ---
+REQUEST_LATENCY = Histogram("geotrack_http_request_duration_seconds", "API request latency by route", ("method", "route", "status"))
+DB_POOL_CONNECTIONS = Gauge("geotrack_db_pool_connections", "Database connection pool usage", ("engine", "state"))
+
+# --- SYNC ---
+SYNC_PHASE_DURATION = Histogram("geotrack_sync_phase_duration_seconds", "Sync cycle duration per phase", ("phase",), buckets=PHASE_BUCKETS)
+GEOTAB_CALLS = Counter("geotrack_geotab_calls_total", "Geotab API calls", ("call",))
+GEOTAB_ERRORS = Counter("geotrack_geotab_errors_total", "Failed Geotab API calls", ("call", "error"))
+SYNC_VEHICLES = Counter("geotrack_sync_vehicles_total", "Vehicles considered by telemetry sync", ("result",)) # polled / skipped / changed
+
+# --- ALERTS ---
+ALERTS_EVALUATED = Counter("geotrack_alerts_evaluated_total", "Maintenance schedules checked for alerts")
+ALERTS_SENT = Counter("geotrack_alerts_sent_total", "Maintenance alerts delivered")
+ALERTS_FAILED = Counter("geotrack_alerts_failed_total", "Maintenance alerts that were due but could not be delivered")
+
+# --- EMAIL ---
+EMAIL_QUEUE_DEPTH = Gauge("geotrack_email_queue_depth", "Emails waiting to be handed to the SMTP server")
+EMAILS = Counter("geotrack_emails_total", "Email delivery attempts", ("result",))
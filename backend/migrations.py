@@ -0,0 +1,246 @@
+"""
+Versioned schema migrations.
+
+Each step runs once, in order, in its own transaction and is recorded in the
+schema_version table. On Postgres a session-level advisory lock serializes
+concurrent workers; every step also re-checks the version inside its own
+transaction so a worker that loses the race simply skips it.
+
+Usage: python migrations.py [--status]
+"""
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import inspect, text
+
+import database as db_mod
+
+ADVISORY_LOCK_ID = 720451 # Arbitrary, but must be the same for every worker
+
+log = logging.getLogger("geotrack.migrations")
+
+_local_lock = threading.Lock()
+
+
+class Migration:
+    def __init__(self, version, description, upgrade, transactional=True):
+        self.version = version
+        self.description = description
+        self.upgrade = upgrade
+        # Non-transactional steps run in autocommit (e.g. CREATE INDEX CONCURRENTLY on Postgres)
+        self.transactional = transactional
+
+
+# --- HELPERS (idempotent so steps are safe on databases created by create_all) ---
+
+def has_column(conn, table, column):
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+def add_column(conn, table, column, ddl_type):
+    if not has_column(conn, table, column):
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl_type}"))
+
+def create_index(conn, name, table, columns, concurrently=False, unique=False):
+    # CONCURRENTLY avoids locking writes on large Postgres tables (autocommit steps only)
+    concurrent = "CONCURRENTLY " if concurrently and conn.dialect.name == "postgresql" else ""
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    conn.execute(text(f"CREATE {kind} {concurrent}IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"))
+
+
+# --- STEPS ---
+
+def _baseline(conn):
+    db_mod.Base.metadata.create_all(bind=conn)
+    # Databases created before these existed
+    add_column(conn, "maintenance_schedules", "last_alerted_at", "TIMESTAMP")
+    create_index(conn, "ix_login_logs_login_time", "login_logs", ["login_time"])
+
+
+def _hot_path_indexes(conn):
+    create_index(conn, "ix_maintenance_logs_vehicle_id", "maintenance_logs", ["vehicle_id"], concurrently=True)
+    create_index(conn, "ix_maintenance_logs_performed_date", "maintenance_logs", ["performed_date"], concurrently=True)
+    create_index(conn, "ix_maintenance_schedules_vehicle_id", "maintenance_schedules", ["vehicle_id"], concurrently=True)
+    create_index(conn, "ix_maintenance_schedules_is_active", "maintenance_schedules", ["is_active"], concurrently=True)
+    create_index(conn, "ix_notifications_created_at", "notifications", ["created_at"], concurrently=True)
+    create_index(conn, "ix_notifications_is_read", "notifications", ["is_read"], concurrently=True)
+
+
+def _scheduler_leases(conn):
+    db_mod.SchedulerLease.__table__.create(bind=conn, checkfirst=True)
+
+def _sync_heartbeats(conn):
+    db_mod.SyncHeartbeat.__table__.create(bind=conn, checkfirst=True)
+
+def _settings_version(conn):
+    db_mod.SettingsVersion.__table__.create(bind=conn, checkfirst=True)
+    _seed_settings_version(conn)
+
+def _seed_settings_version(conn):
+    # The row exists from the start, so settings writers only ever UPDATE it
+    if not conn.execute(text("SELECT 1 FROM settings_version WHERE id = 1")).first():
+        conn.execute(db_mod.SettingsVersion.__table__.insert().values(id=1, version=0))
+
+def _attachment_metadata(conn):
+    add_column(conn, "support_tickets", "attachment_name", "VARCHAR")
+    add_column(conn, "support_tickets", "attachment_sha256", "VARCHAR")
+    add_column(conn, "support_tickets", "attachment_size", "INTEGER")
+
+def _soft_delete(conn):
+    add_column(conn, "vehicles", "deleted_at", "TIMESTAMP")
+    create_index(conn, "ix_vehicles_deleted_at", "vehicles", ["deleted_at"])
+    db_mod.PurgeJob.__table__.create(bind=conn, checkfirst=True)
+
+def _task_templates(conn):
+    import tasks
+    db_mod.MaintenanceTask.__table__.create(bind=conn, checkfirst=True)
+    db_mod.TaskThreshold.__table__.create(bind=conn, checkfirst=True)
+    add_column(conn, "maintenance_schedules", "task_id", "INTEGER REFERENCES maintenance_tasks(id)")
+    add_column(conn, "maintenance_logs", "task_id", "INTEGER REFERENCES maintenance_tasks(id)")
+    create_index(conn, "ix_maintenance_schedules_task_id", "maintenance_schedules", ["task_id"])
+    create_index(conn, "ix_maintenance_logs_task_id", "maintenance_logs", ["task_id"])
+    add_column(conn, "maintenance_schedules", "own_thresholds", "BOOLEAN NOT NULL DEFAULT FALSE")
+    # maintenance_schedules.alert_thresholds is no longer mapped; it stays (unused) on databases that have it
+    tasks.backfill(conn, legacy_thresholds=has_column(conn, "maintenance_schedules", "alert_thresholds"))
+
+def _fleet_groups(conn):
+    # Filled by the next vehicle sync
+    for model in (db_mod.FleetGroup, db_mod.GroupClosure, db_mod.VehicleGroup, db_mod.GroupStats):
+        model.__table__.create(bind=conn, checkfirst=True)
+
+def _fleet_version(conn):
+    db_mod.FleetVersion.__table__.create(bind=conn, checkfirst=True)
+    # The row exists from the start, so concurrent first writers only ever UPDATE it
+    conn.execute(db_mod.FleetVersion.__table__.insert().values(id=1, version=0))
+
+def _tenants(conn):
+    db_mod.Tenant.__table__.create(bind=conn, checkfirst=True)
+    if not conn.execute(text("SELECT 1 FROM tenants WHERE id = :id"), {"id": db_mod.DEFAULT_TENANT}).first():
+        conn.execute(db_mod.Tenant.__table__.insert().values(id=db_mod.DEFAULT_TENANT, key="default", name="Default",
+                                                             created_at=datetime.utcnow()))
+    # Everything synced so far belongs to the original Geotab database; Geotab ids are now unique per tenant
+    for table in ("vehicles", "fleet_groups"):
+        add_column(conn, table, "tenant_id", f"INTEGER NOT NULL DEFAULT {db_mod.DEFAULT_TENANT} REFERENCES tenants(id)")
+        create_index(conn, f"ix_{table}_tenant_id", table, ["tenant_id"])
+        conn.execute(text(f"DROP INDEX IF EXISTS ix_{table}_geotab_id"))
+        create_index(conn, f"ix_{table}_geotab_id", table, ["geotab_id"])
+        create_index(conn, f"ux_{table}_tenant_geotab_id", table, ["tenant_id", "geotab_id"], unique=True)
+
+def _explicit_threshold_overrides(conn):
+    # Before this flag, a schedule only overrode its task's thresholds while it had threshold rows
+    add_column(conn, "maintenance_schedules", "own_thresholds", "BOOLEAN NOT NULL DEFAULT FALSE")
+    conn.execute(text("UPDATE maintenance_schedules SET own_thresholds = TRUE "
+                      "WHERE id IN (SELECT schedule_id FROM task_thresholds WHERE schedule_id IS NOT NULL)"))
+
+
+MIGRATIONS = [
+    Migration(1, "baseline schema", _baseline),
+    Migration(2, "hot-path indexes", _hot_path_indexes, transactional=False),
+    Migration(3, "scheduler leases", _scheduler_leases),
+    Migration(4, "sync heartbeats", _sync_heartbeats),
+    Migration(5, "settings version", _settings_version),
+    Migration(6, "support attachment metadata", _attachment_metadata),
+    Migration(7, "vehicle soft delete and purge jobs", _soft_delete),
+    Migration(8, "maintenance task templates", _task_templates),
+    Migration(9, "fleet groups", _fleet_groups),
+    Migration(10, "fleet snapshot version", _fleet_version),
+    Migration(11, "tenants", _tenants),
+    Migration(12, "explicit threshold overrides", _explicit_threshold_overrides),
+    Migration(13, "seed settings version", _seed_settings_version), # databases already past step 5
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# --- RUNNER ---
+
+def current_version(conn=None):
+    """Highest applied version, or 0 if the database has never been migrated"""
+    try:
+        if conn is not None:
+            return conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+        with db_mod.engine.connect() as c:
+            return c.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+    except Exception:
+        return 0
+
+def _stamp(conn, migration):
+    conn.execute(db_mod.SchemaVersion.__table__.insert(), {"version": migration.version, "applied_at": datetime.utcnow()})
+
+def _apply(migration):
+    engine = db_mod.engine
+    if migration.transactional:
+        with engine.begin() as conn:
+            db_mod.SchemaVersion.__table__.create(bind=conn, checkfirst=True)
+            if current_version(conn) >= migration.version:
+                return False
+            migration.upgrade(conn)
+            _stamp(conn, migration)
+        return True
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if current_version(conn) >= migration.version:
+            return False
+        migration.upgrade(conn)
+    with engine.begin() as conn:
+        _stamp(conn, migration)
+    return True
+
+def _run_pending(target):
+    applied = 0
+    for migration in MIGRATIONS:
+        if migration.version > target:
+            break
+        if migration.version <= current_version():
+            continue
+        log.info("Applying migration", extra={"version": migration.version, "description": migration.description})
+        if _apply(migration):
+            applied += 1
+    return applied
+
+def _upgrade_locked(target):
+    engine = db_mod.engine
+    if engine.dialect.name != "postgresql":
+        return _run_pending(target)
+
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+        lock_conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": ADVISORY_LOCK_ID})
+        try:
+            return _run_pending(target)
+        finally:
+            lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": ADVISORY_LOCK_ID})
+
+def upgrade(target=None):
+    """Apply all pending migrations. Returns True if the schema is at the target version."""
+    target = target or LATEST_VERSION
+    with _local_lock:
+        try:
+            applied = _upgrade_locked(target)
+        except Exception as e:
+            if not db_mod.is_readonly_error(e):
+                log.exception("Migration failed")
+                return False
+            log.warning("Read-only filesystem, falling back to in-memory SQLite")
+            db_mod.use_memory_fallback()
+            applied = _upgrade_locked(target)
+
+    if applied:
+        log.info("Schema upgraded", extra={"version": current_version(), "steps": applied})
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Database schema migrations")
+    parser.add_argument("--status", action="store_true", help="Show the applied and latest version and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        version = current_version()
+        print(f"Schema version: {version} (latest: {LATEST_VERSION})")
+        for m in MIGRATIONS:
+            print(f"   [{'x' if m.version <= version else ' '}] {m.version}: {m.description}")
+    else:
+        import log_config
+        log_config.configure()
+        ok = upgrade()
+        print(f"{'✅' if ok else '❌'} Schema version: {current_version()} (latest: {LATEST_VERSION})")
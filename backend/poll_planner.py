@@ -0,0 +1,146 @@
+"""
+Adaptive per-vehicle polling for the telemetry sync.
+
+The sync job still ticks every SYNC_INTERVAL seconds, but each vehicle has its
+own poll interval. A vehicle whose odometer or engine hours moved since the
+last poll is polled again on the next tick. Each unchanged poll doubles its
+interval, up to SYNC_MAX_INTERVAL, so parked vehicles end up polled about hourly.
+
+Vehicles close to a maintenance mark (an alert threshold or the due value) are
+capped at SYNC_NEAR_DUE_INTERVAL. The recent usage rate also caps an active
+vehicle's interval at half its estimated time to the next mark, so an alert is
+never more than half an interval late. When SYNC_MAX_VEHICLES limits a tick,
+the most urgent vehicles go first.
+
+State is kept in memory per worker: after a restart (or when a partition moves
+to another worker) every vehicle is polled once and the intervals rebuild.
+"""
+import os
+import threading
+import time
+
+SYNC_ADAPTIVE = os.getenv("SYNC_ADAPTIVE", "1").lower() not in ("0", "false", "no")
+SYNC_MIN_INTERVAL = int(os.getenv("SYNC_MIN_INTERVAL", os.getenv("SYNC_INTERVAL", "60"))) # seconds, active vehicles
+SYNC_MAX_INTERVAL = int(os.getenv("SYNC_MAX_INTERVAL", "3600")) # seconds, parked vehicles
+SYNC_NEAR_DUE_INTERVAL = int(os.getenv("SYNC_NEAR_DUE_INTERVAL", "300")) # seconds, vehicles close to a maintenance mark
+NEAR_DUE_FRACTION = float(os.getenv("SYNC_NEAR_DUE_FRACTION", "0.05")) # "close" = within this share of the service interval
+SYNC_MAX_VEHICLES = int(os.getenv("SYNC_MAX_VEHICLES", "0")) # per tick, 0 = no limit
+
+RATE_SMOOTHING = 0.5 # weight of the newest observation in the usage-rate average
+
+
+class VehiclePollState:
+    __slots__ = ("mileage", "hours", "polled_at", "interval", "mileage_rate", "hours_rate")
+
+    def __init__(self):
+        self.mileage = None
+        self.hours = None
+        self.polled_at = None
+        self.interval = SYNC_MIN_INTERVAL
+        self.mileage_rate = 0.0 # miles per hour of wall time
+        self.hours_rate = 0.0 # engine hours per hour of wall time
+
+
+def upcoming_marks(schedules, mileage, hours):
+    """(tracking_type, remaining, service interval) for the next threshold or due value of each schedule"""
+    marks = []
+    for s in schedules:
+        if s.tracking_type == "miles":
+            current = mileage or 0.0
+        elif s.tracking_type == "hours":
+            current = hours or 0.0
+        else:
+            continue
+        offsets = [s.interval_value or 0.0, *s.thresholds]
+        base = s.last_performed_value or 0.0
+        ahead = [base + o - current for o in offsets if base + o > current]
+        if ahead:
+            marks.append((s.tracking_type, min(ahead), s.interval_value or 0.0))
+    return marks
+
+
+class PollPlanner:
+    """Decides which vehicles a sync tick polls and how long each can wait afterwards"""
+
+    def __init__(self, min_interval=SYNC_MIN_INTERVAL, max_interval=SYNC_MAX_INTERVAL,
+                 near_due_interval=SYNC_NEAR_DUE_INTERVAL, max_per_tick=SYNC_MAX_VEHICLES, enabled=SYNC_ADAPTIVE):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.near_due_interval = near_due_interval
+        self.max_per_tick = max_per_tick
+        self.enabled = enabled
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _state(self, vehicle_id):
+        with self._lock:
+            state = self._states.get(vehicle_id)
+            if state is None:
+                state = self._states[vehicle_id] = VehiclePollState()
+            return state
+
+    def _near_due(self, vehicle, schedules):
+        return any(remaining <= NEAR_DUE_FRACTION * interval
+                   for _, remaining, interval in upcoming_marks(schedules, vehicle.current_mileage, vehicle.current_hours))
+
+    def plan(self, vehicles, schedules_by_vehicle, now=None):
+        """The vehicles to poll this tick, most urgent first"""
+        if not self.enabled:
+            return list(vehicles)
+        now = time.time() if now is None else now
+        due = []
+        for v in vehicles:
+            state = self._state(v.id)
+            near_due = self._near_due(v, schedules_by_vehicle.get(v.id, ()))
+            if state.polled_at is None:
+                urgency = float("inf") # never polled by this worker
+            else:
+                wait = min(state.interval, self.near_due_interval) if near_due else state.interval
+                overdue = now - state.polled_at - wait
+                if overdue < -1: # within a second of due counts as due, so tick jitter doesn't skip a cycle
+                    continue
+                urgency = 1 + overdue / wait
+            due.append((near_due, urgency, v))
+        due.sort(key=lambda d: (d[0], d[1]), reverse=True)
+        if self.max_per_tick:
+            due = due[:self.max_per_tick]
+        return [v for _, _, v in due]
+
+    def observe(self, vehicle_id, mileage, hours, schedules, now=None):
+        """Record the readings just synced for a vehicle and pick its next interval"""
+        now = time.time() if now is None else now
+        state = self._state(vehicle_id)
+        if state.polled_at is None:
+            moved = True
+        else:
+            elapsed_h = max(now - state.polled_at, 1.0) / 3600.0
+            d_miles = max((mileage or 0.0) - (state.mileage or 0.0), 0.0)
+            d_hours = max((hours or 0.0) - (state.hours or 0.0), 0.0)
+            moved = d_miles > 0 or d_hours > 0
+            state.mileage_rate += RATE_SMOOTHING * (d_miles / elapsed_h - state.mileage_rate)
+            state.hours_rate += RATE_SMOOTHING * (d_hours / elapsed_h - state.hours_rate)
+
+        interval = self.min_interval if moved else min(state.interval * 2, self.max_interval)
+        for kind, remaining, _ in upcoming_marks(schedules, mileage, hours):
+            rate = state.mileage_rate if kind == "miles" else state.hours_rate
+            if rate > 0:
+                # Poll at least twice before the vehicle reaches its next mark
+                interval = min(interval, max(self.min_interval, remaining / rate * 3600 / 2))
+
+        state.mileage, state.hours, state.polled_at, state.interval = mileage, hours, now, interval
+        return interval
+
+    def forget(self, keep_ids):
+        """Drop state for vehicles that are no longer synced by this worker"""
+        with self._lock:
+            for vehicle_id in [k for k in self._states if k not in keep_ids]:
+                del self._states[vehicle_id]
+
+    def summary(self):
+        with self._lock:
+            intervals = [s.interval for s in self._states.values() if s.polled_at is not None]
+        return {
+            "tracked": len(intervals),
+            "active": sum(1 for i in intervals if i <= self.min_interval),
+            "idle": sum(1 for i in intervals if i >= self.max_interval),
+        }
@@ -0,0 +1,177 @@
+"""
+Background purge of soft-deleted vehicles.
+
+DELETE /vehicles/{id} only stamps vehicles.deleted_at and queues a purge_jobs
+row, so it returns immediately; every ORM query already hides the vehicle.
+The purger then removes the vehicle's logs and schedules PURGE_BATCH rows at a
+time, each batch in its own short transaction, and deletes the vehicle row
+last. Progress is written to purge_jobs after every batch.
+
+The purge is resumable by construction: each batch deletes whatever dependent
+rows are still there, so a purge interrupted by a crash or deploy simply
+continues on the next run. Only one worker purges at a time (lease "purge").
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, select, update
+
+import database as db_mod
+import metrics
+import scheduler
+
+PURGE_BATCH = int(os.getenv("PURGE_BATCH", "1000")) # rows per transaction
+PURGE_PAUSE = float(os.getenv("PURGE_PAUSE", "0.05")) # seconds between batches, so other writers get the locks
+PURGE_INTERVAL = int(os.getenv("PURGE_INTERVAL", "60")) # seconds between scheduled runs in sync_service
+LEASE = "purge"
+
+log = logging.getLogger("geotrack.purger")
+
+ROWS_PURGED = metrics.Counter("geotrack_purge_rows_total", "Rows removed by the vehicle purger", ("table",))
+
+
+def _tables(vehicle_id):
+    """(table, rows of this vehicle) pairs, children first; the vehicle row goes last so the soft-delete marker survives until the end"""
+    logs, schedules = db_mod.MaintenanceLog.__table__, db_mod.MaintenanceSchedule.__table__
+    thresholds, links = db_mod.TaskThreshold.__table__, db_mod.VehicleGroup.__table__
+    return (
+        (logs, logs.c.vehicle_id == vehicle_id),
+        (links, links.c.vehicle_id == vehicle_id),
+        (thresholds, thresholds.c.schedule_id.in_(select(schedules.c.id).where(schedules.c.vehicle_id == vehicle_id))),
+        (schedules, schedules.c.vehicle_id == vehicle_id),
+    )
+
+
+def _progress(conn, vehicle_id, **values):
+    jobs = db_mod.PurgeJob.__table__
+    conn.execute(update(jobs).where(jobs.c.vehicle_id == vehicle_id).values(**values))
+
+
+def purge_vehicle(vehicle_id, batch=PURGE_BATCH, pause=PURGE_PAUSE, renew=None):
+    """Delete one soft-deleted vehicle and its dependents in bounded batches. Returns rows deleted this run."""
+    engine = db_mod.engine
+    jobs, vehicles = db_mod.PurgeJob.__table__, db_mod.Vehicle.__table__
+    with engine.begin() as conn:
+        job = conn.execute(select(jobs).where(jobs.c.vehicle_id == vehicle_id)).first()
+        if job is None or job.finished_at is not None:
+            return 0
+        vehicle = conn.execute(select(vehicles.c.deleted_at).where(vehicles.c.id == vehicle_id)).first()
+        if vehicle is not None and vehicle.deleted_at is None:
+            # Never purge a live vehicle, whatever the job table says
+            _progress(conn, vehicle_id, finished_at=datetime.utcnow(), error="vehicle is not deleted")
+            return 0
+        if job.started_at is None:
+            total = sum(conn.execute(select(func.count()).select_from(t).where(owned)).scalar()
+                        for t, owned in _tables(vehicle_id))
+            _progress(conn, vehicle_id, started_at=datetime.utcnow(), rows_total=total)
+            log.info("Purge started", extra={"vehicle_id": vehicle_id, "rows": total})
+
+    deleted = 0
+    for table, owned in _tables(vehicle_id):
+        while True:
+            with engine.begin() as conn:
+                ids = select(table.c.id).where(owned).limit(batch).scalar_subquery()
+                n = conn.execute(delete(table).where(table.c.id.in_(ids))).rowcount
+                if n:
+                    _progress(conn, vehicle_id, rows_deleted=jobs.c.rows_deleted + n)
+            if not n:
+                break
+            deleted += n
+            ROWS_PURGED.inc(table.name, amount=n)
+            if renew is not None and not renew():
+                log.warning("Lost purge lease, stopping", extra={"vehicle_id": vehicle_id, "deleted": deleted})
+                return deleted
+            if pause:
+                time.sleep(pause)
+
+    with engine.begin() as conn:
+        conn.execute(delete(vehicles).where(vehicles.c.id == vehicle_id, vehicles.c.deleted_at.isnot(None)))
+        _progress(conn, vehicle_id, finished_at=datetime.utcnow())
+    ROWS_PURGED.inc("vehicles")
+    log.info("Purge finished", extra={"vehicle_id": vehicle_id, "deleted": deleted})
+    return deleted
+
+
+def pending():
+    jobs = db_mod.PurgeJob.__table__
+    with db_mod.engine.connect() as conn:
+        return [row.vehicle_id for row in conn.execute(
+            select(jobs.c.vehicle_id).where(jobs.c.finished_at.is_(None)).order_by(jobs.c.requested_at))]
+
+
+def run_pending(renew=None):
+    """Purge every unfinished job (oldest first). Returns the number of vehicles completed."""
+    done = 0
+    for vehicle_id in pending():
+        try:
+            purge_vehicle(vehicle_id, renew=renew)
+            done += 1
+        except Exception as e:
+            log.exception("Purge failed", extra={"vehicle_id": vehicle_id})
+            try:
+                with db_mod.engine.begin() as conn:
+                    _progress(conn, vehicle_id, error=str(e)[:500])
+            except Exception:
+                pass
+        if renew is not None and not renew():
+            break
+    return done
+
+
+def run_leased(holder=None):
+    """run_pending() under the purge lease, renewing it between batches"""
+    holder = holder or scheduler.worker_id()
+    if not scheduler.acquire_lease(LEASE, holder):
+        return False
+    try:
+        # Jobs queued while we were busy are picked up by the next pass
+        while run_pending(renew=lambda: scheduler.acquire_lease(LEASE, holder)):
+            pass
+    finally:
+        scheduler.release_lease(LEASE, holder)
+    return True
+
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def kick():
+    """Start purging in a background thread of this process unless one is already running"""
+    global _thread
+    with _thread_lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_run_quietly, name="vehicle-purger", daemon=True)
+        _thread.start()
+
+
+def _run_quietly():
+    try:
+        run_leased()
+    except Exception:
+        log.exception("Purger crashed")
+
+
+def status(vehicle_id):
+    """Progress of a vehicle's purge, or None if none was requested"""
+    jobs = db_mod.PurgeJob.__table__
+    with db_mod.engine.connect() as conn:
+        job = conn.execute(select(jobs).where(jobs.c.vehicle_id == vehicle_id)).first()
+    if job is None:
+        return None
+    state = "done" if job.finished_at else "running" if job.started_at else "queued"
+    return {
+        "vehicle_id": vehicle_id,
+        "state": state,
+        "requested_at": job.requested_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "rows_total": job.rows_total,
+        "rows_deleted": job.rows_deleted or 0,
+        "percent": 100.0 if job.finished_at else round(100.0 * (job.rows_deleted or 0) / job.rows_total, 1) if job.rows_total else 0.0,
+        "error": job.error,
+    }
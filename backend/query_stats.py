@@ -0,0 +1,113 @@
+import os
+import logging
+import time
+import contextvars
+from sqlalchemy import event
+
+# Configuration
+ENABLED = os.getenv("QUERY_STATS", "1").lower() not in ("0", "false", "no")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "500"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+QUERY_COUNT_THRESHOLD = int(os.getenv("QUERY_COUNT_THRESHOLD", "25")) # more than this per request smells like N+1
+MAX_LOGGED_STATEMENTS = 5
+MAX_SQL_CHARS = 500
+
+log = logging.getLogger("geotrack.sql")
+
+# Stats for the request being handled in this context (None outside a request, e.g. background threads)
+_current = contextvars.ContextVar("query_stats", default=None)
+
+
+class RequestQueryStats:
+    """Statement count and DB time for one request, grouped by SQL text"""
+
+    __slots__ = ("count", "db_ms", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.db_ms = 0.0
+        self.statements = {} # sql -> [executions, total ms]
+
+    def record(self, statement, ms):
+        self.count += 1
+        self.db_ms += ms
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, ms]
+        else:
+            entry[0] += 1
+            entry[1] += ms
+
+    def repeated(self):
+        """Statements issued more than once - the usual signature of a lazy load in a loop"""
+        return sorted(((sql, n, ms) for sql, (n, ms) in self.statements.items() if n > 1), key=lambda s: -s[1])
+
+    def slow(self):
+        return sorted(((sql, n, ms) for sql, (n, ms) in self.statements.items() if ms / n >= SLOW_QUERY_MS), key=lambda s: -s[2])
+
+
+def begin():
+    """Start collecting for the current request. Returns (stats, token) for end()."""
+    stats = RequestQueryStats()
+    return stats, _current.set(stats)
+
+
+def end(token):
+    _current.reset(token)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_stats_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    starts = conn.info.get("query_stats_start")
+    if stats is None or not starts:
+        return
+    stats.record(statement, (time.perf_counter() - starts.pop()) * 1000)
+
+
+def install(engine):
+    """Attach the cursor hooks to an engine (idempotent)"""
+    if not ENABLED or event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def server_timing(stats, total_ms):
+    """Server-Timing header value, shown per request in the browser's network panel"""
+    return f'db;dur={stats.db_ms:.1f};desc="{stats.count} queries", app;dur={max(total_ms - stats.db_ms, 0.0):.1f}'
+
+
+def _one_line(sql):
+    sql = " ".join(sql.split())
+    return sql if len(sql) <= MAX_SQL_CHARS else sql[:MAX_SQL_CHARS] + "..."
+
+
+def report(method, path, status_code, stats, total_ms):
+    """Log a warning with the offending SQL when a request crosses a threshold"""
+    reasons = []
+    if total_ms >= SLOW_REQUEST_MS:
+        reasons.append(f"slow ({total_ms:.0f} ms >= {SLOW_REQUEST_MS:.0f} ms)")
+    if stats.count > QUERY_COUNT_THRESHOLD:
+        reasons.append(f"{stats.count} queries > {QUERY_COUNT_THRESHOLD}")
+    slow = stats.slow()
+    if slow:
+        reasons.append(f"{len(slow)} statement(s) over {SLOW_QUERY_MS:.0f} ms")
+    if not reasons:
+        return False
+
+    shown = {}
+    for label, rows in (("repeated", stats.repeated()), ("slowest", slow or sorted(
+            ((sql, n, ms) for sql, (n, ms) in stats.statements.items()), key=lambda s: -s[2]))):
+        for sql, n, ms in rows[:MAX_LOGGED_STATEMENTS]:
+            if sql not in shown:
+                shown[sql] = {"kind": label, "count": n, "ms": round(ms, 1), "sql": _one_line(sql)}
+    log.warning("Slow request %s %s: %s", method, path, "; ".join(reasons), extra={
+        "method": method, "path": path, "status": status_code, "total_ms": round(total_ms, 1),
+        "queries": stats.count, "db_ms": round(stats.db_ms, 1), "statements": list(shown.values()),
+    })
+    return True
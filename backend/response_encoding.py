@@ -0,0 +1,234 @@
+"""
+Negotiated response encoding.
+
+Field tablets pull /vehicles and /analytics/logs over cellular links, and both
+are large, repetitive JSON. ResponseEncodingMiddleware applies two things to
+every API response, driven by the request headers:
+
+- Accept: application/msgpack (or application/x-msgpack), preferred over JSON,
+  turns a JSON body into MessagePack. Values keep their JSON form, so dates stay
+  ISO 8601 strings. Needs the msgpack package; without it JSON is served.
+- Accept-Encoding: br (with the brotli package) or gzip, by q-value, compresses
+  bodies of at least COMPRESS_MIN_BYTES. Streamed bodies (the CSV export) are
+  compressed chunk by chunk.
+
+Responses that already carry a Content-Encoding pass through untouched. An
+endpoint that caches a serialized body can return render() instead, which keeps
+each encoded variant in the same cache: /vehicles then encodes the fleet once
+per snapshot and format rather than on every request.
+"""
+import gzip
+import json
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024")) # smaller bodies fit in a packet or two anyway
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4")) # 0-11; 4 is about gzip's speed with smaller output
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+COMPRESSIBLE = ("text/", JSON, MSGPACK, "application/javascript", "application/xml", "image/svg+xml")
+CODINGS = ("br", "gzip") if brotli is not None else ("gzip",) # server preference on equal q-values
+
+
+# --- NEGOTIATION ---
+
+def _preferences(header):
+    """{lowercased token: q} from an Accept or Accept-Encoding header"""
+    prefs = {}
+    for part in (header or "").split(","):
+        token, *params = [p.strip() for p in part.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        prefs[token.lower()] = q
+    return prefs
+
+
+def choose_format(accept):
+    """MSGPACK when the client asks for it at least as strongly as for JSON, else JSON"""
+    if msgpack is None:
+        return JSON
+    prefs = _preferences(accept)
+    wanted = max(prefs.get(t, 0.0) for t in MSGPACK_TYPES)
+    if wanted <= 0:
+        return JSON
+    json_q = prefs.get(JSON, prefs.get("application/*", prefs.get("*/*", 0.0)))
+    return MSGPACK if wanted >= json_q else JSON
+
+
+def choose_coding(accept_encoding):
+    """'br', 'gzip' or None (identity)"""
+    prefs = _preferences(accept_encoding)
+    best, best_q = None, 0.0
+    for coding in CODINGS:
+        q = prefs.get(coding, prefs.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def negotiate(headers):
+    """(format, coding) for a request's headers"""
+    return choose_format(headers.get("accept")), choose_coding(headers.get("accept-encoding"))
+
+
+# --- ENCODING ---
+
+def compressible(content_type):
+    return content_type.startswith(COMPRESSIBLE)
+
+
+def compress(body, coding):
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def to_msgpack(json_body):
+    return msgpack.packb(json.loads(json_body), use_bin_type=True)
+
+
+def encode(body, content_type, fmt, coding):
+    """(body, content type, content encoding or None) for a complete response body"""
+    if fmt == MSGPACK and content_type.startswith(JSON) and body:
+        body, content_type = to_msgpack(body), MSGPACK
+    if coding and compressible(content_type) and len(body) >= COMPRESS_MIN_BYTES:
+        return compress(body, coding), content_type, coding
+    return body, content_type, None
+
+
+def _compressor(coding):
+    """(feed, finish) for a streamed body"""
+    if coding == "br":
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        return c.process, c.finish
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # gzip container
+    return c.compress, c.flush
+
+
+def _vary(headers, content_type):
+    # Shared caches must key the response on what it was negotiated from
+    present = {v.strip().lower() for v in headers.get("vary", "").split(",")}
+    if content_type.startswith((JSON, MSGPACK)) and "accept" not in present:
+        headers.add_vary_header("Accept")
+    if compressible(content_type) and "accept-encoding" not in present:
+        headers.add_vary_header("Accept-Encoding")
+
+
+def _below_threshold(headers):
+    """True for a body whose Content-Length says it is smaller than COMPRESS_MIN_BYTES (e.g. a small rendered msgpack body)"""
+    length = headers.get("content-length")
+    return length is not None and length.isdigit() and int(length) < COMPRESS_MIN_BYTES
+
+
+def render(request, body, cache=None, key=None):
+    """
+    Response for an already serialized JSON body, encoded for this request. With a cache dict
+    (e.g. a fleet snapshot's) each (key, format, coding) variant is encoded only once.
+    """
+    fmt, coding = negotiate(request.headers)
+    variant = (key, fmt, coding)
+    found = cache.get(variant) if cache is not None else None
+    if found is None:
+        found = encode(body, JSON, fmt, coding)
+        if cache is not None:
+            cache[variant] = found
+    body, content_type, content_encoding = found
+    response = Response(content=body, media_type=content_type)
+    if content_encoding:
+        response.headers["Content-Encoding"] = content_encoding
+    _vary(response.headers, content_type)
+    return response
+
+
+# --- MIDDLEWARE ---
+
+class ResponseEncodingMiddleware:
+    """ASGI middleware applying the negotiated format and compression to every HTTP response"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        fmt, coding = negotiate(Headers(scope=scope))
+        head = scope.get("method") == "HEAD" # no body: the app's Content-Length describes the GET
+        start = None # held until the body decides the headers
+        chunks = None # a JSON body being buffered (the app middlewares stream every body)
+        stream = None # (feed, finish) once a streamed body is being compressed
+
+        async def encoding_send(message):
+            nonlocal start, chunks, stream
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if message["type"] != "http.response.body" or start is None and stream is None:
+                await send(message)
+                return
+            body, more = message.get("body", b""), message.get("more_body", False)
+            if stream is not None:
+                data = stream[0](body) + (b"" if more else stream[1]())
+                await send({"type": "http.response.body", "body": data, "more_body": more})
+                return
+
+            headers = MutableHeaders(raw=start["headers"])
+            content_type = headers.get("content-type", "")
+            if "content-encoding" in headers or start["status"] in (204, 304):
+                pass
+            elif content_type.startswith(JSON):
+                # Whole JSON bodies only: MessagePack needs all of it and small ones aren't compressed
+                if more:
+                    chunks = chunks or []
+                    chunks.append(body)
+                    return
+                if chunks:
+                    body, chunks = b"".join(chunks) + body, None
+                body, content_type, content_encoding = encode(body, content_type, fmt, coding)
+                if content_encoding:
+                    headers["Content-Encoding"] = content_encoding
+                if content_type != headers.get("content-type", ""):
+                    headers["Content-Type"] = content_type
+                if not head:
+                    headers["Content-Length"] = str(len(body))
+                _vary(headers, content_type)
+                message = {"type": "http.response.body", "body": body, "more_body": False}
+            elif coding and compressible(content_type) and not _below_threshold(headers):
+                # Streamed (e.g. the CSV export): the size is unknown, so compress regardless of COMPRESS_MIN_BYTES;
+                # bodies with a known Content-Length below it (render() settled those) pass as they are
+                stream = _compressor(coding)
+                headers["Content-Encoding"] = coding
+                if "content-length" in headers:
+                    del headers["content-length"]
+                _vary(headers, content_type)
+                data = stream[0](body) + (b"" if more else stream[1]())
+                message = {"type": "http.response.body", "body": data, "more_body": more}
+            elif compressible(content_type):
+                _vary(headers, content_type)
+            await send(start)
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, encoding_send)
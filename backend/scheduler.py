@@ -0,0 +1,232 @@
+"""
+Job scheduler with lease-based leader election.
+
+Every job is guarded by a row in scheduler_leases. A worker runs a job only
+while it holds that job's lease; leases are renewed by a heartbeat thread and
+expire after LEASE_TTL seconds, so a crashed worker's jobs are picked up by a
+standby within one TTL. Because the lease is a plain row it works the same on
+Postgres and SQLite, and cron-style one-shot runs respect it too.
+
+A job split into several leases (the sync's fleet partitions) is shared out:
+every worker announces itself with a presence lease ("<job>@<holder>") and
+takes about leases / live workers of them, renewing its own first, then any
+that are free or expired, and handing extras back when more workers join. An
+orphaned partition is therefore picked up within one TTL, however many
+workers are left.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, insert, or_, select, update, delete
+from sqlalchemy.exc import IntegrityError
+
+import database as db_mod
+import metrics
+
+LEASE_TTL = int(os.getenv("SCHEDULER_LEASE_TTL", "90")) # seconds; keep well above clock skew between hosts
+
+log = logging.getLogger("geotrack.scheduler")
+
+JOB_RUNS = metrics.Counter("geotrack_scheduler_job_runs_total", "Scheduled job runs", ("job", "result"))
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def partition_of(geotab_id, partitions):
+    """Stable partition for a device (crc32, so every worker and restart agrees)"""
+    return zlib.crc32(str(geotab_id).encode()) % partitions
+
+
+class Partition:
+    def __init__(self, index, count):
+        self.index = index
+        self.count = count
+
+    def owns(self, geotab_id):
+        return self.count <= 1 or partition_of(geotab_id, self.count) == self.index
+
+    def __str__(self):
+        return f"{self.index}/{self.count}"
+
+
+# --- LEASES ---
+
+def acquire_lease(name, holder, ttl=LEASE_TTL):
+    """Take or renew a lease. Returns True if `holder` owns it afterwards."""
+    table = db_mod.SchedulerLease.__table__
+    now = datetime.utcnow()
+    expires = now + timedelta(seconds=ttl)
+    with db_mod.engine.begin() as conn:
+        taken = conn.execute(
+            update(table)
+            .where(table.c.name == name, or_(table.c.holder == holder, table.c.expires_at < now))
+            .values(holder=holder, expires_at=expires,
+                    acquired_at=case((table.c.holder == holder, table.c.acquired_at), else_=now))
+        ).rowcount
+    if taken:
+        return True
+    try:
+        with db_mod.engine.begin() as conn:
+            conn.execute(insert(table).values(name=name, holder=holder, acquired_at=now, expires_at=expires))
+        return True
+    except IntegrityError:
+        return False # someone else holds it
+
+def release_lease(name, holder):
+    table = db_mod.SchedulerLease.__table__
+    with db_mod.engine.begin() as conn:
+        conn.execute(delete(table).where(table.c.name == name, table.c.holder == holder))
+
+
+def live_workers(job_name):
+    """Workers currently announcing themselves for a job (unexpired presence leases)"""
+    table = db_mod.SchedulerLease.__table__
+    with db_mod.engine.connect() as conn:
+        return conn.execute(select(func.count()).where(table.c.name.like(f"{job_name}@%"),
+                                                       table.c.expires_at >= datetime.utcnow())).scalar()
+
+
+# --- SCHEDULER ---
+
+class Job:
+    """run(lease) is called with the lease this worker holds for the job.
+
+    `leases` lists interchangeable leases (e.g. one per fleet partition); a
+    worker runs each one it holds, about leases / live workers of them (see _claim).
+    """
+
+    def __init__(self, name, interval, run, leases=None):
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self.leases = list(leases or [name])
+        self.next_run = 0.0
+
+    def __repr__(self):
+        return f"Job({self.name}, every {self.interval}s, leases={','.join(self.leases)})"
+
+
+class Scheduler:
+    """Runs each job on its own interval while this worker holds the job's lease"""
+
+    def __init__(self, jobs, holder=None, lease_ttl=LEASE_TTL):
+        self.jobs = list(jobs)
+        self.holder = holder or worker_id()
+        self.lease_ttl = lease_ttl
+        self.held = set()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def _try_lease(self, lease):
+        try:
+            ok = acquire_lease(lease, self.holder, self.lease_ttl)
+        except Exception as e:
+            log.warning("Lease check failed: %s", e, extra={"lease": lease})
+            ok = False
+        if ok and lease not in self.held:
+            log.info("Acquired lease", extra={"lease": lease, "holder": self.holder})
+            self.held.add(lease)
+        elif not ok and lease in self.held:
+            log.warning("Lost lease", extra={"lease": lease, "holder": self.holder})
+            self.held.discard(lease)
+        return ok
+
+    def _renew_loop(self):
+        # Keep leases alive while a long job runs on the main thread
+        while not self._stop.wait(self.lease_ttl / 3):
+            for lease in list(self.held):
+                self._try_lease(lease)
+
+    def _release(self, lease):
+        try:
+            release_lease(lease, self.holder)
+        except Exception as e:
+            log.warning("Failed to release lease: %s", e, extra={"lease": lease})
+        self.held.discard(lease)
+
+    def _claim(self, job, greedy=False):
+        """
+        Leases of this job to run now. With several, a fair share: the ones this worker holds,
+        then free or expired ones, up to ceil(leases / live workers); extras beyond the share are
+        handed back. greedy (cron runs) takes every lease that is free instead.
+        """
+        if len(job.leases) == 1:
+            return list(job.leases) if self._try_lease(job.leases[0]) else []
+        share = len(job.leases)
+        if not greedy:
+            self._try_lease(f"{job.name}@{self.holder}")
+            try:
+                workers = live_workers(job.name)
+            except Exception as e:
+                log.warning("Worker count failed: %s", e, extra={"job": job.name})
+                workers = 1
+            share = -(-len(job.leases) // max(workers, 1))
+        held = [lease for lease in job.leases if lease in self.held]
+        for lease in held[share:]:
+            log.info("Handing over lease", extra={"lease": lease, "holder": self.holder, "share": share})
+            self._release(lease)
+        claimed = [lease for lease in held[:share] if self._try_lease(lease)]
+        for lease in job.leases:
+            if len(claimed) >= share:
+                break
+            if lease not in held and self._try_lease(lease):
+                claimed.append(lease)
+        return claimed
+
+    def run_job(self, job, greedy=False):
+        """Run a job once for every lease this worker holds or can take (see _claim). Returns True if it ran."""
+        leases = self._claim(job, greedy)
+        if not leases:
+            JOB_RUNS.inc(job.name, "standby")
+            log.debug("Leases held elsewhere, skipping", extra={"job": job.name})
+            return False
+        for lease in leases:
+            try:
+                with metrics.SYNC_PHASE_DURATION.time(job.name):
+                    job.run(lease)
+                JOB_RUNS.inc(job.name, "ok")
+            except Exception:
+                JOB_RUNS.inc(job.name, "error")
+                log.exception("Job failed", extra={"job": job.name, "lease": lease})
+        return True
+
+    def run_once(self):
+        """Run every job once (cron mode) for every lease that is free, then release the leases"""
+        try:
+            return {job.name: self.run_job(job, greedy=True) for job in self.jobs}
+        finally:
+            self.release_all()
+
+    def run_forever(self):
+        log.info("Scheduler started", extra={"holder": self.holder, "jobs": [repr(j) for j in self.jobs]})
+        self._heartbeat = threading.Thread(target=self._renew_loop, name="scheduler-heartbeat", daemon=True)
+        self._heartbeat.start()
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                for job in self.jobs:
+                    if now >= job.next_run:
+                        ran = self.run_job(job)
+                        # A standby re-checks its lease sooner than a full interval so failover is quick
+                        wait = job.interval if ran else min(job.interval, self.lease_ttl / 3)
+                        job.next_run = time.monotonic() + wait
+                next_due = min(job.next_run for job in self.jobs)
+                self._stop.wait(max(next_due - time.monotonic(), 0.5))
+        finally:
+            self.stop()
+
+    def stop(self):
+        self._stop.set()
+        self.release_all()
+
+    def release_all(self):
+        # Hand over immediately instead of making standbys wait out the TTL
+        for lease in list(self.held):
+            self._release(lease)
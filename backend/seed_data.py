@@ -9,6 +9,7 @@ from passlib.context import CryptContext
 # Ensure we can import database.py
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 import database as db_mod
+import tasks
 
 # Security
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
@@ -68,6 +69,7 @@ def seed_vehicles(db: Session):
 
 def seed_schedules(db: Session, vehicles):
     print("🌱 Seeding Schedules...")
+    templates = tasks.resolve(db, [("Oil Change", "miles", 5000, [500]), ("Tire Rotation", "miles", 10000, [1000])])
     for v in vehicles:
         # Check for existing scheduler
         count = db.query(db_mod.MaintenanceSchedule).filter(db_mod.MaintenanceSchedule.vehicle_id == v.id).count()
@@ -75,24 +77,18 @@ def seed_schedules(db: Session, vehicles):
             continue
 
         # Add Oil Change Schedule
-        s1 = db_mod.MaintenanceSchedule(
-            vehicle_id=v.id,
-            task_name="Oil Change",
-            tracking_type="miles",
-            interval_value=5000,
-            alert_thresholds="500",
+        s1 = tasks.new_schedule(
+            templates["oil change"],
+            v.id,
             last_performed_value=v.current_mileage - random.randint(100, 4000),
             is_active=True
         )
         db.add(s1)
         
         # Add Tire Rotation
-        s2 = db_mod.MaintenanceSchedule(
-            vehicle_id=v.id,
-            task_name="Tire Rotation",
-            tracking_type="miles",
-            interval_value=10000,
-            alert_thresholds="1000",
+        s2 = tasks.new_schedule(
+            templates["tire rotation"],
+            v.id,
             last_performed_value=v.current_mileage - random.randint(500, 9000),
             is_active=True
         )
@@ -111,10 +107,12 @@ def seed_logs(db: Session, vehicles):
         for _ in range(random.randint(3, 5)):
             past_date = datetime.utcnow() - timedelta(days=random.randint(10, 365))
             task = random.choice(TASKS)
+            template = tasks.find(db, [task]).get(tasks.key(task))
             mileage_at_time = v.current_mileage - random.randint(1000, 15000)
             
             log = db_mod.MaintenanceLog(
                 vehicle_id=v.id,
+                task_id=template.id if template else None,
                 task_name=task,
                 performed_at_mileage=max(0, mileage_at_time),
                 performed_at_hours=max(0, v.current_hours - random.randint(50, 500)),
@@ -127,6 +125,7 @@ def seed_logs(db: Session, vehicles):
 
 def main():
     print("🔌 connecting to DB...")
+    db_mod.init_db()
     db = db_mod.SessionLocal()
     try:
         # Test connection
@@ -0,0 +1,163 @@
+"""
+Settings from the Settings page, cached in-process with typed accessors.
+
+Values come from the settings table (keys are case-insensitive, the UI saves
+them lowercase), then the environment, then the caller's default:
+
+    settings_service.get_str("EMAIL_USER")
+    settings_service.get_int("SMTP_PORT", 587)
+
+Reads are served from memory. Every write through update_settings() bumps a counter in
+settings_version, and each process checks that counter at most every
+SETTINGS_REFRESH seconds, so a change saved in the UI reaches the API, the sync
+service and cron scripts without a restart and without a query per access.
+
+A tenant (see tenants.py) can override any setting; its values are saved under
+"<tenant key>:<key>" and win over the deployment-wide value for that tenant:
+
+    settings_service.get_str("ALERT_EMAIL", tenant="north")
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+import database as db_mod
+
+SETTINGS_REFRESH = float(os.getenv("SETTINGS_REFRESH", "5")) # seconds between version checks
+
+log = logging.getLogger("geotrack.settings")
+
+_TRUE = ("1", "true", "yes", "on")
+TENANT_SEPARATOR = ":"
+
+_lock = threading.Lock()
+_saved = None # key as saved -> raw string value
+_values = None # upper-cased key -> raw string value
+_version = None
+_checked_at = 0.0
+
+
+def _read_version(conn):
+    table = db_mod.SettingsVersion.__table__
+    return conn.execute(select(table.c.version).where(table.c.id == 1)).scalar() or 0
+
+
+def _refresh(force=False):
+    global _saved, _values, _version, _checked_at
+    with _lock:
+        if not force and _values is not None and time.monotonic() - _checked_at < SETTINGS_REFRESH:
+            return _values
+        try:
+            with db_mod.engine.connect() as conn:
+                version = _read_version(conn)
+                if force or _values is None or version != _version:
+                    _saved = dict(conn.execute(select(db_mod.Setting.key, db_mod.Setting.value)).all())
+                    _values = {key.upper(): value for key, value in _saved.items()}
+                    if _version is not None and version != _version:
+                        log.info("Settings reloaded", extra={"version": version})
+                    _version = version
+        except Exception as e:
+            # Keep serving the last good values (or env/defaults) while the DB is unreachable
+            log.warning("Could not refresh settings: %s", e)
+            if _values is None:
+                _saved, _values = {}, {}
+        _checked_at = time.monotonic()
+        return _values
+
+
+def is_fresh():
+    """True when the next read will be served from memory without a version check"""
+    return _values is not None and time.monotonic() - _checked_at < SETTINGS_REFRESH
+
+
+def invalidate():
+    """Re-check the version on the next read"""
+    global _checked_at
+    _checked_at = 0.0
+
+
+def scoped_key(key, tenant=None):
+    """Key a setting is saved under for this tenant (None: deployment-wide)"""
+    return f"{tenant}{TENANT_SEPARATOR}{key}" if tenant else key
+
+
+def as_dict(tenant=None):
+    """Settings as saved, keyed the way the UI saved them; with a tenant, its overrides applied"""
+    _refresh()
+    values = {key: value for key, value in _saved.items() if TENANT_SEPARATOR not in key}
+    if tenant:
+        prefix = scoped_key("", tenant).lower()
+        values.update({key[len(prefix):]: value for key, value in _saved.items() if key.lower().startswith(prefix)})
+    return values
+
+
+# --- TYPED ACCESSORS ---
+
+def get_str(key, default=None, env=None, tenant=None, inherit=True):
+    """Setting `key`, else environment variable(s) `env` (default: the key itself; () for none), else `default`.
+
+    With a tenant, its own value comes first; inherit=False stops there (e.g. credentials,
+    which must never fall back to another tenant's). Empty values count as unset, so
+    clearing a field in the UI falls back to the environment.
+    """
+    values = _refresh()
+    if tenant:
+        value = values.get(scoped_key(key, tenant).upper())
+        if value or not inherit:
+            return value or default
+    value = values.get(key.upper())
+    if value:
+        return value
+    names = [key.upper()] if env is None else [env] if isinstance(env, str) else env
+    for name in names:
+        value = os.getenv(name)
+        if value:
+            return value
+    return default
+
+
+def get_int(key, default=None, env=None, tenant=None):
+    value = get_str(key, None, env, tenant)
+    try:
+        return int(value) if value is not None else default
+    except ValueError:
+        log.warning("Setting %s is not an integer: %r", key, value)
+        return default
+
+
+def get_float(key, default=None, env=None, tenant=None):
+    value = get_str(key, None, env, tenant)
+    try:
+        return float(value) if value is not None else default
+    except ValueError:
+        log.warning("Setting %s is not a number: %r", key, value)
+        return default
+
+
+def get_bool(key, default=False, env=None, tenant=None):
+    value = get_str(key, None, env, tenant)
+    return value.strip().lower() in _TRUE if value is not None else default
+
+
+def get_list(key, default=(), env=None, tenant=None):
+    """Comma-separated setting as a list of stripped, non-empty strings"""
+    value = get_str(key, None, env, tenant)
+    if value is None:
+        return list(default)
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+# --- WRITES ---
+
+def update_settings(db, values, tenant=None):
+    """Save settings (a tenant's overrides, with a tenant) and bump the version in the same transaction, then drop this process's cache"""
+    for key, value in values.items():
+        db.merge(db_mod.Setting(key=scoped_key(key, tenant), value=str(value)))
+    table = db_mod.SettingsVersion.__table__
+    db.execute(update(table).where(table.c.id == 1).values(version=table.c.version + 1, updated_at=datetime.utcnow()))
+    db.commit()
+    invalidate()
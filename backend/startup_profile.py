@@ -0,0 +1,38 @@
+import os
+import time
+from contextlib import contextmanager
+
+# Set STARTUP_PROFILE=1 to print a per-phase breakdown of cold-start time
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "").lower() in ("1", "true", "yes")
+
+
+class StartupProfiler:
+    """Records wall time for each named startup phase"""
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at or time.perf_counter()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, round((time.perf_counter() - t0) * 1000, 1)))
+
+    def mark(self, name, since):
+        """Record a phase that began before the profiler could wrap it (e.g. module imports)"""
+        self.phases.append((name, round((time.perf_counter() - since) * 1000, 1)))
+
+    def summary(self):
+        return {
+            "total_ms": round((time.perf_counter() - self.started_at) * 1000, 1),
+            "phases": [{"phase": name, "ms": ms} for name, ms in self.phases],
+        }
+
+    def report(self):
+        summary = self.summary()
+        print(f"STARTUP PROFILE: {summary['total_ms']} ms total")
+        for name, ms in self.phases:
+            print(f"   {name:<24} {ms:>8.1f} ms")
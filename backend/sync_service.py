@@ -1,63 +1,134 @@
-import time
 import os
+import argparse
+import logging
 import mygeotab
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
+from sqlalchemy import case, insert, update
 from sqlalchemy.orm import Session
 import database as db_mod
 import email_utils
+import enrollment
+import fleet_snapshot
+import geotab_session
+import groups
+import log_config
+import metrics
+import poll_planner
+import purger
+import scheduler
+import settings_service
+import tenants
+from log_config import sampled
 
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger("geotrack.sync")
+
 # Configuration
 GEOTAB_SERVER = os.getenv("GEOTAB_SERVER", "my.geotab.com")
 GEOTAB_USER = os.getenv("GEOTAB_USER")
 GEOTAB_PASS = os.getenv("GEOTAB_PASSWORD")
 GEOTAB_DB = os.getenv("GEOTAB_DATABASE")
 
-SYNC_INTERVAL = 60 # seconds
+SYNC_INTERVAL = int(os.getenv("SYNC_INTERVAL", "60")) # seconds between telemetry syncs
+ALERT_INTERVAL = int(os.getenv("ALERT_INTERVAL", "300")) # seconds between alert checks
+SYNC_PARTITIONS = int(os.getenv("SYNC_PARTITIONS", "1")) # split the fleet across this many workers
+SYNC_PARTITION = os.getenv("SYNC_PARTITION", "auto") # this worker's partition, or "auto" to share them out with the other workers
+METRICS_PORT = int(os.getenv("SYNC_METRICS_PORT", "0")) # serve /metrics from the sync loop when set
+SYNC_TENANT_WORKERS = int(os.getenv("SYNC_TENANT_WORKERS", "4")) # tenants synced at once (see tenants.py)
+WRITE_CHUNK = 500 # vehicles per telemetry UPDATE statement
+
+# Per-vehicle poll intervals for this worker, one planner per tenant (see poll_planner.py)
+planners = {}
+
+def planner_for(tenant):
+    tenant_id = db_mod.DEFAULT_TENANT if tenant is None else tenant.id
+    return planners.setdefault(tenant_id, poll_planner.PollPlanner())
+
+def geotab_get(api, type_name, **kwargs):
+    """api.get with call and error counters"""
+    metrics.GEOTAB_CALLS.inc(f"Get {type_name}")
+    try:
+        return api.get(type_name, **kwargs)
+    except Exception as e:
+        metrics.GEOTAB_ERRORS.inc(f"Get {type_name}", type(e).__name__)
+        raise
+
+def geotab_credentials(tenant=None):
+    """
+    Geotab login from the Settings page when configured there, otherwise from the environment.
+    Other tenants than the default one use only their own tenant settings.
+    """
+    if not tenants.is_default(tenant):
+        def own(key):
+            return settings_service.get_str(key, env=(), tenant=tenant.key, inherit=False)
+        return {"username": own("GEOTAB_USER"), "password": own("GEOTAB_PASS"), "database": own("GEOTAB_DB"),
+                "server": own("GEOTAB_SERVER") or GEOTAB_SERVER}
+    return {
+        "username": settings_service.get_str("GEOTAB_USER", GEOTAB_USER, env=()),
+        "password": settings_service.get_str("GEOTAB_PASS", GEOTAB_PASS, env=("GEOTAB_PASSWORD", "GEOTAB_PASS")),
+        "database": settings_service.get_str("GEOTAB_DB", GEOTAB_DB, env=("GEOTAB_DATABASE", "GEOTAB_DB")),
+        "server": settings_service.get_str("GEOTAB_SERVER", GEOTAB_SERVER, env=()),
+    }
 
-def get_geotab_api():
-    """Authenticate and return Geotab API object"""
+def get_geotab_api(credentials=None, rate=None):
+    """Geotab API for these credentials, reusing the cached session (authenticates only when there is none)"""
+    credentials = credentials or geotab_credentials()
     try:
-        api = mygeotab.API(username=GEOTAB_USER, password=GEOTAB_PASS, database=GEOTAB_DB)
-        api.authenticate()
-        print(f"✅ Authenticated with Geotab: {GEOTAB_USER}")
+        api = geotab_session.get_session(credentials, rate)
+        if not api.authenticated:
+            api.authenticate()
         return api
     except mygeotab.AuthenticationException as e:
-        print(f"❌ Geotab Authorization Failed: {e}")
+        log.error("Geotab authorization failed: %s", e)
         return None
     except Exception as e:
-        print(f"❌ Geotab Connection Error: {e}")
+        log.error("Geotab connection error: %s", e)
         return None
 
-def sync_vehicles(api, db: Session):
-    """Fetch all devices and update local DB"""
-    print("🔄 Syncing Vehicles...")
+def sync_vehicles(api, db: Session, partition=None, tenant=None):
+    """Fetch all devices and update local DB (only this worker's partition of them, if given) for a tenant (default: the default one)"""
+    log.debug("Syncing vehicles")
+    tenant_id = db_mod.DEFAULT_TENANT if tenant is None else tenant.id
     try:
-        devices = api.get("Device", search={"groups": [{"id": "GroupCompanyId"}]})
-        print(f"   Found {len(devices)} devices in Geotab.")
+        devices = geotab_get(api, "Device", search={"groups": [{"id": "GroupCompanyId"}]})
+        log.debug("Fetched devices from Geotab", extra={"devices": len(devices)})
+        if partition is None or partition.index == 0:
+            # The group tree is company-wide: one partition keeps it, the others only link their devices
+            group_ids = groups.sync_groups(db, geotab_get(api, "Group"), tenant_id)
+        else:
+            group_ids = groups.sync_groups(db, [], tenant_id)
+        if partition is not None:
+            devices = [d for d in devices if partition.owns(d['id'])]
         
         count_updated = 0
         count_new = 0
+        assigned = {} # vehicle id -> Geotab ids of its groups
 
         for device in devices:
             g_id = device['id']
             name = device.get('name', 'Unknown')
             vin = device.get('serialNumber', None)
             
-            # Find existing
-            existing = db.query(db_mod.Vehicle).filter(db_mod.Vehicle.geotab_id == g_id).first()
+            # Find existing (including soft-deleted ones, which stay deleted until purged)
+            existing = db.query(db_mod.Vehicle).filter(db_mod.Vehicle.tenant_id == tenant_id, db_mod.Vehicle.geotab_id == g_id)\
+                         .execution_options(include_deleted=True).first()
             
+            if existing and existing.deleted_at is not None:
+                continue
             if existing:
                 if existing.name != name or existing.vin != vin:
                     existing.name = name
                     existing.vin = vin
                     existing.last_sync = datetime.utcnow()
                     count_updated += 1
+                assigned[existing.id] = [g["id"] for g in device.get("groups") or []]
             else:
                 new_v = db_mod.Vehicle(
+                    tenant_id=tenant_id,
                     geotab_id=g_id,
                     name=name,
                     vin=vin,
@@ -67,35 +138,32 @@ def sync_vehicles(api, db: Session):
                 db.flush() # Get ID
 
                 # Create default schedule (Oil Change every 5000 miles)
-                default_schedule = db_mod.MaintenanceSchedule(
-                    vehicle_id=new_v.id,
-                    task_name="Oil Change",
-                    tracking_type="miles",
-                    interval_value=5000.0,
-                    alert_thresholds="4500,4800"
-                )
-                db.add(default_schedule)
+                db.add(enrollment.default_schedule(db, new_v.id))
+                assigned[new_v.id] = [g["id"] for g in device.get("groups") or []]
                 
                 count_new += 1
         
+        db.flush()
+        joined, left = groups.sync_memberships(db, assigned, group_ids)
+        if count_new or count_updated:
+            fleet_snapshot.touch(db)
         db.commit()
-        print(f"   Saved: {count_new} new, {count_updated} updated.")
+        fleet_snapshot.current(force=True)
+        log.info("Vehicles synced", extra={"tenant_id": tenant_id, "devices": len(devices), "new": count_new, "updated": count_updated,
+                                           "group_links_added": joined, "group_links_removed": left})
 
-    except Exception as e:
-        print(f"❌ Error syncing vehicles: {e}")
+    except Exception:
+        log.exception("Error syncing vehicles")
         db.rollback()
 
 def check_maintenance_alerts(db: Session):
     """Check if any vehicles are due for maintenance and send alerts"""
-    print("🔍 Checking Maintenance Alerts...")
-    schedules = db.query(db_mod.MaintenanceSchedule)\
-                  .join(db_mod.Vehicle)\
-                  .filter(db_mod.MaintenanceSchedule.is_active == True).all()
-
-    for schedule in schedules:
-        vehicle = schedule.vehicle
-        if not vehicle: continue
+    log.debug("Checking maintenance alerts")
+    # Evaluated on the fleet snapshot; only schedules that actually alert are written
+    schedules = list(fleet_snapshot.current(force=True).active_schedules())
+    metrics.ALERTS_EVALUATED.inc(amount=len(schedules))
 
+    for vehicle, schedule in schedules:
         is_due = False
         current_val = 0
         due_val = 0
@@ -136,11 +204,13 @@ def check_maintenance_alerts(db: Session):
             Please schedule service soon.
             """
             
-            print(f"   ⚠️ sending alert for {vehicle.name}...")
+            log.info("Sending maintenance alert", extra={"vehicle_id": vehicle.id, "task": schedule.task_name})
             success = email_utils.send_email_notification(subject, body)
             
             if success:
-                schedule.last_alerted_at = datetime.utcnow()
+                metrics.ALERTS_SENT.inc()
+                db.query(db_mod.MaintenanceSchedule).filter(db_mod.MaintenanceSchedule.id == schedule.id)\
+                  .update({"last_alerted_at": datetime.utcnow()}, synchronize_session=False)
                 
                 # Create In-App Notification
                 new_notif = db_mod.Notification(
@@ -150,109 +220,213 @@ def check_maintenance_alerts(db: Session):
                 )
                 db.add(new_notif)
                 
+                version = fleet_snapshot.touch(db)
                 db.commit()
+                fleet_snapshot.patch([vehicle.id], version)
+            else:
+                metrics.ALERTS_FAILED.inc()
 
-def sync_status_data(api, db: Session):
-    """Fetch odometer and engine hours"""
-    print("🔄 Syncing Telemetry (Odometer/Hours)...")
+def latest_reading(api, geotab_id, *diagnostics):
+    """Latest StatusData value from the first diagnostic that has one in the last 14 days"""
+    for diagnostic in diagnostics:
+        readings = geotab_get(api, "StatusData", search={
+            "deviceSearch": {"id": geotab_id},
+            "diagnosticSearch": {"id": diagnostic},
+            "fromDate": (datetime.utcnow() - timedelta(days=14)).isoformat() + "Z",
+            "take": 1
+        })
+        if readings:
+            return readings[0]['data']
+    return None
+
+def write_readings(db: Session, changes, now):
+    """One UPDATE for all changed vehicles ({id: (mileage, hours)}), chunked to stay under bind-parameter limits"""
+    table = db_mod.Vehicle.__table__
+    items = list(changes.items())
+    for start in range(0, len(items), WRITE_CHUNK):
+        chunk = dict(items[start:start + WRITE_CHUNK])
+        db.execute(
+            update(table)
+            .where(table.c.id.in_(chunk))
+            .values(current_mileage=case({vid: m for vid, (m, h) in chunk.items()}, value=table.c.id),
+                    current_hours=case({vid: h for vid, (m, h) in chunk.items()}, value=table.c.id),
+                    last_sync=now)
+        )
+
+def record_heartbeat(db: Session, scope, **counts):
+    """Mark a completed cycle for this scope: one narrow row instead of touching every vehicle"""
+    table = db_mod.SyncHeartbeat.__table__
+    values = {"synced_at": datetime.utcnow(), **counts}
+    if not db.execute(update(table).where(table.c.scope == scope).values(**values)).rowcount:
+        db.execute(insert(table).values(scope=scope, **values))
+
+def sync_status_data(api, db: Session, partition=None, tenant=None):
+    """Fetch odometer and engine hours for a tenant's vehicles; write only the vehicles whose readings changed"""
+    log.debug("Syncing telemetry (odometer/hours)")
+    tenant_id = db_mod.DEFAULT_TENANT if tenant is None else tenant.id
+    planner = planner_for(tenant)
     try:
-        # Get all vehicles from DB to map IDs
-        vehicles = db.query(db_mod.Vehicle).all()
-        
-        for v in vehicles:
+        # Read from the fleet snapshot (checked against fleet_version first), not the ORM
+        snapshot = fleet_snapshot.current(force=True)
+        vehicles = snapshot.of_tenant(tenant_id)
+        if partition is not None:
+            vehicles = [v for v in vehicles if partition.owns(v.geotab_id)]
+        schedules = {v.id: [s for s in v.schedules if s.is_active] for v in vehicles}
+        planner.forget({v.id for v in vehicles})
+        due = planner.plan(vehicles, schedules)
+        metrics.SYNC_VEHICLES.inc("polled", amount=len(due))
+        metrics.SYNC_VEHICLES.inc("skipped", amount=len(vehicles) - len(due))
+
+        changes, due_changes = {}, {}
+        for v in due:
             try:
-                # Get Odometer
-                odom_readings = api.get("StatusData", search={
-                    "deviceSearch": {"id": v.geotab_id},
-                    "diagnosticSearch": {"id": "DiagnosticOdometerId"},
-                    "fromDate": (datetime.utcnow() - timedelta(days=14)).isoformat() + "Z",
-                    "take": 1
-                })
-                
-                if odom_readings:
-                    # Convert meters to miles? Assuming meters from Geotab usually
-                    # 1 meter = 0.000621371 miles
-                    meters = odom_readings[0]['data']
-                    miles = meters * 0.000621371
-                    v.current_mileage = round(miles, 1)
-
-                # Get AccessEngineHours
-                # Get AccessEngineHours
-                # Try Wrapper first (usually correct for billing/runtime)
-                hours_readings = api.get("StatusData", search={
-                    "deviceSearch": {"id": v.geotab_id},
-                    "diagnosticSearch": {"id": "DiagnosticEngineHoursWrapperId"},
-                    "fromDate": (datetime.utcnow() - timedelta(days=14)).isoformat() + "Z",
-                    "take": 1
-                })
-                
-                # Fallback to raw Engine Hours if Wrapper is empty
-                if not hours_readings:
-                    hours_readings = api.get("StatusData", search={
-                        "deviceSearch": {"id": v.geotab_id},
-                        "diagnosticSearch": {"id": "DiagnosticEngineHoursId"},
-                        "fromDate": (datetime.utcnow() - timedelta(days=14)).isoformat() + "Z",
-                        "take": 1
-                    })
-                
-                if hours_readings:
-                    # Seconds to Hours
-                    seconds = hours_readings[0]['data']
-                    hours = seconds / 3600.0
-                    v.current_hours = round(hours, 1)
-                
-                v.last_sync = datetime.utcnow()
-                
+                mileage, hours = v.current_mileage, v.current_hours
+
+                # Geotab reports the odometer in meters
+                meters = latest_reading(api, v.geotab_id, "DiagnosticOdometerId")
+                if meters is not None:
+                    mileage = round(meters * 0.000621371, 1)
+
+                # Wrapper first (usually correct for billing/runtime), raw engine hours as fallback; seconds
+                seconds = latest_reading(api, v.geotab_id, "DiagnosticEngineHoursWrapperId", "DiagnosticEngineHoursId")
+                if seconds is not None:
+                    hours = round(seconds / 3600.0, 1)
+
+                if (mileage, hours) != (v.current_mileage, v.current_hours):
+                    changes[v.id] = (mileage, hours)
+                    due_changes[v.id] = groups.count_due(schedules.get(v.id, ()), mileage, hours) - \
+                        groups.count_due(schedules.get(v.id, ()), v.current_mileage, v.current_hours)
+                planner.observe(v.id, mileage, hours, schedules.get(v.id, ()))
+
             except Exception as ve:
-                print(f"   ⚠️ Failed to sync vehicle {v.name}: {ve}")
-                
+                # One line per failing vehicle would flood the log during a Geotab outage
+                log.warning("Failed to sync vehicle: %s", ve, extra=sampled(100, vehicle_id=v.id, geotab_id=v.geotab_id))
+
+        write_readings(db, changes, datetime.utcnow())
+        # Due counts of the groups above these vehicles move with them
+        groups.adjust_due(db, due_changes)
+        scope = "sync" if tenants.is_default(tenant) else f"sync@{tenant.key}"
+        if partition is not None and partition.count > 1:
+            scope = f"{scope}:{partition}"
+        record_heartbeat(db, scope, vehicles=len(vehicles), polled=len(due), changed=len(changes))
+        if changes:
+            fleet_snapshot.touch(db)
         db.commit()
-        print("   Telemetry updated.")
+        fleet_snapshot.current(force=True)
+        metrics.SYNC_VEHICLES.inc("changed", amount=len(changes))
+        log.info("Telemetry synced", extra={"tenant_id": tenant_id, "vehicles": len(vehicles), "polled": len(due), "changed": len(changes), **planner.summary()})
 
-    except Exception as e:
-        print(f"❌ Error syncing status data: {e}")
+    except Exception:
+        log.exception("Error syncing status data")
         db.rollback()
 
-import argparse
+# --- JOBS ---
+
+def sync_tenant(tenant, partition=None):
+    """One telemetry sync of one tenant: vehicles and status data for the partition, on its cached Geotab session"""
+    db = db_mod.SessionLocal()
+    try:
+        rate = settings_service.get_float("GEOTAB_RATE_LIMIT", tenants.GEOTAB_RATE_LIMIT, tenant=tenant.key)
+        with metrics.SYNC_PHASE_DURATION.time("authenticate"):
+            api = get_geotab_api(geotab_credentials(tenant), rate)
+        if not api:
+            raise RuntimeError(f"Geotab authentication failed for tenant {tenant.key}")
+        with metrics.SYNC_PHASE_DURATION.time("sync_vehicles"):
+            sync_vehicles(api, db, partition, tenant)
+        with metrics.SYNC_PHASE_DURATION.time("sync_status_data"):
+            sync_status_data(api, db, partition, tenant)
+    finally:
+        db.close()
+
+def run_sync(partition=None):
+    """
+    One telemetry sync of every tenant, up to SYNC_TENANT_WORKERS at once. Each tenant has
+    its own session, Geotab login and rate limit, so one failing tenant doesn't hold up the others.
+    """
+    active = tenants.all_tenants(force=True)
+    if len(active) <= 1:
+        for tenant in active:
+            sync_tenant(tenant, partition)
+        return
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(1, min(SYNC_TENANT_WORKERS, len(active))), thread_name_prefix="sync-tenant") as pool:
+        futures = {pool.submit(sync_tenant, tenant, partition): tenant for tenant in active}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception:
+                failed.append(futures[future].key)
+                log.exception("Tenant sync failed", extra={"tenant": futures[future].key})
+    if len(failed) == len(active):
+        raise RuntimeError("Sync failed for every tenant")
+    log.info("Tenants synced", extra={"tenants": len(active), "failed": failed})
+
+def run_alerts():
+    db = db_mod.SessionLocal()
+    try:
+        with metrics.SYNC_PHASE_DURATION.time("check_maintenance_alerts"):
+            check_maintenance_alerts(db)
+    finally:
+        db.close()
+
+def run_group_stats():
+    db = db_mod.SessionLocal()
+    try:
+        with metrics.SYNC_PHASE_DURATION.time("group_stats"):
+            groups.refresh_due(db)
+            db.commit()
+    finally:
+        db.close()
+
+def build_jobs(partitions=SYNC_PARTITIONS, partition=SYNC_PARTITION, sync=True, alerts=True, purge=True, group_stats=True):
+    """Scheduler jobs for this worker. Each fleet partition has its own lease; alerts, purge and group stats have one global lease each."""
+    jobs = []
+    if sync:
+        if partitions <= 1:
+            leases = {"sync": None}
+        else:
+            indexes = range(partitions) if partition == "auto" else [int(partition)]
+            leases = {f"sync:{i}/{partitions}": scheduler.Partition(i, partitions) for i in indexes}
+        jobs.append(scheduler.Job("sync", SYNC_INTERVAL, lambda lease: run_sync(leases[lease]), leases=list(leases)))
+    if alerts:
+        jobs.append(scheduler.Job("alerts", ALERT_INTERVAL, lambda lease: run_alerts()))
+    if purge:
+        # Same lease as the API's purge thread, so the two never purge at once
+        jobs.append(scheduler.Job("purge", purger.PURGE_INTERVAL, lambda lease: purger.run_pending(), leases=[purger.LEASE]))
+    if group_stats:
+        jobs.append(scheduler.Job("groups", groups.GROUP_STATS_INTERVAL, lambda lease: run_group_stats()))
+    return jobs
 
 def main():
     parser = argparse.ArgumentParser(description="Geotab Sync Service")
-    parser.add_argument("--once", action="store_true", help="Run sync once and exit")
+    parser.add_argument("--once", action="store_true", help="Run each job once and exit (cron mode)")
+    parser.add_argument("--jobs", default="sync,alerts,purge,groups", help="Comma-separated jobs to run: sync, alerts, purge, groups")
+    parser.add_argument("--partitions", type=int, default=SYNC_PARTITIONS, help="Number of fleet partitions across all workers")
+    parser.add_argument("--partition", default=SYNC_PARTITION, help="Partition index for this worker, or 'auto'")
     args = parser.parse_args()
 
-    print("🚀 Starting Geotab Sync Service...")
+    log_config.configure()
+    log.info("Starting Geotab sync service", extra={"mode": "once" if args.once else "loop"})
+    if not db_mod.init_db():
+        log.error("Database is not ready, exiting")
+        return
+    if METRICS_PORT and not args.once:
+        metrics.serve(METRICS_PORT)
+        metrics.watch_pool(db_mod.engine)
+        log.info("Serving metrics", extra={"port": METRICS_PORT})
+
+    selected = {j.strip() for j in args.jobs.split(",") if j.strip()}
+    jobs = build_jobs(args.partitions, args.partition, sync="sync" in selected, alerts="alerts" in selected,
+                      purge="purge" in selected, group_stats="groups" in selected)
+    runner = scheduler.Scheduler(jobs)
     if args.once:
-        print("   Mode: Run Once")
-    else:
-        print("   Mode: Continuous Loop")
-        print("   Press Ctrl+C to stop.")
-    
-    while True:
-        api = get_geotab_api()
-        if not api:
-            if args.once:
-                print("❌ Failed to authenticate. Exiting.")
-                return
-            print("   Retrying in 60s...")
-            time.sleep(60)
-            continue
-            
-        # Connect to DB
-        try:
-            db = db_mod.SessionLocal()
-            sync_vehicles(api, db)
-            sync_status_data(api, db)
-            check_maintenance_alerts(db)
-            db.close()
-        except Exception as e:
-            print(f"❌ Database Connection Failed: {e}")
-        
-        if args.once:
-            print("✅ Sync complete. Exiting.")
-            break
-            
-        print(f"💤 Sleeping {SYNC_INTERVAL}s...")
-        time.sleep(SYNC_INTERVAL)
+        ran = runner.run_once()
+        log.info("Run complete, exiting", extra={"ran": [name for name, did in ran.items() if did]})
+        return
+    try:
+        runner.run_forever()
+    except KeyboardInterrupt:
+        log.info("Stopping")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,187 @@
+"""
+Maintenance task templates.
+
+A task (maintenance_tasks) defines a piece of maintenance once: name, tracking
+type, interval and its alert thresholds as typed rows (task_thresholds).
+Schedules and logs point at it by task_id. A schedule only stores an interval
+or thresholds of its own when that vehicle differs from the task, so changing a
+task's interval is one row update for every vehicle that follows it, and alert
+evaluation reads pre-parsed floats instead of re-splitting strings.
+
+Task names are matched case-insensitively, and only at the API boundary (a
+schedule or log submitted by name); everything stored refers to the id.
+"""
+import logging
+from collections import Counter
+
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import IntegrityError
+
+import database as db_mod
+from database import format_thresholds, parse_thresholds
+
+log = logging.getLogger("geotrack.tasks")
+
+
+class TaskConflict(ValueError):
+    pass
+
+
+def key(name):
+    return (name or "").strip().lower()
+
+
+def find(db, names):
+    """{lowercased name: MaintenanceTask} for the given names, in one query"""
+    wanted = {key(n) for n in names if key(n)}
+    if not wanted:
+        return {}
+    found = db.scalars(select(db_mod.MaintenanceTask).where(func.lower(db_mod.MaintenanceTask.name).in_(wanted)))
+    return {key(t.name): t for t in found}
+
+
+def resolve(db, specs):
+    """
+    Tasks for (name, tracking_type, interval, thresholds) specs: existing ones by name,
+    new ones created from the first spec that names them. Flushes, does not commit.
+    """
+    tasks = find(db, [s[0] for s in specs])
+    for name, tracking_type, interval, thresholds in specs:
+        task = tasks.get(key(name))
+        if task is None:
+            task = tasks[key(name)] = _create(db, db_mod.MaintenanceTask(
+                name=name.strip(), tracking_type=tracking_type, interval_value=interval,
+                thresholds=[db_mod.TaskThreshold(value=v) for v in thresholds]))
+        if tracking_type and task.tracking_type != tracking_type:
+            raise TaskConflict(f"task '{task.name}' is tracked in {task.tracking_type}, not {tracking_type}")
+    db.flush()
+    return tasks
+
+
+def _create(db, task):
+    """Insert a new task in a savepoint; if a concurrent request created the same name first, that task instead"""
+    try:
+        with db.begin_nested():
+            db.add(task)
+    except IntegrityError:
+        winner = find(db, [task.name]).get(key(task.name))
+        if winner is None:
+            raise
+        log.info("Task created concurrently, using the existing one", extra={"task_id": winner.id, "task": winner.name})
+        return winner
+    return task
+
+
+def schedule_fields(task, interval=None, thresholds=None):
+    """
+    (column values, threshold overrides) for a schedule of this task: the interval and
+    thresholds are only stored on the schedule when they differ from the task's.
+    """
+    own_interval = interval if interval is not None and interval != task.interval_value else None
+    # An empty list differing from the task's is an override too: that vehicle gets no alerts
+    own = thresholds is not None and tuple(thresholds) != tuple(t.value for t in task.thresholds)
+    fields = {"task_id": task.id, "task_name": task.name, "tracking_type": task.tracking_type, "interval_override": own_interval,
+              "own_thresholds": own}
+    return fields, list(thresholds) if own else []
+
+
+def override(schedule, interval=None, thresholds=None):
+    """Set a schedule's own interval/thresholds; values equal to the task's go back to following it"""
+    task = schedule.task
+    if interval is not None:
+        schedule.interval_override = None if task is not None and interval == task.interval_value else interval
+    if thresholds is not None:
+        follows = task is not None and tuple(thresholds) == tuple(t.value for t in task.thresholds)
+        schedule.threshold_overrides = [] if follows else [db_mod.TaskThreshold(value=v) for v in thresholds]
+        schedule.own_thresholds = not follows
+
+
+def new_schedule(task, vehicle_id, interval=None, thresholds=None, **values):
+    """MaintenanceSchedule for one vehicle following (or overriding) a task"""
+    fields, overrides = schedule_fields(task, interval, thresholds)
+    schedule = db_mod.MaintenanceSchedule(vehicle_id=vehicle_id, **fields, **values)
+    schedule.threshold_overrides = [db_mod.TaskThreshold(value=v) for v in overrides]
+    return schedule
+
+
+def update(db, task, name=None, interval_value=None, thresholds=None):
+    """Change a task for every schedule that follows it. Does not commit."""
+    if name is not None and name.strip() != task.name:
+        clash = find(db, [name]).get(key(name))
+        if clash is not None and clash.id != task.id:
+            raise TaskConflict(f"a task named '{clash.name}' already exists")
+        task.name = name.strip()
+        # The schedules' display copy of the name, in one statement
+        db.query(db_mod.MaintenanceSchedule).filter(db_mod.MaintenanceSchedule.task_id == task.id)\
+            .update({db_mod.MaintenanceSchedule.task_name: task.name}, synchronize_session=False)
+    if interval_value is not None:
+        task.interval_value = interval_value
+    if thresholds is not None:
+        task.thresholds = [db_mod.TaskThreshold(value=v) for v in thresholds]
+    db.flush()
+    log.info("Task updated", extra={"task_id": task.id, "interval": task.interval_value, "thresholds": format_thresholds(t.value for t in task.thresholds)})
+    return task
+
+
+def backfill(conn, legacy_thresholds=True):
+    """
+    Migration step: turn the task definitions copied onto every schedule into tasks.
+    Each distinct (name, tracking type) becomes a task with its most common interval
+    and thresholds; schedules that differ keep theirs as overrides, including empty
+    or unparseable ones (no alerts, as before). Logs are linked by name. Core
+    statements only, so it runs inside the migration transaction.
+    """
+    thresholds_col = "alert_thresholds" if legacy_thresholds else "NULL"
+    rows = conn.execute(text(
+        f"SELECT id, task_name, tracking_type, interval_value, {thresholds_col} AS thresholds FROM maintenance_schedules WHERE task_id IS NULL"
+    )).all()
+    if not rows:
+        return 0
+
+    def parsed(raw):
+        try:
+            return tuple(parse_thresholds(raw))
+        except ValueError:
+            return ()
+
+    groups = {}
+    for row in rows:
+        groups.setdefault((key(row.task_name), row.tracking_type), []).append(row)
+
+    tasks_t, thresholds_t = db_mod.MaintenanceTask.__table__, db_mod.TaskThreshold.__table__
+    existing = {key(name): (tid, tracking) for tid, name, tracking in conn.execute(select(tasks_t.c.id, tasks_t.c.name, tasks_t.c.tracking_type))}
+    updates, overrides, links = [], [], {}
+    for (name_key, tracking), members in groups.items():
+        name = members[0].task_name.strip() if members[0].task_name else "Unnamed task"
+        if name_key in existing and existing[name_key][1] != tracking:
+            # Same name tracked two ways (e.g. miles and hours): keep them apart
+            name, name_key = f"{name} ({tracking})", key(f"{name} ({tracking})")
+        common = Counter((m.interval_value, parsed(m.thresholds)) for m in members).most_common(1)[0][0]
+        if name_key in existing:
+            task_id = existing[name_key][0]
+            task_interval = conn.execute(select(tasks_t.c.interval_value).where(tasks_t.c.id == task_id)).scalar()
+            task_thresholds = tuple(v for (v,) in conn.execute(
+                select(thresholds_t.c.value).where(thresholds_t.c.task_id == task_id).order_by(thresholds_t.c.value)))
+        else:
+            task_interval, task_thresholds = common
+            task_id = conn.execute(tasks_t.insert().values(name=name, tracking_type=tracking, interval_value=task_interval)).inserted_primary_key[0]
+            if task_thresholds:
+                conn.execute(thresholds_t.insert(), [{"task_id": task_id, "value": v} for v in task_thresholds])
+            existing[name_key] = (task_id, tracking)
+        links[name_key] = task_id
+        for m in members:
+            differs = parsed(m.thresholds) != task_thresholds
+            updates.append({"sid": m.id, "tid": task_id, "tname": name, "differs": differs,
+                            "own": m.interval_value if m.interval_value != task_interval else None})
+            if differs:
+                overrides.extend({"schedule_id": m.id, "value": v} for v in parsed(m.thresholds))
+
+    conn.execute(text("UPDATE maintenance_schedules SET task_id = :tid, task_name = :tname, interval_value = :own, "
+                      "own_thresholds = :differs WHERE id = :sid"), updates)
+    if overrides:
+        conn.execute(thresholds_t.insert(), overrides)
+    conn.execute(text("UPDATE maintenance_logs SET task_id = :tid WHERE task_id IS NULL AND LOWER(TRIM(task_name)) = :name"),
+                 [{"tid": tid, "name": name_key} for name_key, tid in links.items()])
+    log.info("Task templates backfilled", extra={"tasks": len(links), "schedules": len(rows),
+                                                 "own_thresholds": sum(u["differs"] for u in updates)})
+    return len(links)
@@ -0,0 +1,131 @@
+"""
+Tenants: several Geotab databases served by one deployment.
+
+A tenant is one Geotab database (one per subsidiary, say) with its own vehicles
+and group tree. vehicles and fleet_groups carry tenant_id, and Geotab ids only
+have to be unique within a tenant, since every database has its own "b1" and
+its own "GroupCompanyId". Tenant 1, "default", is the database the deployment
+was set up with: it keeps the deployment-wide GEOTAB_* settings and
+environment, so a single-tenant deployment works exactly as before.
+
+Every other tenant keeps its Geotab login in tenant settings ("<key>:GEOTAB_USER"
+and so on, see settings_service), which never fall back to the default
+tenant's. Any other setting can be overridden per tenant the same way, e.g.
+GEOTAB_RATE_LIMIT.
+
+API requests carrying X-Tenant: <key> only see that tenant (see
+database.tenant_scope); without the header they see every tenant. The sync
+service syncs every tenant each cycle, several at a time (sync_service.run_sync).
+"""
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func, insert, select
+
+import database as db_mod
+import settings_service
+
+TENANT_HEADER = "X-Tenant"
+TENANTS_REFRESH = float(os.getenv("TENANTS_REFRESH", "30")) # seconds a process keeps the tenant list
+GEOTAB_RATE_LIMIT = float(os.getenv("GEOTAB_RATE_LIMIT", "0")) # Geotab calls per second per tenant, 0 = no limit
+KEY_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+log = logging.getLogger("geotrack.tenants")
+
+
+class TenantNotFound(ValueError):
+    pass
+
+
+class InvalidTenant(ValueError):
+    pass
+
+
+class TenantExists(InvalidTenant):
+    pass
+
+
+# --- THIS PROCESS'S TENANT LIST ---
+
+_lock = threading.Lock()
+_by_key = None # key -> Row(id, key, name)
+_loaded_at = 0.0
+
+
+def is_fresh():
+    """True when the tenant list will be served from memory"""
+    return _by_key is not None and time.monotonic() - _loaded_at < TENANTS_REFRESH
+
+
+def _load(force=False):
+    global _by_key, _loaded_at
+    with _lock:
+        if force or not is_fresh():
+            table = db_mod.Tenant.__table__
+            with db_mod.engine.connect() as conn:
+                rows = conn.execute(select(table.c.id, table.c.key, table.c.name).order_by(table.c.id)).all()
+            _by_key, _loaded_at = {row.key: row for row in rows}, time.monotonic()
+        return _by_key
+
+
+def invalidate():
+    global _loaded_at
+    _loaded_at = 0.0
+
+
+def all_tenants(force=False):
+    """[Row(id, key, name)] by id"""
+    return list(_load(force).values())
+
+
+def cached(key):
+    """The tenant with this key if the list is in memory and has it, else None (no database access)"""
+    return _by_key.get(key) if is_fresh() else None
+
+
+def resolve(key):
+    """The tenant with this key; TenantNotFound if there is none (checked against the database before giving up)"""
+    tenant = _load().get(key)
+    if tenant is None:
+        tenant = _load(force=True).get(key)
+    if tenant is None:
+        raise TenantNotFound(f"Tenant {key} not found")
+    return tenant
+
+
+def is_default(tenant):
+    return tenant is None or tenant.id == db_mod.DEFAULT_TENANT
+
+
+# --- WRITES ---
+
+def create(db, key, name=None, settings=None):
+    """Add a tenant with its settings (e.g. GEOTAB_USER, GEOTAB_PASS, GEOTAB_DB). Commits. Returns its id."""
+    key = (key or "").strip().lower()
+    if not KEY_PATTERN.match(key):
+        raise InvalidTenant("key must be 1-32 lowercase letters, digits, '-' or '_', starting with a letter or digit")
+    table = db_mod.Tenant.__table__
+    if db.execute(select(table.c.id).where(table.c.key == key)).first():
+        raise TenantExists(f"Tenant {key} already exists")
+    tenant_id = db.execute(insert(table).values(key=key, name=name or key, created_at=datetime.utcnow())
+                           .returning(table.c.id)).scalar()
+    # Commits the tenant row along with its settings
+    settings_service.update_settings(db, {k: v for k, v in (settings or {}).items() if v is not None}, tenant=key)
+    invalidate()
+    log.info("Tenant created", extra={"tenant": key, "tenant_id": tenant_id})
+    return tenant_id
+
+
+def summary():
+    """[dict] for every tenant with its vehicle count"""
+    tenants, vehicles = db_mod.Tenant.__table__, db_mod.Vehicle.__table__
+    with db_mod.engine.connect() as conn:
+        counts = dict(conn.execute(select(vehicles.c.tenant_id, func.count()).where(vehicles.c.deleted_at.is_(None))
+                                   .group_by(vehicles.c.tenant_id)).all())
+        rows = conn.execute(select(tenants.c.id, tenants.c.key, tenants.c.name, tenants.c.created_at).order_by(tenants.c.id)).all()
+    return [{"id": row.id, "key": row.key, "name": row.name, "created_at": row.created_at,
+             "vehicles": counts.get(row.id, 0)} for row in rows]
@@ -9,38 +9,36 @@ from sqlalchemy.orm import Session
 # Add backend to path to import models
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'backend'))
 import database as db_mod
+import fleet_snapshot
+import settings_service
 
 load_dotenv(os.path.join(os.path.dirname(__file__), '..', 'backend', '.env'))
 
 def check_thresholds():
-    db = next(db_mod.get_db())
+    db_mod.init_db()
     try:
-        # Get SMTP settings
-        settings_rows = db.query(db_mod.Setting).all()
-        settings = {s.key: s.value for s in settings_rows}
-        
-        smtp_server = settings.get("SMTP_SERVER") or os.getenv("SMTP_SERVER")
-        smtp_port = int(settings.get("SMTP_PORT") or os.getenv("SMTP_PORT", 587))
-        smtp_user = settings.get("SMTP_USER") or os.getenv("SMTP_USER")
-        smtp_pass = settings.get("SMTP_PASS") or os.getenv("SMTP_PASS")
-        alert_email = settings.get("ALERT_EMAIL") or os.getenv("ALERT_EMAIL")
+        # Get SMTP settings (Settings page first, then environment)
+        smtp_server = settings_service.get_str("SMTP_SERVER")
+        smtp_port = settings_service.get_int("SMTP_PORT", 587)
+        smtp_user = settings_service.get_str("SMTP_USER")
+        smtp_pass = settings_service.get_str("SMTP_PASS")
+        alert_email = settings_service.get_str("ALERT_EMAIL")
 
-        # Get all active schedules
-        schedules = db.query(db_mod.MaintenanceSchedule).filter(db_mod.MaintenanceSchedule.is_active == True).all()
+        # Get all active schedules, with their vehicles, from the fleet snapshot (three queries)
+        schedules = list(fleet_snapshot.current().active_schedules())
         
         print(f"[{datetime.now()}] Checking {len(schedules)} active schedules in Cloud DB...")
         
-        for s in schedules:
-            vehicle = s.vehicle
+        for vehicle, s in schedules:
             current = vehicle.current_mileage if s.tracking_type == "miles" else vehicle.current_hours
             target = s.last_performed_value + s.interval_value
             remaining = target - current
             
             print(f"  - {vehicle.name} ({s.task_name}): {remaining:.1f} {s.tracking_type} remaining")
             
-            # Parse thresholds (e.g., "500, 250, 100")
+            # Thresholds come pre-parsed from the task (or the vehicle's override)
             try:
-                threshold_list = [float(t.strip()) for t in s.alert_thresholds.split(",")]
+                threshold_list = s.thresholds
                 # Simple logic: alert if we just crossed a threshold
                 # For real production, we'd track "last_alerted_threshold" to avoid spam
                 for t in sorted(threshold_list, reverse=True):
@@ -58,8 +56,6 @@ def check_thresholds():
 
     except Exception as e:
         print(f"Global alert error: {e}")
-    finally:
-        db.close()
 
 def send_real_email(host, port, user, password, to_email, vehicle, task, remaining, unit):
     subject = f"⚠️ Maintenance Alert: {vehicle}"